@@ -9,7 +9,8 @@ The ASVspoof Database access methods for Bob
 """
 
 from .query import Database
-from .models import Client, File, Protocol, ProtocolFiles
+from .models import Client, File, Protocol, ProtocolFiles, AudioInfo, AudioRecord, ClientRecord, FileRecord, \
+    ProtocolRecord, ContentHash
 
 
 def get_config():
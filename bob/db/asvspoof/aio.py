@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""An :py:mod:`asyncio` interface to the database, for services that must not
+block their event loop.
+
+The queries of :py:class:`AsyncDatabase` are run by a pool of worker threads,
+each with its own :py:class:`.Database`, since SQLite connections cannot be
+shared between threads. The number of queries running or waiting for a worker
+is bounded by a semaphore, so that bursts of requests queue up in the event
+loop instead of in the executor.
+"""
+
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .query import Database
+
+
+class AsyncDatabase(object):
+    """Awaitable queries on a :py:class:`.Database`, see the module
+    documentation
+
+    Files are always returned as :py:class:`.FileRecord` objects, which are
+    not bound to the session of the worker thread that loaded them.
+
+    Keyword parameters:
+
+    sqlite_file
+        [optional] The SQLite file to open, see :py:class:`.Database`.
+
+    backend
+        The backend of the databases of the workers, see :py:class:`.Database`.
+        With the ``snapshot`` backend, a single snapshot is shared by all
+        workers.
+
+    address
+        [optional] The address of the server of the ``remote`` backend, see
+        :py:class:`.Database`.
+
+    workers
+        The number of worker threads running the queries.
+
+    concurrency
+        [optional] The maximum number of queries running or waiting for a
+        worker at any time; further queries wait in the event loop. By default,
+        twice the number of workers.
+    """
+
+    def __init__(self, sqlite_file=None, backend='sql', address=None, workers=4, concurrency=None):
+        self._local = threading.local()
+        self.sqlite_file = sqlite_file
+        self.backend = backend
+        self.address = address
+        self.concurrency = concurrency or 2 * workers
+        self._semaphore = None
+        self._snapshot = None
+        if backend == 'snapshot':
+            # validates the file, and loads the snapshot once for all workers
+            self._snapshot = Database(sqlite_file, backend=backend)._snapshot
+        elif backend not in Database.backends():
+            raise ValueError("Invalid backend '%s'. Valid values are %s" % (backend, Database.backends()))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bob.db.asvspoof')
+
+    def _database(self):
+        """Returns the database of the current worker thread"""
+
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = Database(self.sqlite_file, backend=self.backend, snapshot=self._snapshot,
+                                           address=self.address)
+        return db
+
+    def _call(self, function, args, kwargs):
+        return function(self._database(), *args, **kwargs)
+
+    async def run(self, function, *args, **kwargs):
+        """Runs ``function(db, *args, **kwargs)`` in a worker thread, where
+        ``db`` is the :py:class:`.Database` of that thread, and returns its
+        result
+
+        The result must not hold objects bound to the session of ``db``, e.g.,
+        :py:class:`.File` objects.
+        """
+
+        if self._semaphore is None:
+            # created here, so that it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(self._call, function, args, kwargs))
+
+    async def objects(self, load_related=None, **object_query):
+        """Returns the :py:class:`.FileRecord` objects of the files returned by
+        :py:meth:`.Database.objects` for the given arguments"""
+
+        return await self.run(Database.objects, lightweight=True, load_related=load_related, **object_query)
+
+    async def count(self, **object_query):
+        """Returns the number of files, see :py:meth:`.Database.count`"""
+
+        return await self.run(Database.count, **object_query)
+
+    async def paths(self, ids, prefix='', suffix=''):
+        """Returns the full paths of the given file ids, see
+        :py:meth:`.Database.paths`"""
+
+        return await self.run(Database.paths, ids, prefix, suffix)
+
+    async def reverse(self, paths, match='exact'):
+        """Returns the ids of the files with the given stems, prefixes or
+        patterns, see :py:meth:`.Database.reverse`"""
+
+        return await self.run(Database.reverse, paths, match)
+
+    async def iterate(self, batch=1000, load_related=None, **object_query):
+        """Iterates asynchronously over the :py:class:`.FileRecord` objects
+        returned by :py:meth:`objects`
+
+        The event loop is given back after every ``batch`` files, so that
+        iterating over large results does not stall other tasks.
+        """
+
+        files = await self.objects(load_related=load_related, **object_query)
+        for start in range(0, len(files), batch):
+            for record in files[start:start + batch]:
+                yield record
+            await asyncio.sleep(0)
+
+    def close(self):
+        """Waits for the running queries and stops the worker threads
+
+        This blocks the calling thread, coroutines should await
+        :py:meth:`aclose` instead.
+        """
+
+        self._executor.shutdown(wait=True)
+
+    async def aclose(self):
+        """Waits for the running queries and stops the worker threads, without
+        blocking the event loop"""
+
+        # the shutdown waits in a thread of the default executor of the loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Reading of the audio files of the database from the ZIP or TAR archives of
+the corpus, without extracting them.
+
+An :py:class:`Archive` lists the members of an archive once, and keeps the
+position and size of each of them, indexed by the stem of the file it holds
+(see :py:attr:`.File.path`). The index is cached next to the archive, so that
+later openings only load a few arrays. Members are then read with positioned
+reads (``pread``) of the archive, which do not move a shared file position, so
+that any number of threads can read from the same archive at once:
+
+.. code-block:: python
+
+    with Archive('ASVspoof2015_development.zip') as archive:
+        audio = archive.load(f)
+        batch = archive.load_many(files, workers=16)
+
+Members of ZIP archives may be stored or deflated, only the stored ones can be
+read in part (e.g., with :py:meth:`Archive.load_segment`) without reading the
+whole member. TAR archives should not be compressed, since a compressed stream
+cannot be read from an arbitrary position.
+"""
+
+import io
+import os
+import zlib
+import struct
+import tarfile
+import zipfile
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from .pathindex import PathIndex
+from . import wav
+
+
+Member = collections.namedtuple('Member', ('offset', 'size', 'compressed', 'method'))
+"""The position of a member in an archive: the ``offset`` in bytes of its data,
+its ``size``, its ``compressed`` size and its compression ``method`` (0 for
+stored members, 8 for deflated ones)"""
+
+STORED, DEFLATED = 0, 8
+"""The compression methods of the members supported by :py:class:`Archive`"""
+
+_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+
+def _zip_members(filename, extension):
+    """Lists the members of a ZIP archive with the given extension, as tuples
+    of their name and :py:data:`Member`"""
+
+    retval = []
+    with zipfile.ZipFile(filename) as z, open(filename, 'rb') as f:
+        for info in z.infolist():
+            if info.filename.endswith('/') or not info.filename.endswith(extension):
+                continue
+            # the data follows the local header, whose extra field may differ from the central directory's
+            f.seek(info.header_offset)
+            local = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            if local[0] != b'PK\x03\x04':
+                raise ValueError("Archive `%s' has an invalid header for member `%s'" % (filename, info.filename))
+            method = info.compress_type if not info.flag_bits & 0x1 else -1
+            offset = info.header_offset + _LOCAL_HEADER.size + local[9] + local[10]
+            retval.append((info.filename, Member(offset, info.file_size, info.compress_size, method)))
+    return retval
+
+
+def _tar_members(filename, extension):
+    """Lists the regular members (and hard links to them) of an uncompressed
+    TAR archive with the given extension, as tuples of their name and
+    :py:data:`Member`"""
+
+    try:
+        t = tarfile.open(filename, 'r:')
+    except tarfile.ReadError:
+        raise ValueError("Archive `%s' is not a ZIP or uncompressed TAR archive" % filename)
+    retval = []
+    data = {}
+    with t:
+        for m in t:
+            if m.isreg():
+                data[m.name] = Member(m.offset_data, m.size, m.size, STORED)
+            elif m.islnk() and m.linkname in data:
+                # hard links share the data of the member they link to
+                data[m.name] = data[m.linkname]
+            else:
+                continue
+            if m.name.endswith(extension):
+                retval.append((m.name, data[m.name]))
+    return retval
+
+
+class _MemberFile(object):
+    """A read-only file object over a stored member, for
+    :py:func:`bob.db.asvspoof.wav.parse_header`"""
+
+    def __init__(self, archive, member):
+        self._archive = archive
+        self._member = member
+        self._position = 0
+
+    def read(self, size):
+        size = max(min(size, self._member.size - self._position), 0)
+        data = self._archive._pread(size, self._member.offset + self._position)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = offset + (self._position if whence == os.SEEK_CUR else 0)
+
+    def tell(self):
+        return self._position
+
+
+class Archive(object):
+    """The audio files of a ZIP or TAR archive of the corpus, see the module
+    documentation
+
+    Keyword parameters:
+
+    filename
+        The archive.
+
+    extension
+        The extension of the audio files in the archive, which is stripped from
+        the names of the members to get their stems. Other members are
+        ignored.
+
+    prefix
+        A prefix added to the names of the members to get their stems, if the
+        archive does not hold the top directories of the stems of the database.
+
+    cache
+        The file the index of the members is cached in. By default, next to the
+        archive, with the extension ``.index.npz``. If ``False``, the index is
+        not cached. The index is built again if the archive changed since it
+        was cached.
+
+    The audio files are given to the methods of the archive by their stems or
+    as :py:class:`.File` objects.
+    """
+
+    def __init__(self, filename, extension='.wav', prefix='', cache=None):
+        self.filename = filename
+        self.extension = extension
+        self.prefix = prefix
+        if cache is None:
+            cache = filename + '.index.npz'
+
+        stat = os.stat(filename)
+        signature = numpy.array([stat.st_size, int(stat.st_mtime)], dtype=numpy.int64)
+        arrays = self._load_index(cache, signature) if cache else None
+        if arrays is None:
+            arrays = self._build_index(signature)
+            if cache:
+                try:
+                    # written under another name first, so that readers never see a partial index
+                    temporary = '%s.%d.tmp' % (cache, os.getpid())
+                    with open(temporary, 'wb') as f:
+                        numpy.savez(f, **arrays)
+                    os.rename(temporary, cache)
+                except (IOError, OSError):
+                    # the archive may lie on read-only storage, the index is then built at each opening
+                    pass
+
+        self._members = numpy.stack([arrays['offset'], arrays['size'], arrays['compressed'], arrays['method']], 1)
+        offsets = arrays['name_offsets'].tolist()
+        blob = arrays['name_blob'].tobytes()
+        names = [blob[s:e].decode('utf-8') for s, e in zip(offsets[:-1], offsets[1:])]
+        self._index = PathIndex(names, numpy.arange(len(names)))
+        self._fd = os.open(filename, os.O_RDONLY)
+
+    def _load_index(self, cache, signature):
+        """Returns the arrays of the cached index, or ``None`` if there is none
+        or if it is out of date"""
+
+        if not os.path.exists(cache):
+            return None
+        with numpy.load(cache, allow_pickle=False) as data:
+            arrays = dict((k, data[k]) for k in data.files)
+        valid = (numpy.array_equal(arrays.get('signature'), signature) and
+                 str(arrays.get('options')) == '%s\n%s' % (self.extension, self.prefix))
+        return arrays if valid else None
+
+    def _build_index(self, signature):
+        """Lists the members of the archive and returns the arrays of the index"""
+
+        if zipfile.is_zipfile(self.filename):
+            members = _zip_members(self.filename, self.extension)
+        else:
+            members = _tar_members(self.filename, self.extension)
+
+        cut = len(self.extension)
+        names = [(self.prefix + k[:len(k) - cut]).encode('utf-8') for k, _ in members]
+        name_offsets = numpy.zeros(len(names) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(k) for k in names], out=name_offsets[1:])
+        values = numpy.array([m for _, m in members], dtype=numpy.int64).reshape(len(members), 4)
+        return {
+            'signature': signature,
+            'options': numpy.array('%s\n%s' % (self.extension, self.prefix)),
+            'name_offsets': name_offsets,
+            'name_blob': numpy.frombuffer(b''.join(names), dtype=numpy.uint8),
+            'offset': values[:, 0],
+            'size': values[:, 1],
+            'compressed': values[:, 2],
+            'method': values[:, 3],
+        }
+
+    def close(self):
+        """Closes the archive"""
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._index.find(getattr(key, 'path', key)) >= 0
+
+    def stems(self):
+        """Returns the sorted stems of the audio files of the archive"""
+
+        return self._index.stems()
+
+    def member(self, key):
+        """Returns the :py:data:`Member` holding the audio file of the given stem
+        or :py:class:`.File`, or raises a :py:exc:`KeyError`"""
+
+        stem = getattr(key, 'path', key)
+        position = self._index.find(stem)
+        if position < 0:
+            raise KeyError("File `%s' is not in archive `%s'" % (stem, self.filename))
+        return Member(*self._members[self._index.ids[position]].tolist())
+
+    def _pread(self, size, offset):
+        """Reads ``size`` bytes at ``offset`` of the archive"""
+
+        chunks = []
+        while size > 0:
+            chunk = os.pread(self._fd, size, offset)
+            if not chunk:
+                raise IOError("Archive `%s' is truncated" % self.filename)
+            chunks.append(chunk)
+            size -= len(chunk)
+            offset += len(chunk)
+        return b''.join(chunks)
+
+    def read(self, key):
+        """Returns the contents of the audio file of the given stem or
+        :py:class:`.File`, as bytes"""
+
+        member = self.member(key)
+        data = self._pread(member.compressed, member.offset)
+        if member.method == DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        if member.method != STORED:
+            raise ValueError("File `%s' of archive `%s' is encrypted or compressed with an unsupported method" %
+                             (getattr(key, 'path', key), self.filename))
+        return data
+
+    def open(self, key):
+        """Returns a file object over the contents of the audio file of the given
+        stem or :py:class:`.File`, e.g., for an audio library"""
+
+        return io.BytesIO(self.read(key))
+
+    def header(self, key):
+        """Returns the :py:data:`bob.db.asvspoof.wav.WavInfo` of the audio file
+        of the given stem or :py:class:`.File`, whose ``offset`` is relative to
+        the start of the member"""
+
+        member = self.member(key)
+        name = getattr(key, 'path', key)
+        if member.method == STORED:
+            return wav.parse_header(_MemberFile(self, member), member.size, name)
+        return wav.parse_header(self.open(key), member.size, name)
+
+    def load_segment(self, key, start, length):
+        """Loads a segment of the audio file of the given stem or
+        :py:class:`.File`, as :py:func:`bob.db.asvspoof.wav.read_segment`
+        does, reading only the frames of the segment from stored members"""
+
+        member = self.member(key)
+        name = getattr(key, 'path', key)
+        if start < 0 or length < 0:
+            raise ValueError("Invalid segment (%d, %d) of file `%s'" % (start, length, name))
+        if member.method == STORED:
+            info = wav.parse_header(_MemberFile(self, member), member.size, name)
+            start, end, first, last = wav.segment_range(info, start, length)
+            data = self._pread(last - first, member.offset + first)
+        else:
+            contents = self.read(key)
+            info = wav.parse_header(io.BytesIO(contents), member.size, name)
+            start, end, first, last = wav.segment_range(info, start, length)
+            data = contents[first:last]
+        if end == start:
+            return numpy.zeros((info.channels, 0))
+        return wav.decode_samples(data, info, name)
+
+    def load(self, key):
+        """Loads the whole audio file of the given stem or :py:class:`.File`,
+        see :py:meth:`load_segment`"""
+
+        # a single read of the member, instead of one per chunk header
+        contents = self.read(key)
+        name = getattr(key, 'path', key)
+        info = wav.parse_header(io.BytesIO(contents), len(contents), name)
+        if not info.samples:
+            return numpy.zeros((info.channels, 0))
+        start, end, first, last = wav.segment_range(info, 0, info.samples)
+        return wav.decode_samples(contents[first:last], info, name)
+
+    def load_many(self, keys, workers=8):
+        """Loads the audio files of the given stems or :py:class:`.File` objects
+        with a pool of threads, and returns them in the same order"""
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.load, keys))
+
+    def __repr__(self):
+        return "Archive('%s', %d files)" % (self.filename, len(self))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Indexes the length of the audio files of the database.
+
+The ``index`` command reads the headers of the audio files of all files of the
+database (with several threads, since it is bound by the latency of the file
+system) and stores their number of samples and sampling rate in the table of
+:py:class:`.AudioInfo`. The durations can then be used to filter, sort, batch
+and balance the files, see :py:meth:`.Database.objects`.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .models import File, AudioInfo
+from .wav import read_header
+
+
+def _try_header(filename):
+    """Returns the header of a WAV file and ``None``, or ``None`` and the
+    reason why it could not be read"""
+
+    try:
+        return read_header(filename), None
+    except (IOError, OSError, ValueError) as e:
+        return None, str(e)
+
+
+def read_headers(filenames, workers=8):
+    """Reads the headers of the given WAV files with a pool of threads
+
+    Yields, in the order of ``filenames``, tuples ``(info, error)`` with
+    either the :py:data:`bob.db.asvspoof.wav.WavInfo` of the file or the
+    reason why it could not be read.
+    """
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_try_header, filenames):
+            yield result
+
+
+def index_audio(session, directory, extension='.wav', workers=8, reindex=False, progress=None, batch=1000):
+    """Reads the headers of the audio files of the database and stores their
+    lengths in the table of :py:class:`.AudioInfo`
+
+    Keyword parameters:
+
+    session
+        A writable session to the database.
+
+    directory
+        The directory containing the audio files.
+
+    extension
+        The extension of the audio files.
+
+    workers
+        The number of threads reading headers.
+
+    reindex
+        If set, all files are indexed again, otherwise only those which are
+        not indexed yet.
+
+    progress
+        [optional] A :py:class:`bob.db.asvspoof.progress.Progress` accounting
+        for the indexed files.
+
+    batch
+        The number of rows inserted at once.
+
+    Returns the list of tuples ``(path, error)`` of the files that could not
+    be indexed.
+    """
+
+    AudioInfo.__table__.create(session.get_bind(), checkfirst=True)
+    if reindex:
+        session.query(AudioInfo).delete()
+
+    q = session.query(File.id, File.path).outerjoin(AudioInfo, AudioInfo.file_id == File.id)
+    files = q.filter(AudioInfo.file_id.is_(None)).order_by(File.path).all()
+    if progress is not None:
+        progress.total = len(files)
+        progress.begin('index', directory=directory)
+
+    failed = []
+    rows = []
+    filenames = (os.path.join(directory, k[1] + extension) for k in files)
+    for (id, path), (info, error) in zip(files, read_headers(filenames, workers)):
+        if info is None:
+            failed.append((path, error))
+        else:
+            rows.append({'file_id': id, 'samples': info.samples, 'rate': info.rate})
+        if len(rows) >= batch:
+            session.bulk_insert_mappings(AudioInfo, rows)
+            rows = []
+        if progress is not None:
+            progress.advance()
+    if rows:
+        session.bulk_insert_mappings(AudioInfo, rows)
+    session.commit()
+
+    if progress is not None:
+        progress.end()
+    return failed
+
+
+# Driver API
+# ==========
+
+def index(args):
+    """Reads and stores the length of the audio files"""
+
+    from bob.db.base.utils import session_try_nolock
+
+    dbfile = args.files[0]
+    s = session_try_nolock(args.type, dbfile)
+
+    progress = None
+    if args.progress:
+        from .progress import Progress
+        progress = Progress(output=sys.stdout, unit='files')
+
+    failed = index_audio(s, args.directory, args.extension, workers=args.jobs, reindex=args.reindex,
+                         progress=progress)
+
+    from .snapshot import Snapshot
+    if Snapshot.exists(dbfile):
+        # the snapshot holds the lengths too
+        Snapshot.from_session(s).save(dbfile)
+    s.close()
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    if progress is not None:
+        progress.write()
+    for path, error in failed:
+        output.write('Cannot index file "%s": %s\n' % (os.path.join(args.directory, path + args.extension), error))
+    if failed:
+        output.write('%d files could not be indexed\n' % len(failed))
+
+    return 1 if failed else 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "index" can use"""
+
+    from argparse import SUPPRESS
+
+    parser = subparsers.add_parser('index', help=index.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="the directory containing the audio files")
+    parser.add_argument('-e', '--extension', default='.wav',
+                        help="the extension of the audio files (defaults to '%(default)s')")
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help="the number of threads reading the audio files (defaults to %(default)s)")
+    parser.add_argument('-R', '--reindex', action='store_true', default=False,
+                        help="if set, all files are indexed again, instead of only the ones not indexed yet")
+    parser.add_argument('-p', '--progress', action='store_true', default=False,
+                        help="if set, the progress and the throughput of the indexing are reported")
+    parser.add_argument('--self-test', dest="selftest", default=False,
+                        action='store_true', help=SUPPRESS)
+
+    parser.set_defaults(func=index)  # action
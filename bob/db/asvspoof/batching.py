@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Grouping of files of similar lengths into batches, and loading of batches of
+fixed-length segments of their audio.
+"""
+
+import numpy
+
+
+def _samples(f):
+    if f.audio is None:
+        raise ValueError("File `%s' is not indexed, run 'bob_dbmanage.py asvspoof index' first" % f.path)
+    return f.audio.samples
+
+
+def bucketed_batches(files, max_frames, length=None, seed=None):
+    """Groups files of similar lengths into batches with a bounded number of
+    padded frames
+
+    The files are sorted by length and cut into consecutive batches, so that
+    the number of files of each batch times the length of its longest file
+    (i.e., the number of frames of the batch once padded) is at most
+    ``max_frames``. Files longer than ``max_frames`` get a batch of their own.
+
+    Keyword parameters:
+
+    files
+        The files to group, e.g., returned by :py:meth:`.Database.objects`
+        with ``load_related='audio'``, so that their lengths are loaded with
+        the files.
+
+    max_frames
+        The maximum number of frames of a padded batch.
+
+    length
+        [optional] A function returning the number of frames of a file. By
+        default, the number of samples of the audio of the file is used, see
+        :py:class:`.AudioInfo`.
+
+    seed
+        [optional] If set, the batches are shuffled with this seed. Otherwise,
+        they are returned from the shortest to the longest files.
+
+    Returns a list of batches, which are lists of files.
+    """
+
+    length = length or _samples
+    lengths = [length(f) for f in files]
+    # ties are broken by the position of the files, so that batches are deterministic
+    order = sorted(range(len(files)), key=lambda k: (lengths[k], k))
+
+    batches = []
+    batch = []
+    for k in order:
+        if batch and (len(batch) + 1) * lengths[k] > max_frames:
+            batches.append(batch)
+            batch = []
+        batch.append(files[k])
+    if batch:
+        batches.append(batch)
+
+    if seed is not None:
+        numpy.random.RandomState(seed).shuffle(batches)
+    return batches
+
+
+def random_segments(files, length, directory=None, extension='.wav', seed=None, workers=8, pad=True):
+    """Loads a random segment of the audio of each of the given files, e.g.,
+    the fixed-length crops of a training batch
+
+    Only the frames of the segments are read from disk, by a pool of threads,
+    see :py:func:`bob.db.asvspoof.wav.read_random_segments`.
+
+    Keyword parameters:
+
+    files
+        The files to load, e.g., a batch returned by :py:func:`bucketed_batches`.
+
+    length
+        The number of frames of the segments.
+
+    directory, extension
+        The directory and the extension of the audio files, see
+        :py:meth:`.File.make_path`.
+
+    seed
+        [optional] The seed drawing the starts of the segments.
+
+    workers
+        The number of threads reading the files.
+
+    pad
+        If set, the segments of files shorter than ``length`` are padded with
+        zeros, and the segments are returned as a single array of shape
+        ``(files, channels, length)``. Otherwise, a list of segments is returned.
+    """
+
+    from .wav import read_random_segments
+    segments = read_random_segments([f.make_path(directory, extension) for f in files], length, seed=seed,
+                                    workers=workers, pad=pad)
+    if pad:
+        return numpy.stack(segments) if segments else numpy.zeros((0, 1, length))
+    return segments
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Benchmarks the hot paths of the database interface on synthetic data.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+
+
+OBJECT_QUERIES = (
+    ('CM', 'real'),
+    ('CM', 'attack'),
+    ('ASV-male', 'real'),
+    ('ASV-male', 'attack'),
+    ('ASV-male', 'impostor'),
+    ('ASV-male', 'enroll'),
+    ('ASV-female', 'real'),
+    ('ASV-female', 'attack'),
+    ('ASV-female', 'impostor'),
+    ('ASV-female', 'enroll'),
+)
+"""The protocol and purpose combinations queried by the benchmark of
+:py:meth:`.Database.objects`, as in the package tests"""
+
+LOOKUP_SIZES = (1000, 10000, 100000)
+"""The number of inputs given to :py:meth:`.Database.reverse` and
+:py:meth:`.Database.paths`"""
+
+
+def _measure(func, repeat):
+    """Calls ``func`` ``repeat`` times and returns statistics on the wall times"""
+
+    times = []
+    for k in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'repeat': repeat,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+    }
+
+
+class _quiet(object):
+    """Silences the standard output of the benchmarked code"""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def bench_create(protodir, dbfile):
+    """Creates the database ``dbfile`` from the protocol files in ``protodir``
+    and returns the time it took, together with the time spent in each phase of
+    the creation"""
+
+    import argparse
+    from .create import create
+
+    report = dbfile + '.json'
+    args = argparse.Namespace(type='sqlite', files=[dbfile], recreate=True, verbose=0,
+                              protodir=protodir, samplesdir='wav', progress=False, report=report, no_snapshot=False)
+    with _quiet():
+        retval = _measure(lambda: create(args), 1)
+    with open(report) as f:
+        retval['phases'] = json.load(f)['phases']
+    os.unlink(report)
+    return retval
+
+
+def bench_objects(db, repeat):
+    """Measures the latency of :py:meth:`.Database.objects` for all
+    :py:data:`OBJECT_QUERIES`, with and without lightweight records"""
+
+    results = {}
+    for protocol, purpose in OBJECT_QUERIES:
+        name = 'objects.%s.%s' % (protocol, purpose)
+        results[name] = _measure(lambda: db.objects(protocol=protocol, purposes=purpose), repeat)
+        results[name + '.lightweight'] = _measure(
+            lambda: db.objects(protocol=protocol, purposes=purpose, lightweight=True), repeat)
+    return results
+
+
+def bench_lookups(db, repeat, sizes=LOOKUP_SIZES):
+    """Measures :py:meth:`.Database.reverse` and :py:meth:`.Database.paths` for
+    the given input sizes, sampling existing files with replacement"""
+
+    from .query import Database
+    from .models import File
+
+    files = db.session.query(File.id, File.path).all()
+    rng = random.Random(0)
+
+    results = {}
+    for size in sizes:
+        sample = [files[rng.randrange(len(files))] for k in range(size)]
+        paths = [k[1] for k in sample]
+        ids = [k[0] for k in sample]
+        # a fresh object per call, so cached indexes are part of the measurement
+        results['reverse.%d' % size] = _measure(lambda: Database(db.sqlite_file).reverse(paths), repeat)
+        results['paths.%d' % size] = _measure(lambda: Database(db.sqlite_file).paths(ids), repeat)
+    return results
+
+
+def bench_commands(dbfile, repeat):
+    """Measures the wall time of the ``dumplist`` and ``checkfiles`` commands"""
+
+    import argparse
+    from . import query
+    from .dumplist import dumplist
+    from .checkfiles import checkfiles
+
+    args = argparse.Namespace(protocol=None, support=None, group=None, purposes=None, gender=None,
+                              client=None, directory='', extension='.wav', selftest=True)
+
+    # the commands open the database installed with the package
+    installed = query.SQLITE_FILE
+    query.SQLITE_FILE = dbfile
+    try:
+        return {
+            'dumplist': _measure(lambda: dumplist(args), repeat),
+            'checkfiles': _measure(lambda: checkfiles(args), repeat),
+        }
+    finally:
+        query.SQLITE_FILE = installed
+
+
+def bench_import(repeat):
+    """Measures the time to import this package in a fresh interpreter"""
+
+    def run(statement):
+        subprocess.check_call([sys.executable, '-c', statement])
+
+    baseline = _measure(lambda: run('pass'), repeat)
+    retval = _measure(lambda: run('import bob.db.asvspoof'), repeat)
+    for key in ('min', 'median', 'mean', 'max'):
+        retval[key] = max(retval[key] - baseline['median'], 0.)
+    return {'import': retval}
+
+
+def run(clients=10, files_per_client=10, repeat=5, sizes=LOOKUP_SIZES, workdir=None):
+    """Runs the complete benchmark suite on a synthetic database
+
+    Keyword parameters:
+
+    clients, files_per_client
+        The size of the synthetic protocols, see
+        :py:func:`bob.db.asvspoof.synthetic.write_protocols`.
+
+    repeat
+        The number of times each measurement is repeated.
+
+    sizes
+        The number of inputs for the lookup benchmarks.
+
+    workdir
+        [optional] The directory in which the synthetic protocols and the database
+        are written. If not set, a temporary directory is used and removed
+        afterwards.
+
+    Returns a dictionary with the description of the environment and the
+    measured timings in seconds, which can be stored in JSON format.
+    """
+
+    from .query import Database
+    from .models import ProtocolFiles
+    from .synthetic import write_protocols
+    from .driver import Interface
+
+    tmpdir = workdir or tempfile.mkdtemp(prefix='asvspoof-bench-')
+    try:
+        protodir = os.path.join(tmpdir, 'protocols')
+        dbfile = os.path.join(tmpdir, 'db.sql3')
+        lines = write_protocols(protodir, clients=clients, files_per_client=files_per_client)
+
+        results = {'create': bench_create(protodir, dbfile)}
+        db = Database(dbfile)
+        results.update(bench_objects(db, repeat))
+        results.update(bench_lookups(db, repeat, sizes))
+        results.update(bench_commands(dbfile, repeat))
+        results.update(bench_import(repeat))
+        rows = db.session.query(ProtocolFiles).count()
+        del db
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmpdir)
+
+    try:
+        version = Interface().version()
+    except Exception:
+        version = None
+
+    return {
+        'package': 'bob.db.asvspoof',
+        'version': version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {'clients': clients, 'files_per_client': files_per_client, 'repeat': repeat,
+                       'lines': sum(lines.values()), 'rows': rows},
+        'results': results,
+    }
+
+
+def compare(baseline, results, output=sys.stdout):
+    """Writes the ratio of the median timings of two benchmark runs
+
+    Keyword parameters:
+
+    baseline, results
+        Dictionaries as returned by :py:func:`run`.
+
+    output
+        The stream to write to.
+    """
+
+    base = baseline['results']
+    for name in sorted(results['results']):
+        current = results['results'][name]['median']
+        if name in base and base[name]['median'] > 0:
+            ratio = current / base[name]['median']
+            output.write('%-32s %12.6f %12.6f %8.2fx\n' % (name, base[name]['median'], current, ratio))
+        else:
+            output.write('%-32s %12s %12.6f\n' % (name, '-', current))
+
+
+# Driver API
+# ==========
+
+def benchmark(args):
+    """Benchmarks the database interface on synthetic data"""
+
+    results = run(clients=args.clients, files_per_client=args.files_per_client,
+                  repeat=args.repeat, sizes=args.sizes)
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results, output)
+    else:
+        for name in sorted(results['results']):
+            output.write('%-32s %12.6f\n' % (name, results['results'][name]['median']))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "benchmark" can use"""
+
+    from argparse import SUPPRESS
+
+    parser = subparsers.add_parser('benchmark', help=benchmark.__doc__)
+
+    parser.add_argument('-c', '--clients', type=int, default=10,
+                        help="the number of synthetic clients per group (defaults to %(default)s)")
+    parser.add_argument('-f', '--files-per-client', type=int, default=10,
+                        help="the number of synthetic samples per client and attack (defaults to %(default)s)")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="the number of repetitions of each measurement (defaults to %(default)s)")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=list(LOOKUP_SIZES),
+                        help="the number of inputs for the reverse and path lookups (defaults to %(default)s)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="if given, the results are written into this file in JSON format")
+    parser.add_argument('-C', '--compare', metavar='FILE',
+                        help="if given, the results are compared to the ones of a previous run stored in this JSON file")
+    parser.add_argument('--self-test', dest="selftest", default=False,
+                        action='store_true', help=SUPPRESS)
+
+    parser.set_defaults(func=benchmark)  # action
+
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Bitmap indexes of the files of each protocol, purpose, attack type, group
+and gender.
+
+The bitmaps are computed when the snapshot is compiled (see
+:py:mod:`bob.db.asvspoof.snapshot`) and stored with it, packed with
+:py:func:`numpy.packbits`, so that each bitmap takes one bit per file. Bit
+``k`` of a bitmap is set if the file in the ``k``-th row of the snapshot, i.e.,
+the ``k``-th file sorted by path, has the value of the bitmap. Selections
+combining several values are then bitwise operations on a few kilobytes,
+instead of several queries and set operations on objects:
+
+.. code-block:: python
+
+    cm = db.bitmap('protocol', 'CM')
+    both = cm & db.bitmap('protocol', 'AS') & db.bitmap('group', 'eval')
+    attacks = db.bitmap('protocol', 'ASV-female') & db.bitmap('purpose', 'attack') - db.bitmap('attacktype', 'S10')
+    print(len(attacks), attacks.paths(directory, '.wav'))
+"""
+
+import numpy
+
+from .models import Client, File, make_paths
+
+
+KINDS = ('protocol', 'purpose', 'attacktype', 'group', 'gender')
+"""The attributes of the files with one bitmap per value"""
+
+_POPCOUNT = numpy.array([bin(k).count('1') for k in range(256)], dtype=numpy.int64)
+
+
+def compile_bitmaps(arrays):
+    """Computes the bitmaps of all values of :py:data:`KINDS` from the arrays
+    of a snapshot
+
+    Returns the arrays ``bitmap_name``, with names such as ``protocol:CM``, and
+    ``bitmap_bits``, with one row of packed bits per bitmap.
+    """
+
+    size = len(arrays['file_id'])
+    names = []
+    masks = []
+
+    offsets = arrays['protocol_offsets']
+    link_file = arrays['link_file']
+    for k, name in enumerate(arrays['protocol_name'].tolist()):
+        mask = numpy.zeros(size, dtype=bool)
+        mask[link_file[offsets[k]:offsets[k + 1]]] = True
+        names.append('protocol:%s' % name)
+        masks.append(mask)
+
+    clients = arrays['file_client']
+    genders = numpy.where(clients >= 0, numpy.asarray(arrays['client_gender'])[numpy.maximum(clients, 0)], -1)
+    for kind, codes, choices in (('purpose', arrays['file_purpose'], File.purpose_choices),
+                                 ('attacktype', arrays['file_attacktype'], File.attacktype_choices),
+                                 ('group', arrays['file_group'], File.group_choices),
+                                 ('gender', genders, Client.gender_choices)):
+        for code, value in enumerate(choices):
+            names.append('%s:%s' % (kind, value))
+            masks.append(codes == code)
+
+    bits = numpy.packbits(numpy.array(masks, dtype=bool).reshape(len(masks), size), axis=1)
+    return {'bitmap_name': numpy.array(names, dtype=str), 'bitmap_bits': bits}
+
+
+class Bitmap(object):
+    """A set of files of a snapshot, as packed bits, see the module
+    documentation
+
+    Bitmaps of the same snapshot are combined with ``&`` (and), ``|`` (or),
+    ``-`` (and not) and ``^`` (exclusive or), and complemented with ``~``.
+    ``len()`` gives the number of files of the bitmap.
+
+    Keyword parameters:
+
+    bits
+        The packed bits, one per file of the snapshot.
+
+    snapshot
+        The :py:class:`bob.db.asvspoof.snapshot.Snapshot` the bits refer to.
+    """
+
+    def __init__(self, bits, snapshot):
+        self.bits = bits
+        self.snapshot = snapshot
+
+    def _combine(self, other, operation):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        if other.snapshot is not self.snapshot:
+            raise ValueError("Cannot combine bitmaps of different snapshots")
+        return Bitmap(operation(self.bits, other.bits), self.snapshot)
+
+    def __and__(self, other):
+        return self._combine(other, numpy.bitwise_and)
+
+    def __or__(self, other):
+        return self._combine(other, numpy.bitwise_or)
+
+    def __xor__(self, other):
+        return self._combine(other, numpy.bitwise_xor)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def __invert__(self):
+        bits = ~self.bits
+        padding = -len(self.snapshot) % 8
+        if padding and len(bits):
+            # the padding bits of the last byte stay cleared
+            bits[-1] &= (0xFF << padding) & 0xFF
+        return Bitmap(bits, self.snapshot)
+
+    def __len__(self):
+        return int(_POPCOUNT[self.bits].sum())
+
+    def __bool__(self):
+        return bool(self.bits.any())
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return (isinstance(other, Bitmap) and other.snapshot is self.snapshot and
+                numpy.array_equal(self.bits, other.bits))
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def rows(self):
+        """Returns the rows of the files of the bitmap in the snapshot, sorted
+        by path"""
+
+        return numpy.flatnonzero(numpy.unpackbits(self.bits, count=len(self.snapshot)))
+
+    def ids(self):
+        """Returns the ids of the files of the bitmap, sorted by path"""
+
+        return self.snapshot.file_id[self.rows()].tolist()
+
+    def paths(self, directory=None, extension=None):
+        """Returns the paths of the files of the bitmap, sorted by path, with the
+        given directory and extension, see :py:meth:`.File.make_path`"""
+
+        return make_paths(self.snapshot.paths(self.rows()), directory, extension)
+
+    def objects(self):
+        """Returns the :py:class:`.FileRecord` objects of the files of the
+        bitmap, sorted by path"""
+
+        return self.snapshot.records(self.rows())
+
+    def __repr__(self):
+        return "Bitmap(%d of %d files)" % (len(self), len(self.snapshot))
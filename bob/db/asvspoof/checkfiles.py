@@ -19,7 +19,9 @@ def checkfiles(args):
     from .query import Database
     db = Database()
 
-    r = db.objects(
+    r = db.bulk_paths(
+        directory=args.directory,
+        extension=args.extension,
         protocol=args.protocol,
         support=args.support,
         groups=args.group,
@@ -32,7 +34,7 @@ def checkfiles(args):
     good = []
     bad = []
     for f in r:
-        if os.path.exists(f.make_path(args.directory, args.extension)):
+        if os.path.exists(f):
             good.append(f)
         else:
             bad.append(f)
@@ -45,7 +47,7 @@ def checkfiles(args):
 
     if bad:
         for f in bad:
-            output.write('Cannot find file "%s"\n' % (f.make_path(args.directory, args.extension),))
+            output.write('Cannot find file "%s"\n' % (f,))
         output.write('%d files (out of %d) were not found at "%s"\n' % \
                      (len(bad), len(r), args.directory))
 
@@ -11,12 +11,17 @@ from __future__ import print_function
 import fnmatch
 
 import glob
+import sys
+import time
 
 from .models import *
 import os.path
 
 
-def add_file(session, protocol, purpose, attack_type, path, group, client_id='undefined', gender='undefined'):
+def add_file(session, protocol, purpose, attack_type, path, group, client_id='undefined', gender='undefined',
+             progress=None):
+    if progress is not None: start = time.perf_counter()
+
     db_client = session.query(Client).filter(Client.id == client_id).first()
     if db_client == None:
         db_client = Client(client_id, gender, group)
@@ -35,7 +40,11 @@ def add_file(session, protocol, purpose, attack_type, path, group, client_id='un
     # link file and the protocol
     session.add(ProtocolFiles(db_protocol, db_file))
 
-def add_four_columns(session, samplesdir, filename, protocol, group, splitline, gender):
+    if progress is not None:
+        progress.add('insert', time.perf_counter() - start)
+        progress.advance()
+
+def add_four_columns(session, samplesdir, filename, protocol, group, splitline, gender, progress=None):
     client = splitline[0]
     samplesfolder = splitline[0]
     samplename = splitline[1]
@@ -67,10 +76,11 @@ def add_four_columns(session, samplesdir, filename, protocol, group, splitline,
                          "it is data from human, impostor, or it's spoofed." %
                          (filename, " ".join(splitline)))
     sample_path = os.path.join(samplesdir, samplesfolder, samplename)
-    add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender)
+    add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender,
+             progress=progress)
 
 
-def add_enrollments(session, samplesdir, filename, protocol, group, line, gender):
+def add_enrollments(session, samplesdir, filename, protocol, group, line, gender, progress=None):
     # the delimiter is ','
     splitline = (line.strip()).split(',')
     client = splitline[0]
@@ -88,9 +98,10 @@ def add_enrollments(session, samplesdir, filename, protocol, group, line, gender
                              "with 'D' or with 'E'." %
                              (filename, samplename))
 
-        add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender)
+        add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender,
+                 progress=progress)
 
-def add_one_column(session, protocol, group, line):
+def add_one_column(session, protocol, group, line, progress=None):
     client = 'undefined'
     samplesfolder = line[0:6]
     purpose = 'attack'
@@ -99,12 +110,20 @@ def add_one_column(session, protocol, group, line):
     gender = 'undefined'
     samplesdir = os.path.join('eva_release', 'wav')
     sample_path = os.path.join(samplesdir, samplesfolder, samplename)
-    add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender)
+    add_file(session, protocol, purpose, attack_type, sample_path, group, client_id=client, gender=gender,
+             progress=progress)
 
-def add_protocol_samples(session, protodir, samplesdir, filename, protocol, group, gender):
+def add_protocol_samples(session, protodir, samplesdir, filename, protocol, group, gender, progress=None):
     # read and add file to the database
+    if progress is not None: start = time.perf_counter()
     with open(os.path.join(protodir, filename)) as f:
         lines = f.readlines()
+    if progress is not None:
+        # the time of parsing is the time spent on the lines minus the one of the insertions
+        progress.add('read', time.perf_counter() - start)
+        start = time.perf_counter()
+        inserted = progress.phases.get('insert', 0.)
+
     for line in lines:
         splitline = (line.strip()).split(' ')
 
@@ -113,19 +132,40 @@ def add_protocol_samples(session, protodir, samplesdir, filename, protocol, grou
             samplesdir = os.path.join('ASVspoof2015_development', 'wav')
             if group == 'eval':
                 # samplesdir is different for eval files, so we don't use it in the call
-                add_one_column(session, protocol, group, splitline[0])
+                add_one_column(session, protocol, group, splitline[0], progress)
                 continue
 
         # in ASV protocol enrollment file has 6 columns and different structure
         if group == 'enroll':
             # have to add enrollment data separately
-            add_enrollments(session, samplesdir, filename, protocol, group, splitline[0], gender)
+            add_enrollments(session, samplesdir, filename, protocol, group, splitline[0], gender, progress)
         else:
             # all the other files have four column format
-            add_four_columns(session, samplesdir, filename, protocol, group, splitline, gender)
+            add_four_columns(session, samplesdir, filename, protocol, group, splitline, gender, progress)
+
+    if progress is not None:
+        progress.add('parse', time.perf_counter() - start - (progress.phases.get('insert', 0.) - inserted))
+
+def count_rows(protocol_file_list):
+    """Returns the number of files that the given protocol files link to their
+    protocol, without touching the database"""
+
+    retval = 0
+    for filename in protocol_file_list:
+        enrollment = 'enrolment' in os.path.basename(filename)
+        with open(filename) as f:
+            for line in f:
+                # enrollment lines list the client followed by its samples
+                retval += line.count(',') if enrollment else 1
+    return retval
+
+def init_database(session, protodir, samplesdir, protocol_file_list, progress=None, verbose=0):
+    """Defines all available protocols
 
-def init_database(session, protodir, samplesdir, protocol_file_list):
-    """Defines all available protocols"""
+    If a :py:class:`bob.db.asvspoof.progress.Progress` is given, it is advanced
+    for every file linked to a protocol and one task per protocol file is
+    reported. The protocol files are only listed if ``verbose`` is set.
+    """
 
     for filename in protocol_file_list:
         # skip hidden files
@@ -135,12 +175,14 @@ def init_database(session, protodir, samplesdir, protocol_file_list):
         # if os.path.isdir(os.path.join(protodir, filename)):
         #     continue
 
-        print ("Processing file %s" % filename)
+        if verbose:
+            print("Processing file %s" % filename)
         # remove extension
         fname = os.path.splitext(os.path.basename(filename.strip()))[0]
         # parse the name
         s = fname.split('_')
-        print ("Basename %s" % fname)
+        if verbose:
+            print("Basename %s" % fname)
 
         group = s[1]  #train, develop, or evaluation
         protocol = s[0].upper()
@@ -168,13 +210,22 @@ def init_database(session, protodir, samplesdir, protocol_file_list):
         if group == 'enrolment':
             group = 'enroll'
 
+        if progress is not None:
+            progress.begin(os.path.basename(filename), protocol=protocol, group=group, gender=gender)
+
         # add protocol only if it does not exist
         db_protocol = session.query(Protocol).filter(Protocol.name == protocol).first()
         if db_protocol == None:
             session.add(Protocol(protocol))
             session.flush()
         # add samples from the protocol file to the database
-        add_protocol_samples(session, protodir, samplesdir, filename, protocol, group, gender)
+        add_protocol_samples(session, protodir, samplesdir, filename, protocol, group, gender, progress)
+
+        if progress is not None:
+            # flushes the pending insertions, so that they are accounted to this file
+            with progress.phase('flush'):
+                session.flush()
+            progress.end()
 
 
 def create_tables(args):
@@ -201,6 +252,9 @@ def create(args):
         if args.verbose and os.path.exists(dbfile):
             print('unlinking %s...' % dbfile)
         if os.path.exists(dbfile): os.unlink(dbfile)
+        from .snapshot import snapshot_files
+        for filename in snapshot_files(dbfile):
+            if os.path.exists(filename): os.unlink(filename)
 
     if not os.path.exists(os.path.dirname(dbfile)):
         os.makedirs(os.path.dirname(dbfile))
@@ -209,21 +263,45 @@ def create(args):
     create_tables(args)
     s = session_try_nolock(args.type, args.files[0], echo=(args.verbose >= 2))
 
-    # ASV protocol files
-    protocol_file_list = glob.glob(os.path.join(args.protodir, 'ASV_*'))
-    init_database(s, args.protodir, args.samplesdir, protocol_file_list)
+    # ASV, CM and AS protocol files
+    protocol_file_lists = [glob.glob(os.path.join(args.protodir, k)) for k in ('ASV_*', 'cm_*', 'as_*')]
 
-    # CM protocol files
-    protocol_file_list = glob.glob(os.path.join(args.protodir, 'cm_*'))
-    init_database(s, args.protodir, args.samplesdir, protocol_file_list)
+    progress = None
+    if args.progress or args.report:
+        from .progress import Progress
+        total = sum(count_rows(k) for k in protocol_file_lists)
+        progress = Progress(total=total, output=sys.stdout if args.progress else None)
 
-    # AS protocol files
-    protocol_file_list = glob.glob(os.path.join(args.protodir, 'as_*'))
-    init_database(s, args.protodir, args.samplesdir, protocol_file_list)
+    for protocol_file_list in protocol_file_lists:
+        init_database(s, args.protodir, args.samplesdir, protocol_file_list, progress, args.verbose)
 
-    s.commit()
+    if progress is None:
+        s.commit()
+    else:
+        with progress.phase('commit'):
+            s.commit()
+
+    if not args.no_snapshot:
+        # compiles the read-only snapshot shipped next to the database
+        from .snapshot import Snapshot
+        if args.verbose:
+            print('writing snapshot of %s...' % dbfile)
+        if progress is None:
+            Snapshot.from_session(s).save(dbfile)
+        else:
+            with progress.phase('snapshot'):
+                Snapshot.from_session(s).save(dbfile)
     s.close()
 
+    if progress is not None:
+        report = progress.report()
+        if args.progress:
+            progress.write()
+            for phase in sorted(report['phases']):
+                print('%-8s %10.3f s' % (phase, report['phases'][phase]))
+        if args.report:
+            progress.save(args.report)
+
     return 0
 
 
@@ -237,6 +315,16 @@ def add_command(subparsers):
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="Do SQL operations in a verbose way")
 
+    parser.add_argument('-p', '--progress', action='store_true', default=False,
+                        help="If set, I'll report the progress and the throughput of the creation")
+    parser.add_argument('-r', '--report', action='store', default=None, metavar='FILE',
+                        help="If given, a report with the number of rows, the throughput and the timings of "
+                             "every protocol file is written into this file in JSON format")
+
+    parser.add_argument('-S', '--no-snapshot', action='store_true', default=False,
+                        help="If set, I'll not compile the binary snapshot of the database used by the "
+                             "'snapshot' backend")
+
     parser.add_argument('-D', '--samplesdir', action='store',
                         default='wav',
                         metavar='DIR',
@@ -92,8 +92,12 @@ class Interface(BaseInterface):
 
     def files(self):
         from pkg_resources import resource_filename
-        raw_files = ('db.sql3',)
-        return [resource_filename(__name__, k) for k in raw_files]
+        from .snapshot import Snapshot, snapshot_files
+        sqlite_file = resource_filename(__name__, 'db.sql3')
+        # the snapshot is optional, it is shipped with the SQLite file if it was compiled
+        if Snapshot.exists(sqlite_file):
+            return [sqlite_file] + snapshot_files(sqlite_file)
+        return [sqlite_file]
 
     def type(self):
         return 'sqlite'
@@ -116,6 +120,30 @@ class Interface(BaseInterface):
         from .checkfiles import add_command as checkfiles_command
         checkfiles_command(subparsers)
 
+        # get the "benchmark" action from a submodule
+        from .benchmark import add_command as benchmark_command
+        benchmark_command(subparsers)
+
+        # get the "synthesize" action from a submodule
+        from .synthetic import add_command as synthesize_command
+        synthesize_command(subparsers)
+
+        # get the "index" action from a submodule
+        from .audioindex import add_command as index_command
+        index_command(subparsers)
+
+        # get the "verify" action from a submodule
+        from .verify import add_command as verify_command
+        verify_command(subparsers)
+
+        # get the "map" action from a submodule
+        from .mapping import add_command as map_command
+        map_command(subparsers)
+
+        # get the "serve" action from a submodule
+        from .service import add_command as serve_command
+        serve_command(subparsers)
+
         # adds the "reverse" command
         reverse_command(subparsers)
 
@@ -18,7 +18,11 @@ def dumplist(args):
   from .query import Database
   db = Database()
 
-  r = db.objects(
+  # the whole list is built at once, as a single string
+  r = db.bulk_paths(
+      directory=args.directory,
+      extension=args.extension,
+      output='buffer',
       protocol=args.protocol,
       support=args.support,
       groups=args.group,
@@ -31,8 +35,7 @@ def dumplist(args):
     from bob.db.base.utils import null
     output = null()
 
-  for f in r:
-    output.write('%s\n' % (f.make_path(args.directory, args.extension),))
+  output.write(r)
 
   return 0
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A registry of the SQLAlchemy engines of the SQLite files opened by the
+current process.
+
+A :py:class:`.Database` is constructed in many places (the driver commands,
+their argument parsers, configuration files of experiments, ...). Instead of
+opening a new engine each time, all :py:class:`.Database` objects of a thread
+reading the same SQLite file share its engine, and only create a session bound
+to it. Each thread has its own engine, since the pool of the engines of
+``bob.db.base`` keeps a single connection per thread for a few threads only,
+and closes the connections of the other threads beyond them. The entry of a
+file also caches values computed from the file that do not change while it is
+open, e.g., the names of the protocols, for all threads.
+
+The entry of a file is replaced if the file changed since it was opened (e.g.,
+recreated by ``bob_dbmanage.py asvspoof create``). The engines of a replaced
+entry are not disposed, since the sessions still bound to them use their
+connections: they are closed once these sessions and engines are garbage
+collected. The registry is emptied in child processes after a ``fork``, since
+SQLite connections cannot be shared with them.
+"""
+
+import os
+import threading
+
+from sqlalchemy.orm import sessionmaker
+
+from bob.db.base import utils
+
+
+_lock = threading.Lock()
+_entries = {}
+
+
+class Entry(object):
+    """The engines of an SQLite file and the values cached for it
+
+    Keyword parameters:
+
+    dbtype
+        The type of the database, see ``bob.db.base.utils``.
+
+    sqlite_file
+        The SQLite file.
+
+    signature
+        The inode, size and modification time of the file when it was opened.
+    """
+
+    def __init__(self, dbtype, sqlite_file, signature):
+        self.dbtype = dbtype
+        self.sqlite_file = sqlite_file
+        self.signature = signature
+        self.values = {}
+        """The values cached for the file, by name"""
+        self._local = threading.local()
+
+    def _opened(self):
+        """Returns the engine and the session maker of the current thread, which
+        are opened with ``bob.db.base.utils.session_try_readonly`` on first use"""
+
+        local = self._local
+        if getattr(local, 'engine', None) is None:
+            session = utils.session_try_readonly(self.dbtype, self.sqlite_file)
+            local.engine = session.bind
+            local.sessionmaker = sessionmaker(bind=session.bind)
+            session.close()
+        return local
+
+    @property
+    def engine(self):
+        """The SQLAlchemy engine of the file for the current thread"""
+
+        return self._opened().engine
+
+    def session(self):
+        """Returns a new session bound to the engine of the current thread"""
+
+        return self._opened().sessionmaker()
+
+
+def _signature(filename):
+    stat = os.stat(filename)
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def acquire(dbtype, sqlite_file):
+    """Returns the :py:class:`Entry` of the given file, which is created if the
+    file is not open yet, or if it changed since it was opened"""
+
+    key = os.path.realpath(sqlite_file)
+    signature = _signature(key)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry.signature != signature:
+            # the previous entry is left to the sessions still using its engines
+            entry = _entries[key] = Entry(dbtype, sqlite_file, signature)
+    return entry
+
+
+def clear():
+    """Empties the registry; the engines are closed once the sessions using
+    them are garbage collected"""
+
+    with _lock:
+        _entries.clear()
+
+
+def _after_fork():
+    # the engines belong to the parent process, which still uses them
+    global _lock
+    _lock = threading.Lock()
+    _entries.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Tables of files as :py:class:`pandas.DataFrame` objects, see
+:py:meth:`.Database.dataframe`.
+
+The frames are built column by column from the result of a single ``SELECT``
+of the needed columns (or from the arrays of the snapshot), without creating
+an object per file. The columns with few values are categorical, stored as
+small integer codes into their categories, so that a frame of all links of the
+database between files and protocols takes a few tens of megabytes, most of
+them for the paths.
+
+:py:mod:`pandas` is not a dependency of this package, it is only needed by
+these functions.
+"""
+
+import numpy
+
+from .models import Client, File
+
+
+COLUMNS = ('id', 'path', 'protocol', 'group', 'purpose', 'attacktype', 'client', 'gender')
+"""The columns of the frames, with one row per file and protocol"""
+
+AUDIO_COLUMNS = ('samples', 'rate')
+"""The columns of the lengths of the audio files, see
+:py:class:`.AudioInfo`, which are ``-1`` and ``0`` for files that are not
+indexed"""
+
+CATEGORICAL = ('protocol', 'group', 'purpose', 'attacktype', 'client', 'gender')
+"""The categorical columns of the frames"""
+
+
+def _pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("Building data frames requires pandas, which can be installed with 'pip install pandas'")
+    return pandas
+
+
+def categories(protocols, clients):
+    """Returns the categories of the categorical columns, given the names of
+    the protocols and the ids of the clients of the database"""
+
+    return {
+        'protocol': list(protocols),
+        'group': list(File.group_choices),
+        'purpose': list(File.purpose_choices),
+        'attacktype': list(File.attacktype_choices),
+        'client': list(clients),
+        'gender': list(Client.gender_choices),
+    }
+
+
+def build(columns, categories):
+    """Returns a data frame of the given columns
+
+    Keyword parameters:
+
+    columns
+        A dictionary of the columns of :py:data:`COLUMNS` (and optionally
+        :py:data:`AUDIO_COLUMNS`) as arrays, where the categorical columns hold
+        the codes of their values, ``-1`` for missing values.
+
+    categories
+        The categories of the categorical columns, see :py:func:`categories`.
+    """
+
+    pandas = _pandas()
+    data = {}
+    for name in COLUMNS + AUDIO_COLUMNS:
+        if name not in columns:
+            continue
+        if name in CATEGORICAL:
+            data[name] = pandas.Categorical.from_codes(columns[name], categories=categories[name])
+        else:
+            data[name] = columns[name]
+    return pandas.DataFrame(data, columns=[k for k in COLUMNS + AUDIO_COLUMNS if k in data])
+
+
+def _codes(values, categories):
+    index = dict((v, i) for i, v in enumerate(categories))
+    return numpy.fromiter((index.get(v, -1) for v in values), dtype=numpy.int32, count=len(values))
+
+
+def from_rows(rows, categories, audio=False):
+    """Returns the columns of the given rows of the ``SELECT`` of
+    :py:meth:`.Database.dataframe`, which has the columns of
+    :py:data:`COLUMNS` in order (and of :py:data:`AUDIO_COLUMNS` if ``audio``
+    is set), for :py:func:`build`"""
+
+    values = list(zip(*rows)) if rows else [()] * (len(COLUMNS) + (len(AUDIO_COLUMNS) if audio else 0))
+    columns = {
+        'id': numpy.array(values[0], dtype=numpy.int64),
+        'path': numpy.array(values[1], dtype=object),
+    }
+    for k, name in enumerate(COLUMNS[2:], 2):
+        columns[name] = _codes(values[k], categories[name])
+    if audio:
+        samples, rate = values[len(COLUMNS):]
+        columns['samples'] = numpy.array([-1 if k is None else k for k in samples], dtype=numpy.int64)
+        columns['rate'] = numpy.array([0 if k is None else k for k in rate], dtype=numpy.int32)
+    return columns
+
+
+def from_records(records, protocols):
+    """Returns the rows of the given :py:class:`.FileRecord` objects, loaded
+    with their clients and protocols, and with their audio lengths if indexed,
+    for each of their protocols among ``protocols``, as :py:func:`from_rows`
+    expects them"""
+
+    protocols = set(protocols)
+    rows = []
+    for f in records:
+        info = getattr(f, 'audio', None)
+        audio = (info.samples, info.rate) if info is not None else (None, None)
+        for p in f.protocols:
+            if p.name in protocols:
+                rows.append((f.id, f.path, p.name, f.group, f.purpose, f.attacktype, f.client_id, f.client.gender) +
+                            audio)
+    return rows
+
+
+def from_snapshot(snapshot, rows, protocols, audio=False):
+    """Returns the columns of the links between the files of the given rows of
+    a :py:class:`.Snapshot` and the given protocols, sorted by path and by
+    protocol, for :py:func:`build`"""
+
+    link_protocol = numpy.repeat(numpy.arange(len(snapshot.protocol_id)), numpy.diff(snapshot.protocol_offsets))
+    selected = numpy.zeros(len(snapshot), dtype=bool)
+    selected[rows] = True
+    wanted = numpy.isin(snapshot.protocol_name, list(protocols))
+    keep = selected[snapshot.link_file] & wanted[link_protocol]
+    link_file = snapshot.link_file[keep].astype(numpy.int64)
+    link_protocol = link_protocol[keep]
+    order = numpy.lexsort((link_protocol, link_file))
+    link_file = link_file[order]
+
+    file_client = snapshot.file_client[link_file]
+    columns = {
+        'id': snapshot.file_id[link_file],
+        'path': numpy.array(snapshot.paths(link_file), dtype=object),
+        'protocol': link_protocol[order],
+        'group': snapshot.file_group[link_file],
+        'purpose': snapshot.file_purpose[link_file],
+        'attacktype': snapshot.file_attacktype[link_file],
+        'client': file_client,
+        'gender': numpy.where(file_client >= 0, snapshot.client_gender[numpy.maximum(file_client, 0)], -1),
+    }
+    if audio:
+        columns['samples'] = snapshot.file_samples[link_file]
+        columns['rate'] = snapshot.file_rate[link_file]
+    return columns
+
+
+def slices(columns, chunksize):
+    """Yields the consecutive parts of ``chunksize`` rows of the given columns"""
+
+    size = len(columns['id'])
+    for start in range(0, size, chunksize):
+        yield dict((k, v[start:start + chunksize]) for k, v in columns.items())
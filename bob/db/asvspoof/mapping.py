@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Runs a function or a command on each file of a query, with a pool of
+processes and resumable checkpoints.
+
+The output of each file is written under a temporary name and renamed to the
+path :py:meth:`.File.save` would use once it is complete, so that an
+interrupted run never leaves truncated outputs behind. The ids of the files
+that are done are appended to a journal. A run that is started again, e.g.,
+after the job was killed or preempted, skips the files listed in the journal
+and the files whose output already exists, and only processes the others.
+Files that fail are reported and not journaled, so that they are tried again
+by the next run.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shlex
+import importlib
+import subprocess
+import multiprocessing
+
+
+JOURNAL = 'map.journal'
+"""The name of the journal in the output directory, by default"""
+
+
+class Command(object):
+    """Runs an external command on a file, as the function of
+    :py:func:`map_files`
+
+    Keyword parameters:
+
+    template
+        The command line, in which ``{input}`` is replaced by the path of the
+        (audio) file, ``{output}`` by the path of the output to write, and
+        ``{path}`` and ``{id}`` by the stem and the id of the file, e.g.,
+        ``'extract --wav {input} --out {output}'``. The command is run without
+        a shell, after its arguments are split, so that paths with spaces stay
+        single arguments.
+
+    directory, extension
+        The directory and the extension of the input files, see
+        :py:meth:`.File.make_path`.
+    """
+
+    def __init__(self, template, directory=None, extension='.wav'):
+        self.template = template
+        self.arguments = shlex.split(template)
+        self.directory = directory
+        self.extension = extension
+
+    def __call__(self, f, output):
+        values = {'input': f.make_path(self.directory, self.extension), 'output': output, 'path': f.path,
+                  'id': f.id}
+        subprocess.check_call([k.format(**values) for k in self.arguments])
+
+    def __repr__(self):
+        return "Command(%r)" % self.template
+
+
+def load_function(name):
+    """Returns the function given as ``module:function``, e.g.,
+    ``mypackage.features:extract``"""
+
+    module, _, function = name.partition(':')
+    if not module or not function:
+        raise ValueError("Invalid function '%s', it should be given as 'module:function'" % name)
+    return getattr(importlib.import_module(module), function)
+
+
+def read_journal(filename):
+    """Returns the set of ids of the files listed in a journal, which is empty
+    if the journal does not exist"""
+
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, 'rt') as f:
+        # the last line may be truncated if the run was killed while writing it
+        return set(int(k) for k in f if k.endswith('\n') and k.strip())
+
+
+def _temporary(output, extension):
+    """Returns the temporary name of an output, with the same extension, which
+    selects the format of the output for most writers"""
+
+    base = output[:len(output) - len(extension)] if extension else output
+    return '%s.part%d%s' % (base, os.getpid(), extension)
+
+
+def _apply(task):
+    """Runs the function on a file, writes its output and returns the id of
+    the file and ``None``, or the reason why it failed"""
+
+    func, f, output, extension = task
+    temporary = _temporary(output, extension)
+    try:
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        data = func(f, temporary)
+        if data is not None:
+            import bob.io.base
+            bob.io.base.save(data, temporary)
+        if not os.path.exists(temporary):
+            raise IOError("no output was written to '%s'" % temporary)
+        os.rename(temporary, output)
+        return f.id, None
+    except Exception as e:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return f.id, '%s: %s' % (type(e).__name__, e)
+
+
+def map_files(files, func, output_dir, extension='.hdf5', workers=4, chunksize=16, journal=None, progress=None):
+    """Runs a function on each of the given files, see the module documentation
+
+    Keyword parameters:
+
+    files
+        The files to process, e.g., returned by :py:meth:`.Database.objects`
+        with ``lightweight=True``, since they are sent to the worker processes.
+
+    func
+        The function called as ``func(file, output)`` on each file, which either
+        writes the output of the file to the path ``output``, or returns it to be
+        saved there as :py:meth:`.File.save` does. It should be defined at the
+        top level of a module, so that it can be sent to the worker processes,
+        or be a :py:class:`Command`.
+
+    output_dir, extension
+        The directory and the extension of the outputs, see
+        :py:meth:`.File.make_path`.
+
+    workers
+        The number of worker processes. If ``1`` or less, the files are
+        processed in the calling process.
+
+    chunksize
+        The number of files sent to a worker process at once.
+
+    journal
+        [optional] The journal of the files that are done. By default,
+        :py:data:`JOURNAL` in the output directory.
+
+    progress
+        [optional] A :py:class:`bob.db.asvspoof.progress.Progress` accounting
+        for the processed files.
+
+    Returns the list of tuples ``(path, error)`` of the files that failed.
+    """
+
+    if journal is None:
+        journal = os.path.join(output_dir, JOURNAL)
+    done = read_journal(journal)
+    if os.path.dirname(journal) and not os.path.isdir(os.path.dirname(journal)):
+        os.makedirs(os.path.dirname(journal))
+
+    failed = []
+    with open(journal, 'at') as log:
+        tasks = []
+        for f in files:
+            if f.id in done:
+                continue
+            output = f.make_path(output_dir, extension)
+            if os.path.exists(output):
+                # written by a run which was stopped before journaling it
+                log.write('%d\n' % f.id)
+                continue
+            tasks.append((func, f, output, extension))
+        log.flush()
+
+        if progress is not None:
+            progress.total = len(tasks)
+            progress.begin('map', output_dir=output_dir)
+
+        paths = dict((k[1].id, k[1].path) for k in tasks)
+        pool = None
+        if workers > 1 and tasks:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(_apply, tasks, chunksize)
+        else:
+            results = (_apply(k) for k in tasks)
+        try:
+            for id, error in results:
+                if error is None:
+                    log.write('%d\n' % id)
+                    log.flush()
+                else:
+                    failed.append((paths[id], error))
+                if progress is not None:
+                    progress.advance()
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    if progress is not None:
+        progress.end()
+    return failed
+
+
+# Driver API
+# ==========
+
+def run(args):
+    """Runs a function or a command on each file of a query, resuming an interrupted run"""
+
+    from .query import Database
+
+    if (args.function is None) == (args.command is None):
+        raise ValueError("Either a function (--function) or a command (--command) should be given")
+    if args.function is not None:
+        func = load_function(args.function)
+    else:
+        func = Command(args.command, args.directory, args.extension)
+
+    progress = None
+    if args.progress:
+        from .progress import Progress
+        progress = Progress(output=sys.stdout, unit='files')
+
+    db = Database()
+    failed = db.map(func, dict(protocol=args.protocol, support=args.support, groups=args.group,
+                               purposes=args.purposes, clients=args.client),
+                    workers=args.jobs, output_dir=args.output_dir, extension=args.output_extension,
+                    journal=args.journal, chunksize=args.chunksize, progress=progress)
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    if progress is not None:
+        progress.write()
+    for path, error in failed:
+        output.write('Cannot process file "%s": %s\n' % (path, error))
+    if failed:
+        output.write('%d files could not be processed, run the command again to retry them\n' % len(failed))
+
+    return 1 if failed else 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "map" can use"""
+
+    from argparse import SUPPRESS
+
+    parser = subparsers.add_parser('map', help=run.__doc__)
+
+    from .query import Database
+
+    db = Database()
+
+    if not db.is_valid():
+        protocols = ('waiting', 'for', 'database', 'creation')
+        clients = tuple()
+    else:
+        protocols = [k.name for k in db.protocols()]
+        clients = [k.id for k in db.clients()]
+
+    parser.add_argument('-f', '--function', default=None,
+                        help="the function to run on each file, as 'module:function', called with the file and the "
+                             "path of its output")
+    parser.add_argument('-m', '--command', default=None,
+                        help="the command to run on each file, in which {input}, {output}, {path} and {id} are "
+                             "replaced by the paths of the audio file and of the output, the stem and the id of the "
+                             "file, e.g., 'extract {input} {output}'")
+    parser.add_argument('-o', '--output-dir', dest="output_dir", required=True,
+                        help="the directory of the outputs")
+    parser.add_argument('-E', '--output-extension', dest="output_extension", default='.hdf5',
+                        help="the extension of the outputs (defaults to '%(default)s')")
+    parser.add_argument('-d', '--directory', dest="directory", default='',
+                        help="the directory containing the audio files, for {input} (defaults to '%(default)s')")
+    parser.add_argument('-e', '--extension', dest="extension", default='.wav',
+                        help="the extension of the audio files, for {input} (defaults to '%(default)s')")
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help="the number of worker processes (defaults to %(default)s)")
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help="the number of files sent to a worker process at once (defaults to %(default)s)")
+    parser.add_argument('-J', '--journal', default=None,
+                        help="the journal of the files that are done (defaults to '%s' in the output directory)" %
+                             JOURNAL)
+    parser.add_argument('-c', '--purpose', dest="purposes", default=None,
+                        help="if given, limits the run to a particular subset of the data that corresponds to the "
+                             "given purpose (defaults to '%(default)s')", choices=db.purposes())
+    parser.add_argument('-g', '--group', dest="group", default=None,
+                        help="if given, limits the run to the files belonging to a particular protocol group. "
+                             "(defaults to '%(default)s')", choices=db.groups())
+    parser.add_argument('-s', '--support', dest="support", default=None,
+                        help="if given, limits the run to the files using this type of attack support. "
+                             "(defaults to '%(default)s')", choices=db.attack_supports())
+    parser.add_argument('-x', '--protocol', dest="protocol", default=None,
+                        help="if given, limits the run to the files of a given protocol. "
+                             "(defaults to '%(default)s')", choices=protocols)
+    parser.add_argument('-C', '--client', dest="client", default=None, type=str,
+                        help="if given, limits the run to a particular client (defaults to '%(default)s')",
+                        choices=clients)
+    parser.add_argument('-p', '--progress', action='store_true', default=False,
+                        help="if set, the progress and the throughput of the run are reported")
+    parser.add_argument('--self-test', dest="selftest", default=False,
+                        action='store_true', help=SUPPRESS)
+
+    parser.set_defaults(func=run)  # action
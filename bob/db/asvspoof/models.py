@@ -64,6 +64,36 @@ class Protocol(Base):
     def __repr__(self):
         return "Protocol('%s')" % (self.name)
 
+def make_paths(stems, directory=None, extension=None):
+    """Returns the paths of many files at once, as :py:meth:`File.make_path`
+    returns the path of one file
+
+    The directory and the extension are added to all stems in a single
+    :py:meth:`str.join`, instead of one :py:func:`os.path.join` per file.
+
+    Keyword parameters:
+
+    stems
+        The paths of the files in the database (e.g., :py:attr:`File.path`).
+
+    directory
+        An optional directory name that will be prefixed to the returned paths.
+
+    extension
+        An optional extension that will be suffixed to the returned paths.
+
+    Returns a list of strings.
+    """
+
+    stems = list(stems)
+    # os.path.join(directory, stem) is the directory, a separator if needed, then the stem
+    prefix = os.path.join(directory, '') if directory else ''
+    suffix = extension or ''
+    if not stems or not (prefix or suffix):
+        return stems
+    return (prefix + (suffix + '\n' + prefix).join(stems) + suffix).split('\n')
+
+
 class File(Base):
     """Generic file container"""
 
@@ -107,6 +137,12 @@ class File(Base):
         self.path = path
         self.group = group
 
+    @property
+    def protocols(self):
+        """The :py:class:`Protocol` objects this file belongs to"""
+
+        return tuple(k.protocol for k in self.protocolfiles)
+
     def __repr__(self):
         return "File('%s')" % self.path
 
@@ -182,6 +218,34 @@ class File(Base):
         """
         return bob.io.base.load(self.make_path(directory, extension))
 
+    def load_segment(self, start, length, directory=None, extension='.wav'):
+        """Loads a segment of the audio of this file, reading only the
+        requested frames from disk
+
+        Keyword parameters:
+
+        start
+            The first frame (sample) of the segment.
+
+        length
+            The number of frames of the segment. The segment is shorter if the
+            audio ends before.
+
+        directory
+            [optional] If not empty or None, this directory is prefixed to the final
+            file destination
+
+        extension
+            [optional] The extension of the audio file, which must be a PCM or
+            floating point WAV file.
+
+        Returns an array with one row per channel, see
+        :py:func:`bob.db.asvspoof.wav.read_segment`.
+        """
+
+        from .wav import read_segment
+        return read_segment(self.make_path(directory, extension), start, length)
+
     def save(self, data, directory=None, extension='.hdf5'):
         """Saves the input data at the specified location and using the given
         extension.
@@ -235,3 +299,172 @@ class ProtocolFiles(Base):
     def __repr__(self):
         return "ProtocolFiles('%s, %s')" % (self.protocol_id, self.file_id)
 
+
+class AudioInfo(Base):
+    """The length of the audio of a file, as read from its header by
+    ``bob_dbmanage.py asvspoof index``"""
+
+    __tablename__ = 'audioinfo'
+
+    file_id = Column(Integer, ForeignKey('file.id'), primary_key=True)
+    """The identifier of the file"""
+
+    samples = Column(Integer)
+    """The number of samples (per channel) of the audio"""
+
+    rate = Column(Integer)
+    """The sampling rate of the audio, in Hz"""
+
+    # for Python
+    file = relationship(File, backref=backref('audio', uselist=False))
+    """A direct link to the file, which refers back to this object as ``audio``"""
+
+    def __init__(self, file_id, samples, rate):
+        self.file_id = file_id
+        self.samples = samples
+        self.rate = rate
+
+    @property
+    def duration(self):
+        """The duration of the audio, in seconds"""
+
+        return float(self.samples) / self.rate
+
+    def __repr__(self):
+        return "AudioInfo('%s', %d, %d)" % (self.file_id, self.samples, self.rate)
+
+
+class ContentHash(Base):
+    """The size and the hash of the contents of the audio file of a file, as
+    recorded by ``bob_dbmanage.py asvspoof verify --record``"""
+
+    __tablename__ = 'contenthash'
+
+    file_id = Column(Integer, ForeignKey('file.id'), primary_key=True)
+    """The identifier of the file"""
+
+    size = Column(Integer)
+    """The size of the audio file, in bytes"""
+
+    digest = Column(String(64))
+    """The hexadecimal digest of the contents of the audio file"""
+
+    # for Python
+    file = relationship(File, backref=backref('content_hash', uselist=False))
+    """A direct link to the file, which refers back to this object as ``content_hash``"""
+
+    def __init__(self, file_id, size, digest):
+        self.file_id = file_id
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return "ContentHash('%s', %d, '%s')" % (self.file_id, self.size, self.digest)
+
+
+class ClientRecord(object):
+    """A lightweight, read-only copy of a :py:class:`Client`, which is not
+    bound to a database session"""
+
+    __slots__ = ('id', 'gender', 'group')
+
+    def __init__(self, id, gender, group):
+        self.id = id
+        self.gender = gender
+        self.group = group
+
+    def __eq__(self, other):
+        return isinstance(other, ClientRecord) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "Client('%s', '%s', '%s')" % (self.id, self.gender, self.group)
+
+
+class ProtocolRecord(object):
+    """A lightweight, read-only copy of a :py:class:`Protocol`, which is not
+    bound to a database session"""
+
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return "Protocol('%s')" % (self.name)
+
+
+class AudioRecord(object):
+    """A lightweight, read-only copy of an :py:class:`AudioInfo`, which is not
+    bound to a database session"""
+
+    __slots__ = ('samples', 'rate')
+
+    def __init__(self, samples, rate):
+        self.samples = samples
+        self.rate = rate
+
+    @property
+    def duration(self):
+        """The duration of the audio, in seconds"""
+
+        return float(self.samples) / self.rate
+
+    def __repr__(self):
+        return "AudioInfo(%d, %d)" % (self.samples, self.rate)
+
+
+class FileRecord(object):
+    """A lightweight, read-only copy of a :py:class:`File`, which is not bound
+    to a database session
+
+    It provides the same attributes as :py:class:`File`, except for the
+    ``protocolfiles`` relationship, and the same methods. The attribute
+    ``client`` is a :py:class:`ClientRecord` and the attribute ``protocols`` a
+    tuple of :py:class:`ProtocolRecord` objects, if they were loaded, or
+    ``None``. The attribute ``audio`` is an :py:class:`AudioRecord`, if it was
+    loaded and the file is indexed, or ``None``. Two records are equal if they
+    refer to the same file.
+    """
+
+    __slots__ = ('id', 'path', 'purpose', 'attacktype', 'group', 'client_id', 'client', 'protocols', 'audio')
+
+    def __init__(self, id, path, purpose, attacktype, group, client_id, client=None, protocols=None):
+        self.id = id
+        self.path = path
+        self.purpose = purpose
+        self.attacktype = attacktype
+        self.group = group
+        self.client_id = client_id
+        self.client = client
+        self.protocols = protocols
+        self.audio = None
+
+    def __eq__(self, other):
+        return isinstance(other, FileRecord) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "File('%s')" % self.path
+
+    # the methods of File which only rely on the attributes path and purpose
+    make_path = File.make_path
+    audiofile = File.audiofile
+    is_real = File.is_real
+    is_attack = File.is_attack
+    is_impostor = File.is_impostor
+    is_enroll = File.is_enroll
+    load = File.load
+    load_segment = File.load_segment
+    save = File.save
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A compact, sorted dictionary of the file stems of the database.
+
+The stems of the files repeat a few directories (e.g., ``wav/T2/``) hundreds
+of thousands of times. A :py:class:`PathIndex` stores each directory once, and
+for each file only the code of its directory and its base name, in a single
+byte blob. The files are sorted by stem, so that the files of a directory, or
+more generally the files whose stem starts with a given prefix, are a range of
+positions found with two binary searches, instead of a ``LIKE`` scan of the
+whole table or of a dictionary of all stems.
+"""
+
+import re
+import bisect
+import fnmatch
+
+import numpy
+
+
+MATCHES = ('exact', 'prefix', 'glob')
+"""The ways :py:meth:`PathIndex.lookup` matches the given stems"""
+
+_WILDCARD = re.compile(r'[*?\[]')
+
+
+class _Stems(object):
+    """A read-only sequence of the sorted stems of a :py:class:`PathIndex`,
+    for the :py:mod:`bisect` module"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, position):
+        return self._index.stem(position)
+
+
+class PathIndex(object):
+    """The file stems of the database, stored once per directory and sorted,
+    see the module documentation
+
+    Keyword parameters:
+
+    stems
+        The stems of the files, e.g., ``wav/T2/T2_1000001``.
+
+    ids
+        The ids of the files, in the same order.
+    """
+
+    def __init__(self, stems, ids):
+        stems = list(stems)
+        order = sorted(range(len(stems)), key=stems.__getitem__)
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)[numpy.array(order, dtype=numpy.int64)]
+        """The ids of the files, sorted by stem"""
+
+        # the directories, with their trailing separator, are stored once
+        splits = [stems[k].rpartition('/') for k in order]
+        self.directories = sorted(set(k[0] + k[1] for k in splits))
+        """The sorted directories of the stems, with a trailing ``/`` (or
+        empty, for stems without directory)"""
+
+        codes = dict((k, i) for i, k in enumerate(self.directories))
+        self.codes = numpy.array([codes[k[0] + k[1]] for k in splits], dtype=numpy.int32)
+        """The index in :py:attr:`directories` of the directory of each file"""
+
+        names = [k[2].encode('utf-8') for k in splits]
+        self.offsets = numpy.zeros(len(names) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(k) for k in names], out=self.offsets[1:])
+        self.blob = b''.join(names)
+        """The base names of the files, concatenated in a single blob delimited
+        by :py:attr:`offsets`"""
+
+        self._stems = _Stems(self)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Builds the index of all files of a :py:class:`.Snapshot`"""
+
+        rows = numpy.arange(len(snapshot))
+        return cls(snapshot.paths(rows), snapshot.file_id)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def stem(self, position):
+        """Returns the stem of the file at the given (sorted) position"""
+
+        name = self.blob[self.offsets[position]:self.offsets[position + 1]]
+        return self.directories[self.codes[position]] + name.decode('utf-8')
+
+    def stems(self, start=0, stop=None):
+        """Returns the stems of the files between the given positions"""
+
+        stop = len(self) if stop is None else stop
+        directories = self.directories
+        blob = self.blob
+        offsets = self.offsets[start:stop + 1].tolist()
+        return [directories[c] + blob[s:e].decode('utf-8')
+                for c, s, e in zip(self.codes[start:stop].tolist(), offsets[:-1], offsets[1:])]
+
+    def range(self, prefix):
+        """Returns the positions ``(start, stop)`` of the files whose stem
+        starts with ``prefix``"""
+
+        if not prefix:
+            return 0, len(self)
+        start = bisect.bisect_left(self._stems, prefix)
+        # the stems starting with the prefix are followed by those from its successor on
+        stop = bisect.bisect_left(self._stems, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        return start, stop
+
+    def find(self, stem):
+        """Returns the position of the file with the given stem, or ``-1``"""
+
+        position = bisect.bisect_left(self._stems, stem)
+        if position < len(self) and self.stem(position) == stem:
+            return position
+        return -1
+
+    def glob(self, pattern):
+        """Returns the positions of the files whose stem matches the given
+        shell-style pattern (see :py:mod:`fnmatch`, where ``*`` also matches
+        ``/``)
+
+        Only the range of the files starting with the part of the pattern
+        before its first wildcard is scanned.
+        """
+
+        wildcard = _WILDCARD.search(pattern)
+        if wildcard is None:
+            position = self.find(pattern)
+            return [position] if position >= 0 else []
+        start, stop = self.range(pattern[:wildcard.start()])
+        match = re.compile(fnmatch.translate(pattern)).match
+        return [start + k for k, stem in enumerate(self.stems(start, stop)) if match(stem)]
+
+    def lookup(self, patterns, match='exact'):
+        """Returns the ids of the files matching the given stems
+
+        Keyword parameters:
+
+        patterns
+            The stems, prefixes or patterns to look up.
+
+        match
+            How the stems of the files are matched, one of :py:data:`MATCHES`:
+            ``'exact'`` for the files with the given stems (unknown stems are
+            skipped), ``'prefix'`` for the files whose stem starts with any of
+            the given prefixes (e.g., ``wav/D18/``), and ``'glob'`` for the files
+            whose stem matches any of the given shell-style patterns (e.g.,
+            ``wav/D1?/*``).
+
+        Returns a list of ids: for each of the ``patterns`` in turn, the ids of
+        its files, sorted by stem.
+        """
+
+        if match not in MATCHES:
+            raise ValueError("Invalid match '%s'. Valid values are %s" % (match, MATCHES))
+        retval = []
+        for pattern in patterns:
+            if match == 'exact':
+                position = self.find(pattern)
+                if position >= 0:
+                    retval.append(int(self.ids[position]))
+            elif match == 'prefix':
+                start, stop = self.range(pattern)
+                retval += self.ids[start:stop].tolist()
+            else:
+                retval += self.ids[self.glob(pattern)].tolist()
+        return retval
+
+    def nbytes(self):
+        """Returns the approximate number of bytes used by the index"""
+
+        return (self.ids.nbytes + self.codes.nbytes + self.offsets.nbytes + len(self.blob) +
+                sum(len(k) + 49 for k in self.directories))
+
+    def __repr__(self):
+        return "PathIndex(%d files in %d directories)" % (len(self), len(self.directories))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Optional instrumentation of the queries run by :py:class:`.Database`.
+
+Instrumentation is disabled by default. It is enabled for all databases opened
+in a process by setting the environment variable ``BOB_DB_ASVSPOOF_PROFILE``
+to a value other than ``0``, or by setting ``BOB_DB_ASVSPOOF_SLOW_QUERY`` to
+a threshold in seconds above which queries are logged. It can also be enabled
+for a single database with :py:meth:`.Database.profile` or temporarily with
+:py:meth:`.Database.slow_queries`.
+"""
+
+import os
+import time
+import weakref
+import logging
+import collections
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VARIABLE = 'BOB_DB_ASVSPOOF_PROFILE'
+"""The environment variable enabling the instrumentation"""
+
+SLOW_QUERY_VARIABLE = 'BOB_DB_ASVSPOOF_SLOW_QUERY'
+"""The environment variable setting the threshold of slow queries, in seconds"""
+
+
+def from_environment():
+    """Returns a :py:class:`Profiler` if the instrumentation is enabled through
+    the environment, ``None`` otherwise"""
+
+    threshold = os.environ.get(SLOW_QUERY_VARIABLE)
+    if threshold:
+        return Profiler(threshold=float(threshold))
+    if os.environ.get(PROFILE_VARIABLE, '0') not in ('', '0'):
+        return Profiler()
+    return None
+
+
+class _NullCall(object):
+    """The measurement of a call when instrumentation is disabled"""
+
+    def validated(self):
+        pass
+
+    def done(self, rows):
+        pass
+
+
+NULL_CALL = _NullCall()
+
+
+class _Call(object):
+    """The measurement of a single call of a :py:class:`.Database` method"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.sql_time = profiler.sql_time
+        self.start = self.validation = time.perf_counter()
+
+    def validated(self):
+        """Marks the end of the validation of the parameters"""
+
+        self.sql_time = self.profiler.sql_time
+        self.validation = time.perf_counter()
+
+    def done(self, rows):
+        """Marks the end of the call, which returned ``rows`` results"""
+
+        end = time.perf_counter()
+        execute = self.profiler.sql_time - self.sql_time
+        self.profiler.record(self.name, rows, validate=self.validation - self.start,
+                             execute=execute, hydrate=max(end - self.validation - execute, 0.),
+                             total=end - self.start)
+
+
+class Profiler(object):
+    """Collects timings of the :py:class:`.Database` methods and of the SQL
+    statements executed by its session
+
+    The time of each call is split into three phases: ``validate`` (checking
+    the parameters and building the query), ``execute`` (running the SQL
+    statements on the database) and ``hydrate`` (fetching the rows and building
+    the returned objects).
+
+    Keyword parameters:
+
+    threshold
+        [optional] If set, calls and SQL statements lasting longer than this
+        number of seconds are logged as warnings.
+
+    statements
+        The number of most recent SQL statements that are kept.
+    """
+
+    PHASES = ('validate', 'execute', 'hydrate', 'total')
+
+    def __init__(self, threshold=None, statements=100):
+        self.threshold = threshold
+        self.session = self.engine = None
+        # engines are shared by all databases of a process, and so may be listened to by several profilers
+        self._key = 'bob.db.asvspoof.start.%d' % id(self)
+        # the connections of the session, the statements run by the other sessions on the engine are ignored
+        self._connections = weakref.WeakSet()
+        self.statements = collections.deque(maxlen=statements)
+        self.reset()
+
+    def reset(self):
+        """Clears all collected timings"""
+
+        self.calls = {}
+        self.sql_count = 0
+        self.sql_time = 0.
+        self.statements.clear()
+
+    def attach(self, session):
+        """Listens to the statements executed by the given SQLAlchemy session
+
+        The statements are collected from the engine of the session, which may
+        be shared with other sessions, for the connections of the transactions
+        of this session only.
+        """
+
+        from sqlalchemy import event
+
+        self.detach()
+        event.listen(session, 'after_begin', self._after_begin)
+        # the connection of the current transaction, which is begun if needed
+        self._connections.add(session.connection())
+        engine = session.get_bind()
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        self.session = session
+        self.engine = engine
+
+    def detach(self):
+        """Stops listening to the session given to :py:meth:`attach`"""
+
+        from sqlalchemy import event
+
+        if self.engine is not None:
+            event.remove(self.session, 'after_begin', self._after_begin)
+            event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+            event.remove(self.engine, 'after_cursor_execute', self._after_execute)
+            self.session = self.engine = None
+            self._connections.clear()
+
+    def _after_begin(self, session, transaction, connection):
+        self._connections.add(connection)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if conn in self._connections:
+            conn.info.setdefault(self._key, []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if conn not in self._connections:
+            return
+        duration = time.perf_counter() - conn.info[self._key].pop()
+        self.sql_count += 1
+        self.sql_time += duration
+        self.statements.append((statement, duration))
+        if self.threshold is not None and duration > self.threshold:
+            logger.warning("Slow SQL statement (%.3f s): %s", duration, statement)
+
+    def call(self, name):
+        """Starts the measurement of a call of the method ``name``"""
+
+        return _Call(self, name)
+
+    def record(self, name, rows, **phases):
+        """Records the timings of a finished call"""
+
+        stats = self.calls.get(name)
+        if stats is None:
+            stats = self.calls[name] = dict([(k, 0.) for k in self.PHASES], calls=0, rows=0)
+        stats['calls'] += 1
+        stats['rows'] += rows
+        for key in self.PHASES:
+            stats[key] += phases[key]
+        if self.threshold is not None and phases['total'] > self.threshold:
+            logger.warning("Slow call of Database.%s (%.3f s, %d rows; validate %.3f s, execute %.3f s, "
+                           "hydrate %.3f s)", name, phases['total'], rows, phases['validate'],
+                           phases['execute'], phases['hydrate'])
+
+    def snapshot(self):
+        """Returns a copy of the collected timings, see :py:meth:`.Database.stats`"""
+
+        return {
+            'calls': dict((k, dict(v)) for k, v in self.calls.items()),
+            'sql': {'count': self.sql_count, 'time': self.sql_time},
+            'statements': list(self.statements),
+        }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Progress reporting and throughput metrics for long running commands.
+"""
+
+from __future__ import print_function
+
+import json
+import time
+import contextlib
+
+
+class Progress(object):
+    """Reports the progress of a command processing items in a sequence of
+    tasks (e.g., the lines of several protocol files) and collects its timings
+
+    The progress is written at most every ``interval`` seconds to ``output``,
+    with the throughput and the estimated time to completion. The timings of
+    the tasks and of named phases (e.g., ``parse`` or ``commit``) are summarized
+    by :py:meth:`report`.
+
+    Keyword parameters:
+
+    total
+        [optional] The total number of items, used to estimate the time to
+        completion.
+
+    output
+        [optional] The stream to write the progress to. If not set, nothing is
+        written and the timings are only collected.
+
+    interval
+        The minimum number of seconds between two progress lines.
+
+    unit
+        The name of the processed items, used in the progress lines.
+    """
+
+    def __init__(self, total=None, output=None, interval=5., unit='rows'):
+        self.total = total
+        self.output = output
+        self.interval = interval
+        self.unit = unit
+        self.count = 0
+        self.phases = {}
+        self.tasks = []
+        self.task = None
+        self.start = self.last = time.perf_counter()
+
+    def begin(self, name, **info):
+        """Starts a new task, described by ``name`` and any other information
+        that should be part of the report"""
+
+        self.end()
+        self.task = dict(info, name=name, count=0, phases={})
+        self.task_start = time.perf_counter()
+
+    def end(self):
+        """Finishes the current task, if any"""
+
+        if self.task is None:
+            return
+        seconds = time.perf_counter() - self.task_start
+        self.task['seconds'] = seconds
+        self.task['throughput'] = self.task['count'] / seconds if seconds > 0 else 0.
+        self.tasks.append(self.task)
+        self.task = None
+
+    def advance(self, count=1):
+        """Accounts for ``count`` processed items"""
+
+        self.count += count
+        if self.task is not None:
+            self.task['count'] += count
+        if self.output is not None:
+            now = time.perf_counter()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.write(now)
+
+    def add(self, phase, seconds):
+        """Adds ``seconds`` to the time spent in ``phase``"""
+
+        self.phases[phase] = self.phases.get(phase, 0.) + seconds
+        if self.task is not None:
+            self.task['phases'][phase] = self.task['phases'].get(phase, 0.) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager measuring the time spent in its block as the phase
+        ``name``"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def write(self, now=None):
+        """Writes a progress line"""
+
+        elapsed = (now or time.perf_counter()) - self.start
+        throughput = self.count / elapsed if elapsed > 0 else 0.
+        line = '%d %s' % (self.count, self.unit)
+        if self.total:
+            line += ' of %d (%.1f%%)' % (self.total, 100. * self.count / self.total)
+        line += ', %.0f %s/s, elapsed %s' % (throughput, self.unit, _duration(elapsed))
+        if self.total and throughput > 0:
+            line += ', ETA %s' % _duration(max(self.total - self.count, 0) / throughput)
+        if self.task is not None:
+            line += ' [%s]' % self.task['name']
+        print(line, file=self.output)
+        self.output.flush()
+
+    def report(self):
+        """Finishes the current task and returns a dictionary with the total and
+        per-task counts, timings and throughputs"""
+
+        self.end()
+        seconds = time.perf_counter() - self.start
+        return {
+            'unit': self.unit,
+            'count': self.count,
+            'seconds': seconds,
+            'throughput': self.count / seconds if seconds > 0 else 0.,
+            'phases': dict(self.phases),
+            'tasks': list(self.tasks),
+        }
+
+    def save(self, filename):
+        """Writes the :py:meth:`report` in JSON format into ``filename``"""
+
+        with open(filename, 'wt') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+def _duration(seconds):
+    """Formats a duration in seconds as ``[h:]mm:ss``"""
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+    return '%02d:%02d' % (minutes, seconds)
@@ -7,14 +7,51 @@
 asvspoof attack database in the most obvious ways.
 """
 
-from bob.db.base import utils
+import math
+import contextlib
+import numpy
+from sqlalchemy import MetaData, bindparam, distinct, func
+from sqlalchemy.orm import contains_eager, selectinload
+
 from .models import *
 from .driver import Interface
+from .snapshot import Snapshot
+from . import engines
+from . import profiling
+from . import sharding
 
 INFO = Interface()
 
 SQLITE_FILE = INFO.files()[0]
 
+RECORD_COLUMNS = (File.id, File.path, File.purpose, File.attacktype, File.group, File.client_id)
+"""The columns of :py:class:`.File` from which :py:class:`.FileRecord` objects
+are built, in the order of its constructor"""
+
+RELATED = ('client', 'protocols', 'audio')
+"""The related objects that :py:meth:`Database.objects` can load with the files"""
+
+DURATION = AudioInfo.samples * 1.0 / AudioInfo.rate
+"""The SQL expression of the duration of a file, in seconds"""
+
+ORDERS = {
+    'path': (File.path,),
+    'duration': (AudioInfo.samples.is_(None), DURATION, File.path),
+}
+"""The orders of the files returned by :py:meth:`Database.objects`"""
+
+PATH_OUTPUTS = ('list', 'array', 'buffer')
+"""The types of paths returned by :py:meth:`Database.bulk_paths`"""
+
+ID_CHUNK = 500
+"""The maximum number of file ids in the ``IN`` clause of a query, which keeps
+queries under the limit of bound parameters of older SQLite versions; longer
+filters of clients or file ids are loaded into temporary tables and joined"""
+
+TEMPORARY_TABLES = 'bob.db.asvspoof.temporary_tables'
+"""The key of the temporary tables and of their contents in the ``info`` of a
+connection, see :py:meth:`Database._temporary_table`"""
+
 
 class Database(object):
     """The dataset class opens and maintains a connection opened to the Database.
@@ -23,37 +60,195 @@ class Database(object):
     and for the data itself inside the database.
     """
 
-    def __init__(self):
+    def __init__(self, sqlite_file=None, backend='sql', snapshot=None, address=None):
+        """Opens the database
+
+        Keyword parameters:
+
+        sqlite_file
+            [optional] The SQLite file to open. If not set, the database file
+            installed with this package is used.
+
+        backend
+            Either ``'sql'``, to answer queries with SQLAlchemy from the SQLite
+            file, or ``'snapshot'``, to answer them from the
+            :py:mod:`bob.db.asvspoof.snapshot` stored next to the SQLite file
+            without any SQL, or ``'remote'``, to send them to a server started
+            with ``bob_dbmanage.py asvspoof serve`` (see
+            :py:mod:`bob.db.asvspoof.service`). With the latter two, the returned
+            files, clients and protocols are :py:class:`.FileRecord`,
+            :py:class:`.ClientRecord` and :py:class:`.ProtocolRecord` objects.
+            The snapshot is optional: if none is stored next to the SQLite file
+            (e.g., after ``create --no-snapshot``), the ``snapshot`` backend
+            answers queries with SQL, with a :py:exc:`RuntimeWarning`.
+
+        snapshot
+            [optional] A :py:class:`bob.db.asvspoof.snapshot.Snapshot` to be used
+            by the ``snapshot`` backend instead of the one stored next to the
+            SQLite file, e.g., one living in shared memory.
+
+        address
+            [optional] The address of the server used by the ``remote`` backend,
+            either ``http://HOST:PORT`` or ``unix:PATH``. If not set, it is taken
+            from the environment variable ``BOB_DB_ASVSPOOF_SERVER``.
+        """
+        if backend not in self.backends():
+            raise ValueError("Invalid backend '%s'. Valid values are %s" % (backend, self.backends()))
+        self.sqlite_file = sqlite_file or SQLITE_FILE
+        self.backend = backend
+        self._given_snapshot = snapshot
+        self.address = address
+        self._profiler = profiling.from_environment()
         # opens a session to the database - keep it open until the end
         self.connect()
 
     def __del__(self):
-        """Releases the opened file descriptor"""
+        """Releases the session, the engine is shared with the other objects
+        reading the same file (see :py:mod:`bob.db.asvspoof.engines`)"""
         if self.session:
             try:
-                # Since the dispose function re-creates a pool
-                # which might fail in some conditions, e.g., when this
+                if self._profiler is not None:
+                    self._profiler.detach()
+                # this might fail in some conditions, e.g., when this
                 # destructor is called during the exit of the python interpreter
                 self.session.close()
-                self.session.bind.dispose()
             except TypeError:
                 # ... I can just ignore the according exception...
                 pass
             except AttributeError:
                 pass
 
+    @staticmethod
+    def backends():
+        """Returns the names of the available backends"""
+
+        return ('sql', 'snapshot', 'remote')
+
     def connect(self):
         """Tries connecting or re-connecting to the database"""
-        if not os.path.exists(SQLITE_FILE):
+        self._snapshot = self._remote = self._entry = None
+        if self.backend == 'snapshot' and (self._given_snapshot is not None or Snapshot.exists(self.sqlite_file)):
+            self.session = None
+            if self._given_snapshot is not None:
+                self._snapshot = self._given_snapshot
+            else:
+                self._snapshot = Snapshot.load(self.sqlite_file)
+
+        elif self.backend == 'remote':
+            from .service import ServiceClient
+            self.session = None
+            self._remote = ServiceClient(self.address)
+
+        elif not os.path.exists(self.sqlite_file):
             self.session = None
 
         else:
-            self.session = utils.session_try_readonly(INFO.type(), SQLITE_FILE)
+            if self.backend == 'snapshot':
+                import warnings
+                warnings.warn("No snapshot is stored next to the SQLite file `%s', the snapshot backend answers "
+                              "queries with SQL; run 'bob_dbmanage.py asvspoof create' to compile it" %
+                              self.sqlite_file, RuntimeWarning)
+            # the engine is opened once per thread and file
+            self._entry = engines.acquire(INFO.type(), self.sqlite_file)
+            self.session = self._entry.session()
+            if self._profiler is not None:
+                self._profiler.attach(self.session)
+
+        # the records of the clients and protocols, for the backends without SQL
+        self._catalog = self._snapshot if self._snapshot is not None else self._remote
+
+        # cached lookup tables are bound to the session
+        self._stems = self._indexed = self._bitmaps = None
+        self._samplers = {}
+        self._values = self._entry.values if self._entry is not None else {}
+
+    def profile(self, enable=True, threshold=None):
+        """Enables or disables the instrumentation of the queries
+
+        Keyword parameters:
+
+        enable
+            If set, the timings of the calls and of the SQL statements are
+            collected, see :py:meth:`stats`. Otherwise, the collected timings are
+            dropped.
+
+        threshold
+            [optional] If set, calls and SQL statements lasting longer than this
+            number of seconds are logged as warnings.
+
+        The SQL statements are collected from the engine of the SQLite file,
+        which is shared by all objects of the thread reading it (see
+        :py:mod:`bob.db.asvspoof.engines`), for the session of this object only.
+        """
+
+        if self._profiler is not None:
+            self._profiler.detach()
+            self._profiler = None
+        if enable:
+            self._profiler = profiling.Profiler(threshold=threshold)
+            if self.session is not None:
+                self._profiler.attach(self.session)
+
+    def stats(self):
+        """Returns a snapshot of the timings collected since the instrumentation
+        was enabled, or ``None`` if it is disabled
+
+        The returned dictionary contains the key ``calls``, which maps the names
+        of the instrumented methods (e.g., ``objects``) to the number of calls,
+        the number of returned rows and the total time in seconds spent in the
+        phases ``validate``, ``execute``, ``hydrate`` and ``total``; the key
+        ``sql`` with the number and the total time of the executed SQL statements;
+        and the key ``statements`` with the most recent SQL statements and their
+        durations.
+        """
+
+        if self._profiler is None:
+            return None
+        return self._profiler.snapshot()
+
+    @contextlib.contextmanager
+    def slow_queries(self, threshold):
+        """Context manager logging the calls and the SQL statements lasting
+        longer than ``threshold`` seconds inside its block
+
+        If the instrumentation is not enabled, it is enabled for the duration of
+        the block only.
+        """
+
+        profiler = self._profiler
+        if profiler is None:
+            self.profile(threshold=threshold)
+        else:
+            previous, profiler.threshold = profiler.threshold, threshold
+        try:
+            yield self
+        finally:
+            if profiler is None:
+                self.profile(False)
+            else:
+                profiler.threshold = previous
+
+    def _cached(self, name, compute):
+        """Returns the value ``name`` computed from the database by calling
+        ``compute``, which is cached with the engine of the file for the
+        ``sql`` backend, and with this object otherwise"""
+
+        try:
+            return self._values[name]
+        except KeyError:
+            return self._values.setdefault(name, compute())
+
+    def _profile(self, name):
+        """Starts the measurement of a call of the method ``name``"""
+
+        if self._profiler is None:
+            return profiling.NULL_CALL
+        return self._profiler.call(name)
 
     def is_valid(self):
         """Returns if a valid session has been opened for reading the database"""
 
-        return self.session is not None
+        return self.session is not None or self._catalog is not None
 
     def assert_validity(self):
         """Raise a RuntimeError if the database backend is not available"""
@@ -61,11 +256,12 @@ class Database(object):
         if not self.is_valid():
             raise RuntimeError("Database '%s' cannot be found at expected location '%s'. "
                                " Create it and then try re-connecting using Database.connect()" % (
-                               INFO.name(), SQLITE_FILE))
+                               INFO.name(), self.sqlite_file))
 
     def objects(self, support=File.attacktype_choices,
                 protocol='CM', groups=Client.group_choices, purposes='real',
-                gender=Client.gender_choices, clients=None):
+                gender=Client.gender_choices, clients=None, lightweight=False, load_related=None,
+                shard=None, balance_by=None, min_duration=None, max_duration=None, order_by='path'):
         """Returns a list of unique :py:class:`.File` objects for the specific
         query by the user.
 
@@ -100,10 +296,306 @@ class Database(object):
             client identifiers from which files should be retrieved. If ommited, set
             to None or an empty list, then data from all clients is retrieved.
 
+        lightweight
+            If set, the files are returned as :py:class:`.FileRecord` objects,
+            which are built from a select of the file columns only. They are much
+            cheaper to create and to keep in memory than :py:class:`.File`
+            objects, but are not bound to the database session. Their attributes
+            ``client`` and ``protocols`` are only set if loaded with
+            ``load_related``. The ``snapshot`` backend always returns
+            :py:class:`.FileRecord` objects, with their client.
+
+        load_related
+            One of :py:data:`RELATED` or a tuple of those. The given related
+            objects are loaded together with the files, instead of being loaded
+            lazily with one query per file (or per client) when accessed. The
+            clients and the lengths of the audio (``audio``, see
+            :py:class:`.AudioInfo`) are taken from joins of the query and the
+            protocols are loaded with a single additional query.
+
+        shard
+            [optional] A tuple ``(i, n)`` to only return the files of the ``i``-th
+            of ``n`` shards (starting at 0) of the query, e.g., to distribute the
+            files over ``n`` jobs. The shards are deterministic, disjoint and cover
+            all files, see :py:mod:`bob.db.asvspoof.sharding`. Only the ids of all
+            files are queried, the files of the shard are then loaded in chunks.
+
+        balance_by
+            [optional] One of :py:data:`bob.db.asvspoof.sharding.BALANCE_KEYS`. If
+            set to ``'client'`` or ``'attacktype'``, each shard holds the same
+            number of files of each client or attack, give or take one. If set to
+            ``'duration'``, all shards hold about the same duration of audio.
+            Otherwise, the files are dealt to the shards in path order.
+
+        min_duration, max_duration
+            [optional] If set, only the files whose audio lasts at least, or at
+            most, this number of seconds are returned. This requires the lengths
+            of the audio files to be indexed with ``bob_dbmanage.py asvspoof
+            index``; files that are not indexed are dropped.
+
+        order_by
+            Either ``'path'`` (the default) or ``'duration'``, to sort the files
+            by the duration of their audio (then by path), with files that are
+            not indexed last.
+
         Returns: A list of :py:class:`.File` objects.
         """
 
         self.assert_validity()
+        call = self._profile('objects')
+
+        support, protocol, groups, purposes, gender, clients = self._check_objects_parameters(
+            support, protocol, groups, purposes, gender, clients)
+        load_related = self.check_parameters_for_validity(load_related, "related object", RELATED, ())
+        shard, balance_by = sharding.check_shard(shard, balance_by)
+        order_by = self.check_parameter_for_validity(order_by, "order", ORDERS, 'path')
+        audio = (min_duration is not None or max_duration is not None or order_by == 'duration' or
+                 balance_by == 'duration' or 'audio' in load_related)
+
+        # now query the database
+        retval = []
+
+        if audio and self._remote is None:
+            self._assert_indexed()
+
+        if self._snapshot is not None:
+            call.validated()
+            snapshot = self._snapshot
+            rows = snapshot.select(protocol, groups, purposes, support, gender, clients)
+            rows = snapshot.restrict(rows, min_duration, max_duration)
+            if shard is not None:
+                rows = snapshot.shard(rows, shard, balance_by)
+            if order_by == 'duration':
+                rows = snapshot.sort_by_duration(rows)
+            retval += snapshot.records(rows)
+            if 'protocols' in load_related:
+                for record, protocols in zip(retval, snapshot.protocols(rows)):
+                    record.protocols = protocols
+            if 'audio' in load_related:
+                for record, info in zip(retval, snapshot.audio(rows)):
+                    record.audio = info
+            call.done(len(retval))
+            return retval
+
+        if self._remote is not None:
+            call.validated()
+            query = {'support': support, 'protocol': protocol, 'groups': groups, 'purposes': purposes,
+                     'gender': gender, 'clients': clients}
+            if shard is not None:
+                query.update(shard=shard, balance_by=balance_by)
+            if audio:
+                query.update(min_duration=min_duration, max_duration=max_duration, order_by=order_by)
+            retval += self._remote.objects([query], load_related)[0]
+            call.done(len(retval))
+            return retval
+
+        parameters = (support, protocol, groups, purposes, gender, clients)
+        call.validated()
+
+        # the files of a shard are loaded by their ids, in the returned order
+        chunks = [None]
+        if shard is not None:
+            ids = self._shard_ids(shard, balance_by, order_by, audio, min_duration, max_duration, parameters)
+            if len(ids) > ID_CHUNK:
+                # a single query joined to a table of the ids, rather than a query per chunk of ids
+                chunks = [self._temporary_table('shard_ids', Integer, ids)]
+            else:
+                chunks = [ids] if ids else []
+
+        if lightweight:
+            columns = RECORD_COLUMNS
+            if 'client' in load_related:
+                columns += (Client.gender, Client.group)
+            if 'audio' in load_related:
+                # with DISTINCT, the expressions of the order come after the selected columns
+                samples = len(columns)
+                columns += (AudioInfo.samples, AudioInfo.rate)
+            # files linked to several protocols are returned once, as for File objects
+            q = self._files_query(columns, *parameters)
+            if audio:
+                q = self._audio_query(q, min_duration, max_duration)
+            q = q.distinct()
+            client_records = {}
+            for chunk in chunks:
+                qc = self._restrict(q, chunk)
+                records = []
+                for k in self.session.execute(qc.order_by(*ORDERS[order_by]).statement):
+                    record = FileRecord(k[0], k[1], k[2], k[3], k[4], k[5])
+                    if 'client' in load_related:
+                        record.client = client_records.get(k[5])
+                        if record.client is None:
+                            record.client = client_records[k[5]] = ClientRecord(k[5], k[6], k[7])
+                    if 'audio' in load_related and k[samples + 1] is not None:
+                        record.audio = AudioRecord(k[samples], k[samples + 1])
+                    records.append(record)
+                if 'protocols' in load_related:
+                    self._load_protocols(records, qc)
+                retval += records
+
+        else:
+            q = self._files_query((File,), *parameters)
+            if audio:
+                q = self._audio_query(q, min_duration, max_duration)
+            if 'client' in load_related:
+                q = q.options(contains_eager(File.client))
+            if 'protocols' in load_related:
+                q = q.options(selectinload(File.protocolfiles).joinedload(ProtocolFiles.protocol))
+            if 'audio' in load_related:
+                q = q.options(contains_eager(File.audio))
+            for chunk in chunks:
+                qc = self._restrict(q, chunk)
+                retval += list(qc.order_by(*ORDERS[order_by]))
+
+        call.done(len(retval))
+        return retval
+
+    def _shard_ids(self, shard, balance_by, order_by, audio, min_duration, max_duration, parameters):
+        """Returns the ids of the files of a shard, in the order given by
+        ``order_by``, given the validated parameters of :py:meth:`objects`"""
+
+        columns = (File.id, File.path)
+        if balance_by == 'client':
+            columns += (File.client_id,)
+        elif balance_by == 'attacktype':
+            columns += (File.attacktype,)
+        samples = len(columns)
+        if audio:
+            columns += (AudioInfo.samples, AudioInfo.rate)
+        q = self._files_query(columns, *parameters)
+        if audio:
+            q = self._audio_query(q, min_duration, max_duration)
+        rows = self.session.execute(q.distinct().order_by(File.path).statement).fetchall()
+
+        # the keys are ranked as in the snapshot, so that all backends agree
+        keys = durations = None
+        if balance_by == 'client':
+            ranks = dict((k, i) for i, k in enumerate(sorted(set(k[2] for k in rows))))
+            keys = [ranks[k[2]] for k in rows]
+        elif balance_by == 'attacktype':
+            ranks = dict((k, i) for i, k in enumerate(File.attacktype_choices))
+            keys = [ranks[k[2]] for k in rows]
+        if audio:
+            durations = [float(k[samples]) / k[samples + 1] if k[samples + 1] else float('nan') for k in rows]
+        positions = sharding.positions(len(rows), shard, keys,
+                                       durations if balance_by == 'duration' else None).tolist()
+        if order_by == 'duration':
+            # files that are not indexed come last, as in SQL
+            last = float('inf')
+            positions.sort(key=lambda k: (last if math.isnan(durations[k]) else durations[k], k))
+        return [rows[k][0] for k in positions]
+
+    def _audio_query(self, q, min_duration, max_duration):
+        """Adds the lengths of the audio files to the query of files ``q``,
+        keeping only those with a duration within the given bounds"""
+
+        q = q.outerjoin(AudioInfo, AudioInfo.file_id == File.id)
+        if min_duration is not None:
+            q = q.filter(DURATION >= min_duration)
+        if max_duration is not None:
+            q = q.filter(DURATION <= max_duration)
+        return q
+
+    def _assert_indexed(self):
+        """Raises a RuntimeError if the lengths of the audio files are not
+        stored in the database"""
+
+        if not self._indexed:
+            # only found indexes are cached, since the database may be indexed meanwhile
+            if self._snapshot is not None:
+                self._indexed = self._snapshot.indexed
+            else:
+                from sqlalchemy import inspect
+                # the table is created with the others, but only filled by the index command
+                self._indexed = (AudioInfo.__tablename__ in inspect(self.session.get_bind()).get_table_names() and
+                                 self.session.query(AudioInfo.file_id).first() is not None)
+        if not self._indexed:
+            raise RuntimeError("The audio files of database '%s' are not indexed, run 'bob_dbmanage.py %s index' "
+                               "first" % (self.sqlite_file, INFO.name()))
+
+    @staticmethod
+    def _restrict(q, ids):
+        """Restricts the query of files ``q`` to the given ids, either as a
+        list, or as a temporary table (see :py:meth:`_temporary_table`), or
+        not if ``ids`` is ``None``"""
+
+        if ids is None:
+            return q
+        if isinstance(ids, Table):
+            return q.join(ids, ids.c.id == File.id)
+        return q.filter(File.id.in_(ids))
+
+    def _load_protocols(self, records, q):
+        """Sets the protocols of the given :py:class:`.FileRecord` objects, which
+        were returned by the query ``q``, with a single query"""
+
+        ids = q.with_entities(File.id).statement.correlate(None)
+        links = self.session.query(ProtocolFiles.file_id, Protocol.id, Protocol.name).\
+            join((Protocol, ProtocolFiles.protocol)).filter(ProtocolFiles.file_id.in_(ids)).\
+            order_by(ProtocolFiles.file_id, Protocol.id)
+        protocol_records = {}
+        protocols = {}
+        for file_id, protocol_id, name in self.session.execute(links.statement):
+            protocol = protocol_records.get(protocol_id)
+            if protocol is None:
+                protocol = protocol_records[protocol_id] = ProtocolRecord(protocol_id, name)
+            protocols.setdefault(int(file_id), []).append(protocol)
+        for record in records:
+            record.protocols = tuple(protocols.get(record.id, ()))
+
+    def _files_query(self, entities, support, protocol, groups, purposes, gender, clients):
+        """Returns the query for the given entities (e.g., :py:class:`.File` or
+        some of its columns) of the files matching the validated parameters of
+        :py:meth:`objects`"""
+
+        q = self.session.query(*entities).select_from(File).join(ProtocolFiles).join((Protocol, ProtocolFiles.protocol)).join(Client)
+        if groups: q = q.filter(Client.group.in_(groups))
+        if clients and len(clients) > ID_CHUNK:
+            table = self._temporary_table('clients', String, clients)
+            q = q.join(table, table.c.id == Client.id)
+        elif clients: q = q.filter(Client.id.in_(clients))
+        if gender: q = q.filter(Client.gender.in_(gender))
+        if support: q = q.filter(File.attacktype.in_(support))
+        if purposes: q = q.filter(File.purpose.in_(purposes))
+        q = q.filter(Protocol.name.in_(protocol))
+        return q
+
+    def _temporary_table(self, name, type, values):
+        """Returns the temporary table ``name`` of the connection of the session,
+        with a single indexed column ``id`` of the given type holding the given
+        values, which replaces an ``IN`` clause with a join
+
+        The table is created and filled on first use, and filled again if it is
+        used with other values. Its contents are recorded with the connection,
+        which is shared by the objects of a thread reading the same file (see
+        :py:mod:`bob.db.asvspoof.engines`), so that a table filled by another
+        object is filled again.
+        """
+
+        connection = self.session.connection()
+        values = frozenset(values)
+        tables = connection.info.setdefault(TEMPORARY_TABLES, {})
+        table, current = tables.get(name, (None, None))
+        if table is None:
+            table = Table(name, MetaData(), Column('id', type, primary_key=True), prefixes=['TEMPORARY'])
+        if not connection.dialect.has_table(connection, name):
+            # temporary tables live as long as the connection
+            table.create(connection)
+            current = None
+        if current != values:
+            connection.execute(table.delete())
+            if values:
+                # inserted by the driver, without the overhead of a statement per row in SQLAlchemy
+                cursor = connection.connection.cursor()
+                try:
+                    cursor.executemany('INSERT INTO %s (id) VALUES (?)' % name, [(k,) for k in values])
+                finally:
+                    cursor.close()
+        tables[name] = (table, values)
+        return table
+
+    def _check_objects_parameters(self, support, protocol, groups, purposes, gender, clients):
+        """Checks the parameters of :py:meth:`objects` for validity and returns
+        them, as sequences or ``None``, in the same order"""
 
         # check if groups set are valid
         VALID_GROUPS = self.groups()
@@ -122,26 +614,344 @@ class Database(object):
         purposes = self.check_parameters_for_validity(purposes, "purpose", VALID_PURPOSE, None)
 
         # check protocol validity
-        VALID_PROTOCOLS = [k.name for k in self.protocols()]
+        VALID_PROTOCOLS = self.protocol_names()
         protocol = self.check_parameters_for_validity(protocol, "protocol", VALID_PROTOCOLS, ('CM',))
 
         # checks client identity validity
-        VALID_CLIENTS = [k.id for k in self.clients()]
+        VALID_CLIENTS = self._cached('clients', lambda: [k.id for k in self.clients()])
         clients = self.check_parameters_for_validity(clients, "client", VALID_CLIENTS, None)
 
-        # now query the database
-        retval = []
+        return support, protocol, groups, purposes, gender, clients
 
-        q = self.session.query(File).join(ProtocolFiles).join((Protocol, ProtocolFiles.protocol)).join(Client)
-        if groups: q = q.filter(Client.group.in_(groups))
-        if clients: q = q.filter(Client.id.in_(clients))
-        if gender: q = q.filter(Client.gender.in_(gender))
-        if support: q = q.filter(File.attacktype.in_(support))
-        if purposes: q = q.filter(File.purpose.in_(purposes))
-        q = q.filter(Protocol.name.in_(protocol))
-        q = q.order_by(File.path)
-        retval += list(q)
+    def publish(self, name=None, **object_query):
+        """Publishes the file table, or the result of a query, in shared memory
+
+        Worker processes can then attach to the table by name with
+        :py:func:`bob.db.asvspoof.shared.attach` and access the files without
+        copying the metadata, see :py:mod:`bob.db.asvspoof.shared`.
+
+        Keyword parameters:
+
+        name
+            [optional] The name of the shared memory segment. If not set, a unique
+            name is chosen.
+
+        object_query
+            If given, only the files returned by :py:meth:`objects` for these
+            arguments are published, in the same order. Otherwise, all files of
+            the database are published, sorted by path.
+
+        Returns a :py:class:`bob.db.asvspoof.shared.SharedTable`, which owns the
+        segment and should be unlinked once all workers are done.
+        """
+
+        from . import shared
+
+        self.assert_validity()
+        if self._remote is not None:
+            raise ValueError("The files of the 'remote' backend cannot be published, they are not loaded locally")
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = Snapshot.from_session(self.session)
+
+        rows = None
+        if object_query:
+            support, protocol, groups, purposes, gender, clients = self._check_object_query(object_query)
+            rows = snapshot.select(protocol, groups, purposes, support, gender, clients)
+
+        return shared.publish(snapshot, rows, name)
+
+    def count(self, **object_query):
+        """Returns the number of files that :py:meth:`objects` returns for the
+        given arguments, without loading them
+
+        Keyword parameters:
+
+        object_query
+            The filtering arguments of :py:meth:`objects`, with the same
+            defaults.
+        """
+
+        self.assert_validity()
+        call = self._profile('count')
+        support, protocol, groups, purposes, gender, clients = self._check_object_query(object_query)
+        call.validated()
+
+        if self._snapshot is not None:
+            retval = len(self._snapshot.select(protocol, groups, purposes, support, gender, clients))
+        elif self._remote is not None:
+            retval = self._remote.count([{'support': support, 'protocol': protocol, 'groups': groups,
+                                          'purposes': purposes, 'gender': gender, 'clients': clients}])[0]
+        else:
+            q = self._files_query((func.count(distinct(File.id)),), support, protocol, groups, purposes, gender,
+                                  clients)
+            retval = q.scalar()
+
+        call.done(1)
+        return retval
+
+    def dataframe(self, chunksize=None, audio=False, **object_query):
+        """Returns the files of a query as a :py:class:`pandas.DataFrame`, with
+        one row per file and protocol, sorted by path and by protocol
+
+        The columns are listed in :py:data:`bob.db.asvspoof.frames.COLUMNS`. The
+        columns ``protocol``, ``group``, ``purpose``, ``attacktype``,
+        ``client`` and ``gender`` are categorical, so that a frame of all the
+        links between files and protocols takes a few tens of megabytes. The
+        frame is built from a single ``SELECT`` of these columns, or from the
+        arrays of the ``snapshot`` backend, without creating an object per file.
+        Requires :py:mod:`pandas`.
+
+        Keyword parameters:
+
+        chunksize
+            [optional] If set, an iterator over frames of at most this number of
+            rows is returned instead, which are fetched from the database one
+            after the other with the ``sql`` backend.
+
+        audio
+            If set, the columns ``samples`` and ``rate`` of the lengths of the
+            audio files are added, see :py:class:`.AudioInfo`, which are ``-1``
+            and ``0`` for files that are not indexed. Raises a
+            :py:exc:`RuntimeError` if the database is not indexed.
+
+        object_query
+            The filtering arguments of :py:meth:`objects`, with the same
+            defaults.
+        """
+
+        from . import frames
+
+        frames._pandas()
+        self.assert_validity()
+        if chunksize is not None and chunksize < 1:
+            raise ValueError("Invalid chunk size %d, it should be positive" % chunksize)
+        call = self._profile('dataframe')
+        support, protocol, groups, purposes, gender, clients = self._check_object_query(object_query)
+        call.validated()
+
+        if audio and self._remote is None:
+            self._assert_indexed()
+
+        if self._snapshot is not None:
+            snapshot = self._snapshot
+            categories = frames.categories(snapshot.protocol_name.tolist(), snapshot.client_id.tolist())
+        else:
+            categories = frames.categories(self.protocol_names(),
+                                           self._cached('clients', lambda: [k.id for k in self.clients()]))
+
+        if self._snapshot is not None or self._remote is not None:
+            if self._snapshot is not None:
+                rows = snapshot.select(protocol, groups, purposes, support, gender, clients)
+                columns = frames.from_snapshot(snapshot, rows, protocol, audio)
+            else:
+                related = ('client', 'protocols', 'audio') if audio else ('client', 'protocols')
+                records = self.objects(lightweight=True, load_related=related, **object_query)
+                columns = frames.from_rows(frames.from_records(records, protocol), categories, audio)
+            call.done(len(columns['id']))
+            if chunksize is None:
+                return frames.build(columns, categories)
+            return (frames.build(k, categories) for k in frames.slices(columns, chunksize))
+
+        entities = (File.id, File.path, Protocol.name, File.group, File.purpose, File.attacktype, File.client_id,
+                    Client.gender)
+        if audio:
+            entities += (AudioInfo.samples, AudioInfo.rate)
+        q = self._files_query(entities, support, protocol, groups, purposes, gender, clients)
+        if audio:
+            q = q.outerjoin(AudioInfo, AudioInfo.file_id == File.id)
+        result = self.session.execute(q.order_by(File.path, Protocol.id).statement)
+
+        if chunksize is None:
+            columns = frames.from_rows(result.fetchall(), categories, audio)
+            call.done(len(columns['id']))
+            return frames.build(columns, categories)
+
+        def chunks():
+            size = 0
+            try:
+                while True:
+                    rows = result.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    size += len(rows)
+                    yield frames.build(frames.from_rows(rows, categories, audio), categories)
+            finally:
+                result.close()
+                call.done(size)
+        return chunks()
+
+    def query(self):
+        """Returns a lazy :py:class:`bob.db.asvspoof.selection.Selection` of
+        the files of this database, refined by chaining filters and evaluated
+        by a single query when one of its terminal methods is called, e.g.:
+
+        .. code-block:: python
+
+            db.query().protocol('CM').group('eval').purpose('attack').paths(directory, '.wav')
+        """
+
+        from .selection import Selection
+        return Selection(self)
+
+    def bitmap(self, kind, values=None):
+        """Returns the :py:class:`bob.db.asvspoof.bitmap.Bitmap` of the files
+        with any of the given values of an attribute, which are combined with
+        the bitmaps of other values by bitwise operations, e.g.:
 
+        .. code-block:: python
+
+            attacks = db.bitmap('protocol', 'CM') & db.bitmap('purpose', 'attack') - db.bitmap('attacktype', 'S10')
+            attacks.paths(directory, '.wav')
+
+        Keyword parameters:
+
+        kind
+            The attribute of the files, one of
+            :py:data:`bob.db.asvspoof.bitmap.KINDS`: ``protocol``, ``purpose``,
+            ``attacktype``, ``group`` or ``gender`` (of the client).
+
+        values
+            One or several values of the attribute, e.g., ``'CM'`` or
+            ``('S1', 'S2')``. By default, all values with a bitmap, see
+            :py:meth:`bitmap_values`.
+
+        The bitmaps are stored with the snapshot. With the ``sql`` backend, the
+        snapshot is loaded, or compiled from the database if it does not exist,
+        on first use.
+        """
+
+        from .bitmap import KINDS
+
+        call = self._profile('bitmap')
+        snapshot = self._bitmap_snapshot()
+        self.check_parameter_for_validity(kind, "bitmap kind", KINDS)
+        valid = snapshot.bitmap_values(kind)
+        values = self.check_parameters_for_validity(values, kind, valid, valid)
+        call.validated()
+        retval = snapshot.bitmap(kind, values)
+        call.done(1)
+        return retval
+
+    def bitmap_values(self, kind):
+        """Returns the values of the given attribute with a bitmap, see
+        :py:meth:`bitmap`"""
+
+        from .bitmap import KINDS
+
+        self.check_parameter_for_validity(kind, "bitmap kind", KINDS)
+        return self._bitmap_snapshot().bitmap_values(kind)
+
+    def _bitmap_snapshot(self):
+        """Returns the snapshot holding the bitmaps of the files"""
+
+        self.assert_validity()
+        if self._remote is not None:
+            raise ValueError("The bitmaps of the 'remote' backend are not available, the files are not loaded locally")
+        if self._snapshot is not None:
+            return self._snapshot
+        if self._bitmaps is None:
+            if Snapshot.exists(self.sqlite_file):
+                self._bitmaps = Snapshot.load(self.sqlite_file)
+            else:
+                self._bitmaps = Snapshot.from_session(self.session)
+        return self._bitmaps
+
+    def map(self, func, query=None, workers=4, output_dir=None, extension='.hdf5', journal=None, chunksize=16,
+            progress=None):
+        """Runs a function or a command on each file of a query with a pool of
+        processes, skipping the files that are already done, see
+        :py:mod:`bob.db.asvspoof.mapping`
+
+        Keyword parameters:
+
+        func
+            The function called as ``func(file, output)`` on each file, which
+            writes the output to the path ``output`` or returns it to be saved
+            there, or a :py:class:`bob.db.asvspoof.mapping.Command`.
+
+        query
+            [optional] The filtering arguments of :py:meth:`objects`, as a
+            dictionary, or a :py:class:`bob.db.asvspoof.selection.Selection`.
+            By default, the files returned by :py:meth:`objects` without
+            arguments.
+
+        workers
+            The number of worker processes.
+
+        output_dir, extension
+            The directory and the extension of the outputs, as given to
+            :py:meth:`.File.save`.
+
+        journal
+            [optional] The journal of the files that are done, by default in the
+            output directory. A run that is started again skips the files listed
+            in the journal and the files whose output exists.
+
+        chunksize
+            The number of files sent to a worker process at once.
+
+        progress
+            [optional] A :py:class:`bob.db.asvspoof.progress.Progress`
+            accounting for the processed files.
+
+        Returns the list of tuples ``(path, error)`` of the files that failed,
+        which are tried again by the next run.
+        """
+
+        from .mapping import map_files
+
+        if output_dir is None:
+            raise ValueError("An output directory is required")
+        if hasattr(query, 'arguments'):
+            query = query.arguments()
+        files = self.objects(lightweight=True, **(query or {}))
+        return map_files(files, func, output_dir, extension, workers=workers, chunksize=chunksize,
+                         journal=journal, progress=progress)
+
+    def sampler(self, by=('purpose', 'attacktype'), **object_query):
+        """Returns the :py:class:`.Sampler` of the files of a query, which draws
+        the orders of training epochs balanced between strata of files
+
+        The sampler is built once per query and cached.
+
+        Keyword parameters:
+
+        by
+            The attributes of the files defining the strata, among
+            :py:data:`bob.db.asvspoof.sampler.STRATA_KEYS`.
+
+        object_query
+            The filtering arguments of :py:meth:`objects`, with the same
+            defaults.
+        """
+
+        from .sampler import Sampler, STRATA_KEYS
+
+        by = self.check_parameters_for_validity(by, "stratum key", STRATA_KEYS, ())
+        by = tuple(k for k in STRATA_KEYS if k in by)
+        parameters = self._check_object_query(object_query)
+        key = (by,) + tuple(k if k is None else tuple(sorted(k)) for k in parameters)
+        sampler = self._samplers.get(key)
+        if sampler is None:
+            support, protocol, groups, purposes, gender, clients = parameters
+            files = self.objects(support, protocol, groups, purposes, gender, clients, lightweight=True,
+                                 load_related='client' if 'gender' in by else None)
+            sampler = self._samplers[key] = Sampler(files, by)
+        return sampler
+
+    def _check_object_query(self, object_query):
+        """Checks the filtering arguments of :py:meth:`objects` given as a
+        dictionary, see :py:meth:`_check_objects_parameters`"""
+
+        defaults = {'support': File.attacktype_choices, 'protocol': 'CM', 'groups': Client.group_choices,
+                    'purposes': 'real', 'gender': Client.gender_choices, 'clients': None}
+        defaults.update(object_query)
+        retval = self._check_objects_parameters(
+            defaults.pop('support'), defaults.pop('protocol'), defaults.pop('groups'),
+            defaults.pop('purposes'), defaults.pop('gender'), defaults.pop('clients'))
+        if defaults:
+            raise TypeError("Invalid arguments for Database.objects(): %s" % ', '.join(sorted(defaults)))
         return retval
 
     def files(self, directory=None, extension=None, **object_query):
@@ -175,7 +985,8 @@ class Database(object):
             "The method Database.files() is deprecated, use Database.objects() for more powerful object retrieval",
             DeprecationWarning)
 
-        return dict([(k.id, k.make_path(directory, extension)) for k in self.objects(**object_query)])
+        ids, stems = self._select_stems(object_query)
+        return dict(zip(ids, make_paths(stems, directory, extension)))
 
     def clients(self, groups=None, protocol=None, gender=None):
         """Returns a list of Clients for the specific query by the user.
@@ -194,31 +1005,44 @@ class Database(object):
 
         Returns: A list containing the ids of all models belonging to the given group.
         """
+        call = self._profile('clients')
         if protocol == '.': protocol = None
         protocol = self.check_parameters_for_validity(protocol, "protocol", self.protocol_names(), None)
         groups = self.check_parameters_for_validity(groups, "group", self.groups(), self.groups())
         gender = self.check_parameters_for_validity(gender, "gender", self.genders(), None)
 
+        call.validated()
         retval = []
-        if groups:
+        if groups and self._catalog is not None:
+            retval += [k for k in self._catalog.client_records
+                       if k.group in groups and (not gender or k.gender in gender)]
+        elif groups:
             q = self.session.query(Client).filter(Client.group.in_(groups))
             if gender:
                 q = q.filter(Client.gender.in_(gender))
             q = q.order_by(Client.id)
             retval += list(q)
 
+        call.done(len(retval))
         return retval
 
     def has_client_id(self, id):
         """Returns True if we have a client with a certain integer identifier"""
 
         self.assert_validity()
+        if self._catalog is not None:
+            return any(k.id == id for k in self._catalog.client_records)
         return self.session.query(Client).filter(Client.id == id).count() != 0
 
     def client(self, id):
         """Returns the Client object in the database given a certain id. Raises
         an error if that does not exist."""
 
+        if self._catalog is not None:
+            retval = [k for k in self._catalog.client_records if k.id == id]
+            if len(retval) != 1:
+                raise ValueError("Client '%s' does not exist" % (id,))
+            return retval[0]
         return self.session.query(Client).filter(Client.id == id).one()
 
     def protocols(self):
@@ -226,19 +1050,21 @@ class Database(object):
         """
 
         self.assert_validity()
+        if self._catalog is not None:
+            return list(self._catalog.protocol_records)
         return list(self.session.query(Protocol))
 
     def protocol_names(self):
         """Returns all registered protocol names"""
 
-        l = self.protocols()
-        retval = [str(k.name) for k in l]
-        return retval
+        return list(self._cached('protocols', lambda: [str(k.name) for k in self.protocols()]))
 
     def has_protocol(self, name):
         """Tells if a certain protocol is available"""
 
         self.assert_validity()
+        if self._catalog is not None:
+            return name in self.protocol_names()
         return self.session.query(Protocol).filter(Protocol.name == name).count() != 0
 
     def protocol(self, name):
@@ -246,6 +1072,11 @@ class Database(object):
         an error if that does not exist."""
 
         self.assert_validity()
+        if self._catalog is not None:
+            retval = [k for k in self._catalog.protocol_records if k.name == name]
+            if len(retval) != 1:
+                raise ValueError("Protocol '%s' does not exist" % (name,))
+            return retval[0]
         return self.session.query(Protocol).filter(Protocol.name == name).one()
 
     def groups(self):
@@ -290,14 +1121,99 @@ class Database(object):
         """
 
         self.assert_validity()
+        call = self._profile('paths')
+        ids = list(ids)
+        call.validated()
+        retval = make_paths(self._stems_by_id(ids), prefix, suffix)
+        call.done(len(retval))
+        return retval
 
-        fobj = self.session.query(File).filter(File.id.in_(ids))
-        retval = []
-        for p in ids:
-            retval.extend([k.make_path(prefix, suffix) for k in fobj if k.id == p])
+    def bulk_paths(self, ids=None, directory=None, extension=None, output='list', **object_query):
+        """Returns the paths of many files at once, either of the given file ids
+        or of the files of a query
+
+        The paths are built with a single query of the stems of the files and
+        a single concatenation, see :py:func:`bob.db.asvspoof.models.make_paths`.
+
+        Keyword Parameters:
+
+        ids
+            [optional] The ids of the files, as for :py:meth:`paths`. Unknown ids
+            are skipped. If not given, the files returned by :py:meth:`objects`
+            for ``object_query`` are used, in the same order.
+
+        directory
+            An optional directory name that will be prefixed to the paths.
+
+        extension
+            An optional extension that will be suffixed to the paths.
+
+        output
+            The type of the returned paths, one of :py:data:`PATH_OUTPUTS`:
+            ``'list'`` for a list of strings, ``'array'`` for a NumPy array of
+            strings, or ``'buffer'`` for a single string with one path per line
+            (e.g., to be written to a file list).
+
+        object_query
+            The filtering arguments of :py:meth:`objects`, if ``ids`` is not
+            given.
+        """
+
+        self.assert_validity()
+        output = self.check_parameter_for_validity(output, "output", PATH_OUTPUTS, 'list')
+        call = self._profile('bulk_paths')
+        if ids is not None:
+            if object_query:
+                raise TypeError("Invalid arguments for Database.bulk_paths() with ids: %s" %
+                                ', '.join(sorted(object_query)))
+            ids = list(ids)
+            call.validated()
+            stems = self._stems_by_id(ids)
+        else:
+            call.validated()
+            stems = self._select_stems(object_query)[1]
+
+        retval = make_paths(stems, directory, extension)
+        call.done(len(retval))
+        if output == 'array':
+            return numpy.array(retval, dtype=str)
+        if output == 'buffer':
+            return '\n'.join(retval) + '\n' if retval else ''
         return retval
 
-    def reverse(self, paths):
+    def _select_stems(self, object_query):
+        """Returns the ids and the stems of the files returned by
+        :py:meth:`objects` for the given arguments, as two lists"""
+
+        support, protocol, groups, purposes, gender, clients = self._check_object_query(object_query)
+        if self._snapshot is not None:
+            rows = self._snapshot.select(protocol, groups, purposes, support, gender, clients)
+            return self._snapshot.file_id[rows].tolist(), self._snapshot.paths(rows)
+        if self._remote is not None:
+            files = self.objects(lightweight=True, **object_query)
+            return [k.id for k in files], [k.path for k in files]
+        q = self._files_query((File.id, File.path), support, protocol, groups, purposes, gender, clients)
+        rows = self.session.execute(q.distinct().order_by(File.path).statement).fetchall()
+        return [k[0] for k in rows], [k[1] for k in rows]
+
+    def _stems_by_id(self, ids):
+        """Returns the stems of the files with the given ids, in the same order,
+        skipping unknown ids"""
+
+        if self._snapshot is not None:
+            rows = self._snapshot.rows_by_id(ids)
+            return self._snapshot.paths(rows[rows >= 0])
+        if self._remote is not None:
+            return self._remote.paths(ids, '', '')
+        stems = {}
+        unique = list(set(ids))
+        # the statement is built once, its IN list is expanded on execution
+        q = self.session.query(File.id, File.path).filter(File.id.in_(bindparam('ids', expanding=True)))
+        for k in range(0, len(unique), ID_CHUNK):
+            stems.update(self.session.execute(q.statement, {'ids': unique[k:k + ID_CHUNK]}).fetchall())
+        return [stems[k] for k in ids if k in stems]
+
+    def reverse(self, paths, match='exact'):
         """Reverses the lookup: from certain stems, returning file ids
 
         Keyword Parameters:
@@ -306,15 +1222,181 @@ class Database(object):
             The filename stems I'll query for. This object should be a python
             iterable (such as a tuple or list)
 
-        Returns a list (that may be empty).
+        match
+            How the stems are matched, one of
+            :py:data:`bob.db.asvspoof.pathindex.MATCHES`: ``'exact'`` for the
+            files with the given stems, ``'prefix'`` for the files whose stems
+            start with the given prefixes (e.g., ``wav/D18/``), or ``'glob'`` for
+            the files whose stems match the given shell-style patterns (e.g.,
+            ``wav/D1?/*_100000?``). The lookups are binary searches in the
+            sorted stems, see :py:class:`bob.db.asvspoof.pathindex.PathIndex`.
+
+        Returns a list (that may be empty). With prefixes or patterns, the ids
+        of the files matching each of them are given in turn, sorted by stem.
         """
 
+        from .pathindex import MATCHES
+
         self.assert_validity()
+        match = self.check_parameter_for_validity(match, "match", MATCHES, 'exact')
+        call = self._profile('reverse')
 
-        fobj = self.session.query(File).filter(File.path.in_(paths))
-        retval = []
-        for p in paths:
-            retval.extend([k.id for k in fobj if k.path == p])
+        if self._remote is not None:
+            retval = self._remote.reverse(paths, match)
+        else:
+            retval = self._stem_index().lookup(paths, match)
+
+        call.done(len(retval))
+        return retval
+
+    def _stem_index(self):
+        """Returns the :py:class:`bob.db.asvspoof.pathindex.PathIndex` of all
+        files, which is built with a single query on first use and cached for
+        the lifetime of this object"""
+
+        from .pathindex import PathIndex
+
+        if self._stems is None:
+            if self._snapshot is not None:
+                self._stems = PathIndex.from_snapshot(self._snapshot)
+            else:
+                rows = self.session.execute(self.session.query(File.path, File.id).statement).fetchall()
+                self._stems = PathIndex([k[0] for k in rows], [k[1] for k in rows])
+        return self._stems
+
+    def attach_scores(self, score_file):
+        """Joins the scores of a 4-column score file to the file metadata
+
+        The score file is streamed line by line and its distinct test labels
+        (the third column) are looked up in the sorted index of the file stems
+        as stored in :py:attr:`.File.path` (see :py:meth:`reverse`). The
+        metadata of the matched files only is then gathered column by column,
+        from the arrays of the snapshot or with a single query to the database.
+
+        Keyword Parameters:
+
+        score_file
+            The name of a 4-column score file (``claimed_id real_id test_label
+            score``), optionally compressed with gzip (``.gz`` extension), or an
+            open file-like object containing text lines in the same format.
+
+        Returns a tuple ``(scores, unmatched)``. ``scores`` is a dictionary with
+        the keys ``id``, ``score``, ``purpose``, ``attacktype``, ``group`` and
+        ``gender``, each containing a :py:class:`numpy.ndarray` with one entry
+        per matched line of the score file, in the order of the score file.
+        ``unmatched`` is a list of the test labels that could not be found in
+        the database.
+        """
+
+        self.assert_validity()
+        call = self._profile('attach_scores')
+
+        if hasattr(score_file, 'read'):
+            lines = score_file
+        elif score_file.endswith('.gz'):
+            import gzip
+            lines = gzip.open(score_file, 'rt')
+        else:
+            lines = open(score_file)
+
+        labels = []
+        scores = []
+        try:
+            for line in lines:
+                splitline = line.split()
+                if not splitline or splitline[0].startswith('#'):
+                    continue
+                if len(splitline) != 4:
+                    raise ValueError("Line `%s' of score file `%s' does not have four columns" %
+                                     (line.strip(), getattr(score_file, 'name', score_file)))
+                labels.append(splitline[2])
+                scores.append(float(splitline[3]))
+        finally:
+            if lines is not score_file:
+                lines.close()
+
+        # the labels repeat once per claimed identity, they are resolved once
+        stems, inverse = numpy.unique(numpy.array(labels, dtype=str), return_inverse=True)
+        ids = self._ids_by_stem(stems.tolist())
+        known = ids >= 0
+        columns = self._file_columns(ids[known])
+        # the position of each matched label among the known ids
+        positions = numpy.cumsum(known) - 1
+        matched = known[inverse]
+        take = positions[inverse[matched]]
+
+        retval = dict((k, v[take]) for k, v in columns.items())
+        retval['score'] = numpy.array(scores, dtype=numpy.float64)[matched]
+        unmatched = [labels[k] for k in numpy.flatnonzero(~matched).tolist()]
+        call.done(len(take))
+        return retval, unmatched
+
+    def _ids_by_stem(self, stems):
+        """Returns the ids of the files with the given (sorted, distinct) stems
+        as an array, ``-1`` for unknown stems"""
+
+        retval = numpy.full(len(stems), -1, dtype=numpy.int64)
+        if self._remote is not None:
+            ids = self._remote.reverse(stems)
+            # the known stems are returned in order, their positions are found back from their paths
+            retval[numpy.searchsorted(stems, self._remote.paths(ids, '', ''))] = ids
+            return retval
+        index = self._stem_index()
+        positions = numpy.array([index.find(k) for k in stems], dtype=numpy.int64)
+        found = positions >= 0
+        retval[found] = index.ids[positions[found]]
+        return retval
+
+    def _file_columns(self, ids):
+        """Returns the columns ``id``, ``purpose``, ``attacktype``, ``group``
+        and ``gender`` of the files with the given (known) ids, in the same
+        order, as a dictionary of :py:class:`numpy.ndarray`"""
+
+        choices = {
+            'purpose': numpy.array(File.purpose_choices),
+            'attacktype': numpy.array(File.attacktype_choices),
+            'group': numpy.array(File.group_choices),
+            # files without client have an empty gender
+            'gender': numpy.array(Client.gender_choices + ('',)),
+        }
+        if self._snapshot is not None:
+            snapshot = self._snapshot
+            rows = snapshot.rows_by_id(ids)
+            client = snapshot.file_client[rows]
+            codes = {
+                'purpose': snapshot.file_purpose[rows],
+                'attacktype': snapshot.file_attacktype[rows],
+                'group': snapshot.file_group[rows],
+                'gender': numpy.where(client >= 0, snapshot.client_gender[numpy.maximum(client, 0)], -1),
+            }
+        elif self._remote is not None:
+            files = self._remote.files(ids)
+            genders = numpy.array([Client.gender_choices.index(k.gender) for k in self._remote.client_records] + [-1],
+                                  dtype=numpy.int64)
+            codes = {
+                'purpose': numpy.array(files['purpose'], dtype=numpy.int64),
+                'attacktype': numpy.array(files['attacktype'], dtype=numpy.int64),
+                'group': numpy.array(files['group'], dtype=numpy.int64),
+                'gender': genders[numpy.array(files['client'], dtype=numpy.int64)],
+            }
+        else:
+            found = {}
+            q = self.session.query(File.id, File.purpose, File.attacktype, File.group, Client.gender)
+            q = q.outerjoin(Client).filter(File.id.in_(bindparam('ids', expanding=True)))
+            unique = ids.tolist()
+            for k in range(0, len(unique), ID_CHUNK):
+                rows = self.session.execute(q.statement, {'ids': unique[k:k + ID_CHUNK]}).fetchall()
+                found.update((r[0], tuple(r[1:])) for r in rows)
+            rows = [found[k] for k in unique]
+            return {
+                'id': numpy.array(unique, dtype=numpy.int64),
+                'purpose': numpy.array([k[0] for k in rows], dtype=str),
+                'attacktype': numpy.array([k[1] for k in rows], dtype=str),
+                'group': numpy.array([k[2] for k in rows], dtype=str),
+                'gender': numpy.array([k[3] or '' for k in rows], dtype=str),
+            }
+        retval = dict((k, choices[k][v]) for k, v in codes.items())
+        retval['id'] = numpy.asarray(ids, dtype=numpy.int64)
         return retval
 
     def save_one(self, id, obj, directory, extension):
@@ -428,9 +1510,15 @@ class Database(object):
             # parameter is just a single element, not a tuple or list -> transform it into a tuple
             parameters = (parameters,)
 
-        # perform the checks
+        # perform the checks, with a set of the valid parameters for several parameters
+        valid = valid_parameters
+        if len(parameters) > 1 and not isinstance(valid, (set, frozenset, dict)):
+            try:
+                valid = set(valid_parameters)
+            except TypeError:
+                pass
         for parameter in parameters:
-            if parameter not in valid_parameters:
+            if parameter not in valid:
                 raise ValueError("Invalid %s '%s'. Valid values are %s, or lists/tuples of those" % (
                 parameter_description, parameter, valid_parameters))
 
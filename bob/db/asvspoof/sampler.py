@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Epoch orders of training files, balanced between strata of files.
+
+A :py:class:`Sampler` splits the files of a query into strata, e.g., by
+purpose and attack type, and keeps the positions of the files of each stratum
+as index arrays. The orders of the epochs are then computed from these arrays
+with a few vectorized operations for a given seed, without going through the
+files again, so that they can be drawn anew at each epoch over millions of
+files. Samplers are built and cached by :py:meth:`.Database.sampler`.
+"""
+
+import numpy
+
+
+STRATA_KEYS = ('purpose', 'attacktype', 'group', 'gender', 'client')
+"""The attributes of the files the strata can be defined by"""
+
+
+def _value(record, key):
+    """Returns the value of ``key`` for the given :py:class:`.FileRecord`"""
+
+    if key == 'client':
+        return record.client_id
+    if key == 'gender':
+        return record.client.gender
+    return getattr(record, key)
+
+
+class Sampler(object):
+    """The strata of the files of a query and the orders of their epochs
+
+    Keyword parameters:
+
+    files
+        The :py:class:`.FileRecord` objects of the query, with their clients
+        loaded if the strata depend on the gender.
+
+    by
+        The attributes defining the strata, among :py:data:`STRATA_KEYS`.
+
+    The positions returned by the methods of the sampler are positions in
+    ``files``, which is available as attribute ``files``, with their ids as
+    the array ``ids``.
+    """
+
+    def __init__(self, files, by):
+        self.files = files
+        self.by = tuple(by)
+        self.ids = numpy.array([k.id for k in files], dtype=numpy.int64)
+
+        # the strata are the distinct combinations of the codes of the values of each attribute
+        values = []
+        codes = []
+        for key in self.by:
+            v, c = numpy.unique(numpy.array([_value(k, key) for k in files], dtype=str), return_inverse=True)
+            values.append(v.tolist())
+            codes.append(c)
+        if files:
+            combined = numpy.ravel_multi_index(codes, [len(k) for k in values])
+            unique, self.codes = numpy.unique(combined, return_inverse=True)
+            unique = numpy.unravel_index(unique, [len(k) for k in values])
+        else:
+            unique, self.codes = [[] for k in self.by], numpy.zeros((0,), dtype=numpy.int64)
+
+        self.strata = list(zip(*[[v[i] for i in k.tolist()] for v, k in zip(values, unique)])) if files else []
+        """The strata, as sorted tuples of values of the attributes ``by``"""
+
+        self.codes = self.codes.astype(numpy.int32)
+        """The index in :py:attr:`strata` of the stratum of each file"""
+
+        self.counts = numpy.bincount(self.codes, minlength=len(self.strata))
+        """The number of files of each stratum"""
+
+        self._order = numpy.argsort(self.codes, kind='stable')
+        self._offsets = numpy.concatenate(([0], numpy.cumsum(self.counts)))
+        self.indexes = [self._order[self._offsets[k]:self._offsets[k + 1]] for k in range(len(self.strata))]
+        """The sorted positions of the files of each stratum"""
+
+    def __len__(self):
+        return len(self.files)
+
+    def index(self, stratum):
+        """Returns the positions of the files of the given stratum, as a tuple
+        of values of the attributes ``by`` (or a single value if the strata are
+        defined by one attribute)"""
+
+        if not isinstance(stratum, tuple):
+            stratum = (stratum,)
+        if stratum not in self.strata:
+            return numpy.zeros((0,), dtype=numpy.int64)
+        return self.indexes[self.strata.index(stratum)]
+
+    def _weights(self, weights):
+        """Returns the weights of the strata as an array"""
+
+        if weights is None:
+            return numpy.ones(len(self.strata))
+        retval = numpy.zeros(len(self.strata))
+        for stratum, weight in weights.items():
+            if not isinstance(stratum, tuple):
+                stratum = (stratum,)
+            if stratum not in self.strata:
+                raise ValueError("Invalid stratum %r. Valid values are %s" % (stratum, self.strata))
+            retval[self.strata.index(stratum)] = weight
+        if (retval < 0).any() or not (retval[self.counts > 0] > 0).any():
+            raise ValueError("Invalid weights %r, they should be positive" % (weights,))
+        return retval
+
+    def shuffle(self, seed):
+        """Returns a random permutation of the positions of the files"""
+
+        return numpy.random.RandomState(seed).permutation(len(self.files))
+
+    def stratified(self, seed):
+        """Returns a random permutation of the positions of the files, in which
+        the strata are spread evenly
+
+        The files of each stratum are shuffled, and the ``k``-th of the ``n``
+        files of a stratum is placed at a random position in the ``k``-th
+        ``n``-th of the epoch. Any contiguous part of the epoch (e.g., a batch)
+        then holds files of all strata in proportion to their sizes.
+        """
+
+        rng = numpy.random.RandomState(seed)
+        size = len(self.files)
+        shuffled = rng.permutation(size)
+        # groups the shuffled positions by stratum, and ranks them within their stratum
+        grouped = shuffled[numpy.argsort(self.codes[shuffled], kind='stable')]
+        codes = self.codes[grouped]
+        ranks = numpy.arange(size) - self._offsets[codes]
+        keys = (ranks + rng.random_sample(size)) / self.counts[codes]
+        return grouped[numpy.argsort(keys, kind='stable')]
+
+    def weighted(self, seed, weights=None, size=None, replace=True):
+        """Returns the positions of files drawn at random with probabilities
+        depending on their stratum
+
+        Keyword parameters:
+
+        seed
+            The seed of the random generator.
+
+        weights
+            [optional] A dictionary of the weight of each stratum, which is the
+            probability to draw a file of that stratum up to a normalization.
+            Strata that are not listed are never drawn. By default, all strata
+            have the same weight, i.e., the epoch is balanced between strata,
+            whatever their sizes.
+
+        size
+            [optional] The number of files of the epoch, by default the number
+            of files of the query.
+
+        replace
+            If set, the files are drawn with replacement, so that files of the
+            small strata are repeated in the epoch. Otherwise, each file is
+            drawn at most once.
+        """
+
+        rng = numpy.random.RandomState(seed)
+        weights = self._weights(weights) * (self.counts > 0)
+        if size is None:
+            size = len(self.files)
+
+        if replace:
+            # draws the strata of the files, then the files uniformly within their stratum
+            cdf = numpy.cumsum(weights / weights.sum())
+            last = numpy.flatnonzero(weights)[-1]
+            codes = numpy.minimum(numpy.searchsorted(cdf, rng.random_sample(size), side='right'), last)
+            within = (rng.random_sample(size) * self.counts[codes]).astype(numpy.int64)
+            return self._order[self._offsets[codes] + within]
+
+        # weighted sampling without replacement: the files with the largest log(u) / p are drawn
+        with numpy.errstate(divide='ignore'):
+            probabilities = (weights / numpy.maximum(self.counts, 1))[self.codes]
+            keys = numpy.where(probabilities > 0, numpy.log(rng.random_sample(len(self.files))) / probabilities,
+                               -numpy.inf)
+        if size > numpy.count_nonzero(probabilities):
+            raise ValueError("Cannot draw %d files without replacement from %d files of the given strata" %
+                             (size, numpy.count_nonzero(probabilities)))
+        drawn = numpy.argpartition(-keys, size - 1)[:size] if size else numpy.zeros((0,), dtype=numpy.int64)
+        return drawn[numpy.argsort(-keys[drawn], kind='stable')]
+
+    def epoch(self, seed, strategy='stratified', **kwargs):
+        """Returns the positions of the files of an epoch drawn with the given
+        ``strategy``: ``'shuffle'``, ``'stratified'`` or ``'weighted'``, see the
+        methods of the same names; other arguments are passed to
+        :py:meth:`weighted`"""
+
+        if strategy == 'weighted':
+            return self.weighted(seed, **kwargs)
+        if kwargs:
+            raise TypeError("Invalid arguments for strategy '%s': %s" % (strategy, ', '.join(sorted(kwargs))))
+        if strategy == 'stratified':
+            return self.stratified(seed)
+        if strategy == 'shuffle':
+            return self.shuffle(seed)
+        raise ValueError("Invalid strategy '%s'. Valid values are ('shuffle', 'stratified', 'weighted')" % strategy)
+
+    def __repr__(self):
+        return "Sampler(%d files, %d strata by %s)" % (len(self.files), len(self.strata), ', '.join(self.by))
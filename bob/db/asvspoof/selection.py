@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Lazy, chainable selections of files.
+
+A :py:class:`Selection`, returned by :py:meth:`.Database.query`, only records
+the filters given to it; nothing is read from the database until one of its
+terminal methods is called. Each terminal then runs a single ``SELECT`` of the
+columns it needs (e.g., only the paths of the files), with the counting,
+ordering and paging done by the database instead of in Python:
+
+.. code-block:: python
+
+    attacks = db.query().protocol('CM').group('eval').purpose('attack')
+    n = attacks.support('S10').count()
+    first = attacks.page(0, 100)
+
+With the ``snapshot`` backend, the terminals work on the arrays of the
+snapshot instead. With the ``remote`` backend, they are computed from the
+files returned by the server.
+"""
+
+from sqlalchemy import distinct, func
+
+from .models import File, FileRecord, make_paths
+from .query import RECORD_COLUMNS
+
+
+FILTERS = {
+    'support': ('support', lambda db: db.attack_supports()),
+    'protocol': ('protocol', lambda db: db.protocol_names()),
+    'groups': ('group', lambda db: db.groups()),
+    'purposes': ('purpose', lambda db: db.purposes()),
+    'gender': ('gender', lambda db: db.genders()),
+    'clients': ('client', lambda db: [k.id for k in db.clients()]),
+}
+"""The arguments of :py:meth:`.Database.objects` set by the filters of a
+:py:class:`Selection`, with the description of their values and a function
+listing the valid ones of a :py:class:`.Database`"""
+
+
+def _values(args):
+    """Returns the values given to a filter either as several arguments or as
+    a single sequence"""
+
+    if len(args) == 1 and isinstance(args[0], (list, tuple, set)):
+        return tuple(args[0])
+    return args
+
+
+class Selection(object):
+    """A lazy selection of the files of a :py:class:`.Database`, see the module
+    documentation
+
+    The filters have the semantics of the arguments of
+    :py:meth:`.Database.objects`, with the same defaults for the filters that
+    are not set (e.g., only ``real`` files of the ``CM`` protocol). Each filter
+    returns a new selection, so that selections can be shared and refined;
+    setting a filter again replaces its values. The values are checked when the
+    filter is set, against the same vocabularies as
+    :py:meth:`.Database.objects`.
+
+    The files are always ordered by path.
+    """
+
+    def __init__(self, db, query=None):
+        self._db = db
+        self._query = dict(query or {})
+
+    def _filter(self, name, args):
+        description, valid = FILTERS[name]
+        values = _values(args)
+        if not values:
+            raise ValueError("No %s given" % description)
+        self._db.check_parameters_for_validity(values, description, valid(self._db))
+        query = dict(self._query)
+        query[name] = values
+        return Selection(self._db, query)
+
+    def protocol(self, *names):
+        """Keeps the files of the given protocols"""
+
+        return self._filter('protocol', names)
+
+    def group(self, *groups):
+        """Keeps the files of the given groups (``train``, ``dev``, ``eval``)"""
+
+        return self._filter('groups', groups)
+
+    def purpose(self, *purposes):
+        """Keeps the files of the given purposes (e.g., ``real``, ``attack``)"""
+
+        return self._filter('purposes', purposes)
+
+    def support(self, *supports):
+        """Keeps the files of the given attack types (e.g., ``S1``)"""
+
+        return self._filter('support', supports)
+
+    def gender(self, *genders):
+        """Keeps the files of the clients of the given genders"""
+
+        return self._filter('gender', genders)
+
+    def client(self, *ids):
+        """Keeps the files of the given clients"""
+
+        return self._filter('clients', ids)
+
+    def arguments(self):
+        """Returns the filters of this selection as arguments of
+        :py:meth:`.Database.objects`"""
+
+        return dict(self._query)
+
+    def _select(self):
+        """Checks the filters and returns the backend of the database (``sql``,
+        ``snapshot`` or ``remote``), and the rows of the selected files in the
+        snapshot or the parameters of :py:meth:`.Database.objects`"""
+
+        db = self._db
+        db.assert_validity()
+        support, protocol, groups, purposes, gender, clients = parameters = db._check_object_query(self._query)
+        if db._snapshot is not None:
+            return 'snapshot', db._snapshot.select(protocol, groups, purposes, support, gender, clients)
+        if db._remote is not None:
+            return 'remote', parameters
+        return 'sql', parameters
+
+    def _execute(self, parameters, columns, offset=0, limit=None):
+        """Runs the SQL query of the given columns of the selected files,
+        ordered by path, and returns its result"""
+
+        # files linked to several protocols are returned once
+        q = self._db._files_query(columns, *parameters).distinct().order_by(File.path)
+        if offset or limit is not None:
+            q = q.limit(-1 if limit is None else limit).offset(offset)
+        return self._db.session.execute(q.statement)
+
+    def _objects(self):
+        """Returns all selected files, from the server of the remote backend"""
+
+        return self._db.objects(lightweight=True, **self._query)
+
+    def count(self):
+        """Returns the number of selected files"""
+
+        call = self._db._profile('query.count')
+        backend, selected = self._select()
+        call.validated()
+        if backend == 'snapshot':
+            retval = len(selected)
+        elif backend == 'remote':
+            retval = self._db.count(**self._query)
+        else:
+            retval = self._db._files_query((func.count(distinct(File.id)),), *selected).scalar()
+        call.done(1)
+        return retval
+
+    def ids(self):
+        """Returns the ids of the selected files"""
+
+        call = self._db._profile('query.ids')
+        backend, selected = self._select()
+        call.validated()
+        if backend == 'snapshot':
+            retval = self._db._snapshot.file_id[selected].tolist()
+        elif backend == 'remote':
+            retval = [k.id for k in self._objects()]
+        else:
+            retval = [k[0] for k in self._execute(selected, (File.id,))]
+        call.done(len(retval))
+        return retval
+
+    def paths(self, prefix='', extension=''):
+        """Returns the paths of the selected files, with the given ``prefix``
+        (e.g., a directory) and ``extension``, as :py:meth:`.File.make_path`
+        does"""
+
+        call = self._db._profile('query.paths')
+        backend, selected = self._select()
+        call.validated()
+        if backend == 'snapshot':
+            stems = [self._db._snapshot.path(k) for k in selected.tolist()]
+        elif backend == 'remote':
+            stems = [k.path for k in self._objects()]
+        else:
+            stems = [k[0] for k in self._execute(selected, (File.path,))]
+        retval = make_paths(stems, prefix, extension)
+        call.done(len(retval))
+        return retval
+
+    def page(self, offset, limit):
+        """Returns the :py:class:`.FileRecord` objects of at most ``limit``
+        selected files, starting at the ``offset``-th one"""
+
+        if offset < 0 or limit < 0:
+            raise ValueError("Invalid page (%d, %d)" % (offset, limit))
+        call = self._db._profile('query.page')
+        backend, selected = self._select()
+        call.validated()
+        if backend == 'snapshot':
+            retval = self._db._snapshot.records(selected[offset:offset + limit])
+        elif backend == 'remote':
+            retval = self._objects()[offset:offset + limit]
+        else:
+            retval = [FileRecord(*k[:len(RECORD_COLUMNS)])
+                      for k in self._execute(selected, RECORD_COLUMNS, offset, limit)]
+        call.done(len(retval))
+        return retval
+
+    def iter(self, batch=1000):
+        """Iterates over the :py:class:`.FileRecord` objects of the selected
+        files, fetching ``batch`` rows at a time from the result of a single
+        query"""
+
+        backend, selected = self._select()
+        if backend == 'snapshot':
+            for start in range(0, len(selected), batch):
+                for k in self._db._snapshot.records(selected[start:start + batch]):
+                    yield k
+        elif backend == 'remote':
+            for k in self._objects():
+                yield k
+        else:
+            rows = self._execute(selected, RECORD_COLUMNS)
+            try:
+                while True:
+                    chunk = rows.fetchmany(batch)
+                    if not chunk:
+                        break
+                    for k in chunk:
+                        yield FileRecord(*k[:len(RECORD_COLUMNS)])
+            finally:
+                rows.close()
+
+    def __iter__(self):
+        return self.iter()
+
+    def __repr__(self):
+        return "Selection(%s)" % ', '.join('%s=%r' % k for k in sorted(self._query.items()))
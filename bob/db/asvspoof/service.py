@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A local HTTP service answering queries from an in-memory copy of the
+database, and the client used by the ``remote`` backend of
+:py:class:`.Database`.
+
+The server is started with ``bob_dbmanage.py asvspoof serve``, which loads the
+snapshot of the database (see :py:mod:`bob.db.asvspoof.snapshot`) into memory
+once, so that jobs using the ``remote`` backend do not open the SQLite file
+themselves. It listens on a TCP address or on a Unix socket. All endpoints take
+and return JSON, compressed with gzip if the client accepts it:
+
+``GET /info``
+    The clients and protocols of the database.
+
+``POST /objects``
+    The files for a batch of queries (``{"queries": [...]}``, each with the
+    arguments of :py:meth:`.Database.objects`), in columnar form.
+
+``POST /count``
+    The number of files for a batch of queries.
+
+``POST /paths``
+    The paths of a list of file ids, see :py:meth:`.Database.paths`.
+
+``POST /reverse``
+    The ids of a list of file stems, prefixes or patterns, see
+    :py:meth:`.Database.reverse`.
+
+``POST /files``
+    The files of a list of file ids, in columnar form, skipping unknown ids.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import gzip
+import json
+import socket
+import logging
+import threading
+
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_VARIABLE = 'BOB_DB_ASVSPOOF_SERVER'
+"""The environment variable with the address of the server used by default by
+the ``remote`` backend"""
+
+
+def _records_columns(snapshot, rows, protocols=False, audio=False):
+    """Returns the files of the given snapshot rows as columns of plain values,
+    with categorical values as indexes into the ``*_choices`` of
+    :py:class:`.File`, clients as indexes into the clients of ``/info`` and,
+    if ``protocols`` is set, the indexes of the protocols of each file. If
+    ``audio`` is set, the numbers of samples and the rates of the audio files
+    are added"""
+
+    starts = snapshot.path_offsets[rows].tolist()
+    ends = snapshot.path_offsets[rows + 1].tolist()
+    blob = snapshot._blob
+    retval = {
+        'id': snapshot.file_id[rows].tolist(),
+        'path': [str(blob[s:e], 'utf-8') for s, e in zip(starts, ends)],
+        'purpose': snapshot.file_purpose[rows].tolist(),
+        'attacktype': snapshot.file_attacktype[rows].tolist(),
+        'group': snapshot.file_group[rows].tolist(),
+        'client': snapshot.file_client[rows].tolist(),
+    }
+    if protocols:
+        index = dict((id(k), i) for i, k in enumerate(snapshot.protocol_records))
+        retval['protocols'] = [[index[id(p)] for p in k] for k in snapshot.protocols(rows)]
+    if audio:
+        retval['samples'] = snapshot.file_samples[rows].tolist()
+        retval['rate'] = snapshot.file_rate[rows].tolist()
+    return retval
+
+
+class Service(object):
+    """Answers the requests of the endpoints from a snapshot, see the module
+    documentation
+
+    Keyword parameters:
+
+    snapshot
+        The :py:class:`bob.db.asvspoof.snapshot.Snapshot` holding the database.
+    """
+
+    def __init__(self, snapshot):
+        from .query import Database
+
+        self.snapshot = snapshot
+        self.db = Database(backend='snapshot', snapshot=snapshot)
+        # builds the lazy lookup tables before serving concurrent requests
+        self.db._stem_index()
+        snapshot.rows_by_id([])
+        snapshot.protocols([])
+
+    def info(self, request=None):
+        return {
+            'clients': [[k.id, k.gender, k.group] for k in self.snapshot.client_records],
+            'protocols': [[k.id, k.name] for k in self.snapshot.protocol_records],
+        }
+
+    def _select(self, query):
+        query = dict(query)
+        shard, balance_by = sharding.check_shard(query.pop('shard', None), query.pop('balance_by', None))
+        min_duration = query.pop('min_duration', None)
+        max_duration = query.pop('max_duration', None)
+        order_by = query.pop('order_by', 'path')
+        if order_by not in ('path', 'duration'):
+            raise ValueError("Invalid order '%s'" % order_by)
+        if (min_duration is not None or max_duration is not None or order_by == 'duration' or
+                balance_by == 'duration') and not self.snapshot.indexed:
+            raise ValueError("The audio files of the database are not indexed")
+        support, protocol, groups, purposes, gender, clients = self.db._check_object_query(query)
+        rows = self.snapshot.select(protocol, groups, purposes, support, gender, clients)
+        rows = self.snapshot.restrict(rows, min_duration, max_duration)
+        if shard is not None:
+            rows = self.snapshot.shard(rows, shard, balance_by)
+        if order_by == 'duration':
+            rows = self.snapshot.sort_by_duration(rows)
+        return rows
+
+    def objects(self, request):
+        related = request.get('load_related') or ()
+        return {'results': [_records_columns(self.snapshot, self._select(k), 'protocols' in related,
+                                             'audio' in related)
+                            for k in request['queries']]}
+
+    def count(self, request):
+        return {'counts': [len(self._select(k)) for k in request['queries']]}
+
+    def paths(self, request):
+        return {'paths': self.db.paths(request['ids'], request.get('prefix', ''), request.get('suffix', ''))}
+
+    def reverse(self, request):
+        return {'ids': self.db.reverse(request['paths'], request.get('match', 'exact'))}
+
+    def files(self, request):
+        rows = self.snapshot.rows_by_id(request['ids'])
+        return {'files': _records_columns(self.snapshot, rows[rows >= 0])}
+
+    ENDPOINTS = ('info', 'objects', 'count', 'paths', 'reverse', 'files')
+
+    def handle(self, endpoint, request):
+        """Returns the response to a request to the given endpoint"""
+
+        if endpoint not in self.ENDPOINTS:
+            raise KeyError(endpoint)
+        return getattr(self, endpoint)(request)
+
+
+def _handler_class(service, tcp):
+    """Returns the request handler class of an HTTP server for the service"""
+
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        # headers and body are written separately on kept-alive connections
+        disable_nagle_algorithm = tcp
+
+        def _respond(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data, compresslevel=1)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _dispatch(self, request):
+            endpoint = self.path.strip('/')
+            if endpoint not in service.ENDPOINTS:
+                return self._respond(404, {'error': "Unknown endpoint '%s'" % endpoint})
+            try:
+                self._respond(200, service.handle(endpoint, request))
+            except KeyError as e:
+                # a key missing from the request
+                self._respond(400, {'error': 'Invalid request, missing %s' % e})
+            except (ValueError, TypeError) as e:
+                self._respond(400, {'error': str(e)})
+
+        def do_GET(self):
+            self._dispatch({})
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                request = json.loads(data.decode('utf-8'))
+            except ValueError as e:
+                return self._respond(400, {'error': 'Invalid request: %s' % e})
+            self._dispatch(request)
+
+        def address_string(self):
+            # Unix sockets have no client address
+            return self.client_address[0] if self.client_address else 'local'
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def make_server(service, address):
+    """Returns a multi-threaded HTTP server for the service, which is not
+    started yet
+
+    Keyword parameters:
+
+    service
+        The :py:class:`Service` answering the requests.
+
+    address
+        Either a tuple ``(host, port)`` to listen on TCP, or the path of a Unix
+        socket.
+    """
+
+    import socketserver
+    from http.server import HTTPServer
+
+    handler = _handler_class(service, tcp=isinstance(address, tuple))
+    if isinstance(address, tuple):
+        server_class = type('Server', (socketserver.ThreadingMixIn, HTTPServer), {'daemon_threads': True})
+    else:
+        server_class = type('Server', (socketserver.ThreadingMixIn, socketserver.UnixStreamServer),
+                            {'daemon_threads': True})
+    return server_class(address, handler)
+
+
+def _connection(address, timeout):
+    """Returns an HTTP connection to the given address, see
+    :py:class:`ServiceClient`"""
+
+    import http.client
+
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+
+        class UnixConnection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(path)
+
+        return UnixConnection('localhost', timeout=timeout)
+
+    host = address.split('://', 1)[-1].rstrip('/')
+    return http.client.HTTPConnection(host, timeout=timeout)
+
+
+class ServiceClient(object):
+    """Queries a server started by ``bob_dbmanage.py asvspoof serve``
+
+    Files, clients and protocols are returned as :py:class:`.FileRecord`,
+    :py:class:`.ClientRecord` and :py:class:`.ProtocolRecord` objects.
+
+    Keyword parameters:
+
+    address
+        [optional] The address of the server, either ``http://HOST:PORT`` or
+        ``unix:PATH``. If not set, it is taken from the environment variable
+        :py:data:`ADDRESS_VARIABLE`.
+
+    timeout
+        The timeout of the requests, in seconds.
+    """
+
+    def __init__(self, address=None, timeout=60.):
+        from .models import ClientRecord, ProtocolRecord
+
+        address = address or os.environ.get(ADDRESS_VARIABLE)
+        if not address:
+            raise ValueError("The address of the server is not set, please give one or set %s" % ADDRESS_VARIABLE)
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+        info = self.request('info')
+        self.client_records = [ClientRecord(*k) for k in info['clients']]
+        self.protocol_records = [ProtocolRecord(*k) for k in info['protocols']]
+
+    def request(self, endpoint, body=None):
+        """Sends a request to the given endpoint and returns the decoded
+        response; requests with a ``body`` are sent with ``POST``"""
+
+        # connections are kept open, one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = _connection(self.address, self.timeout)
+        headers = {'Accept-Encoding': 'gzip'}
+        try:
+            if body is None:
+                connection.request('GET', '/' + endpoint, headers=headers)
+            else:
+                headers['Content-Type'] = 'application/json'
+                connection.request('POST', '/' + endpoint, json.dumps(body).encode('utf-8'), headers)
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            self._local.connection = None
+            raise
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        retval = json.loads(data.decode('utf-8'))
+        if response.status == 400:
+            raise ValueError(retval['error'])
+        if response.status != 200:
+            raise IOError("Request to %s/%s failed (%d): %s" % (self.address, endpoint, response.status,
+                                                                 retval.get('error')))
+        return retval
+
+    def objects(self, queries, load_related=()):
+        """Returns, for each of the given queries (dictionaries with the
+        arguments of :py:meth:`.Database.objects`), the list of matching
+        :py:class:`.FileRecord` objects, with a single request"""
+
+        from .models import File, FileRecord, AudioRecord
+
+        load_related = list(load_related or ())
+        results = self.request('objects', {'queries': queries, 'load_related': load_related})['results']
+        clients = self.client_records
+        protocols = self.protocol_records
+        purposes = File.purpose_choices
+        attacks = File.attacktype_choices
+        groups = File.group_choices
+        retval = []
+        for k in results:
+            files = [FileRecord(i, s, purposes[p], attacks[a], groups[g], clients[c].id, clients[c])
+                     for i, s, p, a, g, c in zip(k['id'], k['path'], k['purpose'], k['attacktype'], k['group'],
+                                                 k['client'])]
+            if 'protocols' in k:
+                for f, indexes in zip(files, k['protocols']):
+                    f.protocols = tuple(protocols[p] for p in indexes)
+            if 'samples' in k:
+                for f, samples, rate in zip(files, k['samples'], k['rate']):
+                    if rate > 0:
+                        f.audio = AudioRecord(samples, rate)
+            retval.append(files)
+        return retval
+
+    def count(self, queries):
+        """Returns the number of files of each of the given queries"""
+
+        return self.request('count', {'queries': queries})['counts']
+
+    def paths(self, ids, prefix='', suffix=''):
+        """See :py:meth:`.Database.paths`"""
+
+        return self.request('paths', {'ids': list(ids), 'prefix': prefix, 'suffix': suffix})['paths']
+
+    def reverse(self, paths, match='exact'):
+        """See :py:meth:`.Database.reverse`"""
+
+        return self.request('reverse', {'paths': list(paths), 'match': match})['ids']
+
+    def files(self, ids):
+        """Returns the files with the given ids, in the same order, as columns
+        of plain values: categorical values are indexes into the ``*_choices``
+        of :py:class:`.File` and clients indexes into :py:attr:`client_records`"""
+
+        return self.request('files', {'ids': [int(k) for k in ids]})['files']
+
+
+def serve(args):
+    """Serves the database from memory to local jobs"""
+
+    from .query import Database
+    from .snapshot import Snapshot
+
+    db = Database(args.sqlite_file)
+    if Snapshot.exists(db.sqlite_file):
+        snapshot = Snapshot.load(db.sqlite_file, mmap_mode=None)
+    else:
+        db.assert_validity()
+        snapshot = Snapshot.from_session(db.session)
+    del db
+
+    if args.socket:
+        address = args.socket
+        if os.path.exists(address):
+            os.unlink(address)
+        url = 'unix:%s' % address
+    else:
+        host, port = args.address.rsplit(':', 1)
+        address = (host, int(port))
+
+    server = make_server(Service(snapshot), address)
+    if not args.socket:
+        url = 'http://%s:%d' % server.server_address[:2]
+    print("Serving %d files at %s (set %s=%s to use it)" % (len(snapshot), url, ADDRESS_VARIABLE, url))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "serve" can use"""
+
+    parser = subparsers.add_parser('serve', help=serve.__doc__)
+
+    parser.add_argument('-a', '--address', default='127.0.0.1:8631', metavar='HOST:PORT',
+                        help="the TCP address to listen on; use port 0 to pick a free port (defaults to %(default)s)")
+    parser.add_argument('-s', '--socket', default=None, metavar='PATH',
+                        help="if given, the server listens on this Unix socket instead of a TCP address")
+    parser.add_argument('-D', '--sqlite-file', default=None, metavar='FILE',
+                        help="the SQLite file to serve (defaults to the one installed with this package)")
+
+    parser.set_defaults(func=serve)  # action
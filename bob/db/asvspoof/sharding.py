@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Deterministic partitioning of the files of a query into shards.
+
+The files returned by :py:meth:`.Database.objects` are sorted by path, which
+groups them by client and by attack. Taking contiguous slices of that list
+gives unbalanced shards, so the shards are dealt round-robin instead: the files
+are ordered by the balancing key (stable, so by path within a key) and the
+``i``-th of ``n`` shards takes every ``n``-th file, starting at ``i``. Each
+shard then holds the same number of files of each key, give or take one. The
+files of a shard stay sorted by path.
+
+Shards balanced by duration are filled greedily instead: the files are taken
+from the longest to the shortest and each is given to the shard with the
+least total duration so far (or with the fewest files, in case of a tie), so
+that all shards hold about the same amount of audio. Files that are not
+indexed (see :py:mod:`bob.db.asvspoof.audioindex`) count as empty.
+
+The assignment only depends on the files of the query and their keys, so all
+workers of a job compute the same partition independently, whatever backend
+they use.
+"""
+
+import heapq
+import numpy
+
+
+BALANCE_KEYS = ('client', 'attacktype', 'duration')
+"""The keys the shards can be balanced by"""
+
+
+def check_shard(shard, balance_by):
+    """Checks the sharding arguments of :py:meth:`.Database.objects` and
+    returns them as ``(index, count)`` and the balancing key, or ``None`` if
+    sharding is not requested"""
+
+    if shard is None:
+        if balance_by is not None:
+            raise ValueError("The shards can only be balanced (by '%s') if a shard is requested" % balance_by)
+        return None, None
+    try:
+        index, count = (int(k) for k in shard)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid shard %r, it should be a tuple (index, count)" % (shard,))
+    if count < 1:
+        raise ValueError("Invalid shard %r, the number of shards should be positive" % (shard,))
+    if not 0 <= index < count:
+        raise ValueError("Invalid shard %r, the index should be between 0 and %d" % (shard, count - 1))
+    if balance_by is not None and balance_by not in BALANCE_KEYS:
+        raise ValueError("Invalid balancing key '%s'. Valid values are %s" % (balance_by, BALANCE_KEYS))
+    return (index, count), balance_by
+
+
+def positions(size, shard, keys=None, weights=None):
+    """Returns the positions of the files of a shard
+
+    Keyword parameters:
+
+    size
+        The number of files of the query.
+
+    shard
+        The tuple ``(index, count)`` of the shard.
+
+    keys
+        [optional] The integer ranks of the balancing keys of the files, in
+        path order. If not set, the files are dealt in path order.
+
+    weights
+        [optional] The durations of the files, in path order, with NaN for
+        unknown durations. If set, the shards are balanced by duration and
+        ``keys`` is ignored.
+
+    Returns the sorted positions, in the path-ordered files of the query, of
+    the files of the shard.
+    """
+
+    index, count = shard
+    if weights is not None:
+        weights = numpy.nan_to_num(numpy.asarray(weights, dtype=numpy.float64))
+        # the heap holds the total duration, the number of files and the index of every shard
+        heap = [(0., 0, k) for k in range(count)]
+        selected = []
+        order = numpy.argsort(-weights, kind='stable')
+        for position, weight in zip(order.tolist(), weights[order].tolist()):
+            total, files, target = heap[0]
+            if target == index:
+                selected.append(position)
+            heapq.heapreplace(heap, (total + weight, files + 1, target))
+        return numpy.array(sorted(selected), dtype=numpy.int64)
+    if keys is None:
+        return numpy.arange(index, size, count)
+    order = numpy.argsort(numpy.asarray(keys), kind='stable')
+    return numpy.sort(order[index::count])
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Publishes the file table, or the result of a query, in shared memory.
+
+The columnar arrays of a :py:class:`bob.db.asvspoof.snapshot.Snapshot` are
+copied once into a :py:class:`multiprocessing.shared_memory.SharedMemory`
+segment by a parent process with :py:meth:`.Database.publish`. Worker
+processes attach to the segment by name with :py:func:`attach` and read the
+arrays in place, so that the metadata is not duplicated in every worker. The
+segment starts with a small JSON header describing the arrays, followed by the
+raw array data; nothing is pickled.
+
+This module requires Python 3.8 or later. Before Python 3.13, segments are
+destroyed when a process that attached to them exits, unless that process was
+started by the publisher (e.g., with :py:mod:`multiprocessing`), so workers
+should be children of the publishing process.
+"""
+
+import json
+import struct
+import warnings
+import numpy
+
+from .snapshot import ARRAYS, Snapshot
+
+
+_ALIGNMENT = 64
+"""The alignment in bytes of the arrays inside the segment"""
+
+
+def _open(name=None, size=0):
+    """Creates (if ``size`` is set) or opens a shared memory segment"""
+
+    from multiprocessing import shared_memory
+
+    if size:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        # the segment is owned by the publisher, don't clean it up on exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached segments with the resource tracker,
+        # which is shared by the publisher and the workers it started
+        return shared_memory.SharedMemory(name=name)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedFiles(object):
+    """A read-only sequence of :py:class:`.FileRecord` objects over the files
+    of a :py:class:`SharedTable`, in the order they were published
+
+    Records are built on access, so that only the files that are used are
+    materialized in the worker.
+    """
+
+    def __init__(self, snapshot, order):
+        self.snapshot = snapshot
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.snapshot.records(self.order[index])
+        return self.snapshot.record(self.order[index])
+
+    def __iter__(self, batch=1024):
+        for start in range(0, len(self.order), batch):
+            for record in self.snapshot.records(self.order[start:start + batch]):
+                yield record
+
+
+class SharedTable(object):
+    """A file table stored in a shared memory segment, see the module
+    documentation
+
+    Use :py:meth:`.Database.publish` or :py:func:`attach` to obtain one. The
+    publisher owns the segment and should :py:meth:`unlink` it once all workers
+    are done, e.g., by using the table as a context manager.
+
+    Attributes:
+
+    name
+        The name of the segment, to be passed to :py:func:`attach`.
+
+    snapshot
+        The :py:class:`bob.db.asvspoof.snapshot.Snapshot` whose arrays live in
+        the segment.
+
+    files
+        The published files, as a :py:class:`SharedFiles` sequence.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+        size, = struct.unpack_from('<Q', shm.buf, 0)
+        header = json.loads(bytes(shm.buf[8:8 + size]).decode('utf-8'))
+        arrays = {}
+        for name, dtype, shape, offset in header['arrays']:
+            # frombuffer holds an export of the buffer, so that the segment cannot be closed under the arrays
+            count = int(numpy.prod(shape, dtype=numpy.int64))
+            arrays[name] = numpy.frombuffer(shm.buf, dtype=numpy.dtype(dtype), count=count,
+                                            offset=offset).reshape(shape)
+            arrays[name].flags.writeable = False
+        self.order = arrays.pop('order')
+        self.snapshot = Snapshot(arrays)
+        self.files = SharedFiles(self.snapshot, self.order)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return len(self.order)
+
+    def database(self):
+        """Returns a :py:class:`.Database` answering queries from the files of
+        this table with the ``snapshot`` backend"""
+
+        from .query import Database
+        return Database(backend='snapshot', snapshot=self.snapshot)
+
+    def close(self):
+        """Detaches from the segment in this process
+
+        The arrays of :py:attr:`snapshot`, and the :py:class:`.Database`
+        objects returned by :py:meth:`database`, are views into the segment and
+        should be deleted first (the records of :py:attr:`files` are copies).
+        While some of them are alive, the segment cannot be detached: a
+        :py:exc:`ResourceWarning` is issued and ``False`` is returned, and
+        ``close`` should be called again once they are deleted.
+        """
+
+        if self.shm is None:
+            return True
+        # drops the views into the segment before closing it
+        self.files = self.snapshot = self.order = None
+        try:
+            self.shm.close()
+        except BufferError:
+            warnings.warn("Shared table '%s' is still in use, delete the arrays and databases taken from it before "
+                          "closing it" % self.shm.name, ResourceWarning)
+            return False
+        self.shm = None
+        return True
+
+    def unlink(self):
+        """Detaches from the segment and destroys it, which should only be done
+        by the publisher"""
+
+        shm = self.shm
+        self.close()
+        if shm is not None:
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+def publish(snapshot, rows=None, name=None):
+    """Copies the arrays of a snapshot into a new shared memory segment
+
+    Keyword parameters:
+
+    snapshot
+        The :py:class:`bob.db.asvspoof.snapshot.Snapshot` to publish.
+
+    rows
+        [optional] The rows of the files to publish, in the order in which they
+        are exposed by :py:attr:`SharedTable.files`. If not set, all files are
+        published.
+
+    name
+        [optional] The name of the segment. If not set, a unique name is chosen.
+
+    Returns the :py:class:`SharedTable` owning the new segment.
+    """
+
+    if rows is None:
+        order = numpy.arange(len(snapshot), dtype=numpy.int64)
+    else:
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        unique = numpy.unique(rows)
+        snapshot = snapshot.take(unique)
+        order = numpy.searchsorted(unique, rows)
+
+    arrays = snapshot.arrays()
+    arrays['order'] = order
+
+    # the header is written with the final offsets, so its size is estimated first
+    names = list(ARRAYS) + ['order']
+    header = {'arrays': [[k, arrays[k].dtype.str, list(arrays[k].shape), 0] for k in names]}
+    offset = _align(8 + len(json.dumps(header)) + 32 * len(names))
+    for entry in header['arrays']:
+        entry[3] = offset
+        offset = _align(offset + arrays[entry[0]].nbytes)
+    encoded = json.dumps(header).encode('utf-8')
+    if 8 + len(encoded) > header['arrays'][0][3]:
+        raise ValueError("The header of the table (%d bytes) does not fit before its arrays" % len(encoded))
+
+    shm = _open(name, size=max(offset, 1))
+    struct.pack_into('<Q', shm.buf, 0, len(encoded))
+    shm.buf[8:8 + len(encoded)] = encoded
+    for name, dtype, shape, start in header['arrays']:
+        target = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=shm.buf, offset=start)
+        target[...] = arrays[name]
+        del target
+    return SharedTable(shm, owner=True)
+
+
+def attach(name):
+    """Attaches to a segment published by another process, without copying it
+
+    Returns a :py:class:`SharedTable`, which should be closed when not needed
+    anymore.
+    """
+
+    return SharedTable(_open(name), owner=False)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A compiled, read-only copy of the database in columnar NumPy arrays.
+
+The snapshot is written by ``bob_dbmanage.py asvspoof create`` next to the
+SQLite file, as one ``.npy`` file per array, and is loaded with memory mapping,
+so that opening it only costs a few ``mmap`` calls and the arrays are shared by
+all processes reading them. No pickled data is stored.
+
+Categorical columns are stored as ``int8`` codes, which are indexes into the
+corresponding ``*_choices`` tuples of :py:class:`.File` and
+:py:class:`.Client`. The file stems are stored in a single byte blob with
+offsets. Files are sorted by path, which is the order of
+:py:meth:`.Database.objects`. The lengths of the audio files (see
+:py:mod:`bob.db.asvspoof.audioindex`) are stored as numbers of samples and
+sampling rates, which are ``-1`` and ``0`` for files that are not indexed.
+The bitmaps of the files of each protocol, purpose, attack type, group and
+gender (see :py:mod:`bob.db.asvspoof.bitmap`) are stored as one row of packed
+bits each.
+"""
+
+import os
+import numpy
+
+from .models import Client, File, Protocol, ProtocolFiles, AudioInfo, AudioRecord, ClientRecord, FileRecord, \
+    ProtocolRecord
+from . import sharding
+from .bitmap import Bitmap, KINDS, compile_bitmaps
+
+
+ARRAYS = (
+    'file_id', 'file_group', 'file_purpose', 'file_attacktype', 'file_client', 'file_samples', 'file_rate',
+    'path_offsets', 'path_blob',
+    'client_id', 'client_gender', 'client_group',
+    'protocol_id', 'protocol_name', 'protocol_offsets', 'link_file',
+    'bitmap_name', 'bitmap_bits',
+)
+"""The names of the arrays of a snapshot"""
+
+
+def snapshot_files(sqlite_file):
+    """Returns the names of the files of the snapshot of the given SQLite file"""
+
+    base = os.path.splitext(sqlite_file)[0]
+    return ['%s.snapshot.%s.npy' % (base, k) for k in ARRAYS]
+
+
+def _codes(values, choices):
+    """Converts categorical values into codes into ``choices``"""
+
+    index = dict((v, k) for k, v in enumerate(choices))
+    return numpy.array([index.get(v, -1) for v in values], dtype=numpy.int8)
+
+
+def _blob(strings):
+    """Concatenates the given strings into a byte blob, returning the blob and
+    the offsets of the strings"""
+
+    encoded = [k.encode('utf-8') for k in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(k) for k in encoded], out=offsets[1:])
+    blob = numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8)
+    return blob, offsets
+
+
+class Snapshot(object):
+    """The database tables in columnar arrays, see the module documentation
+
+    Keyword parameters:
+
+    arrays
+        A dictionary with all :py:data:`ARRAYS`.
+    """
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+        self.client_records = [ClientRecord(str(i), Client.gender_choices[g], Client.group_choices[r])
+                               for i, g, r in zip(self.client_id.tolist(), self.client_gender.tolist(),
+                                                  self.client_group.tolist())]
+        self.protocol_records = [ProtocolRecord(i, str(n))
+                                 for i, n in zip(self.protocol_id.tolist(), self.protocol_name.tolist())]
+        self._blob = memoryview(self.path_blob)
+        self._text = None
+        self._rows_by_id = None
+        self._links_by_file = None
+        self._bitmaps = dict((str(k), i) for i, k in enumerate(self.bitmap_name.tolist()))
+
+    def __len__(self):
+        return len(self.file_id)
+
+    @classmethod
+    def from_session(cls, session):
+        """Compiles the snapshot from the tables of an SQLAlchemy session"""
+
+        clients = session.query(Client.id, Client.gender, Client.group).order_by(Client.id).all()
+        client_index = dict((k[0], i) for i, k in enumerate(clients))
+
+        files = session.query(File.id, File.path, File.group, File.purpose, File.attacktype,
+                              File.client_id).order_by(File.path).all()
+        file_row = dict((k[0], i) for i, k in enumerate(files))
+
+        protocols = session.query(Protocol.id, Protocol.name).order_by(Protocol.id).all()
+        protocol_index = dict((k[0], i) for i, k in enumerate(protocols))
+
+        # links are sorted by protocol, then by path
+        links = sorted((protocol_index[int(p)], file_row[int(f)])
+                       for p, f in session.query(ProtocolFiles.protocol_id, ProtocolFiles.file_id))
+        protocol_offsets = numpy.searchsorted(numpy.array([k[0] for k in links], dtype=numpy.int64),
+                                              numpy.arange(len(protocols) + 1))
+
+        path_blob, path_offsets = _blob([k[1] for k in files])
+
+        file_samples = numpy.full(len(files), -1, dtype=numpy.int64)
+        file_rate = numpy.zeros(len(files), dtype=numpy.int32)
+        from sqlalchemy import inspect
+        if AudioInfo.__tablename__ in inspect(session.get_bind()).get_table_names():
+            for file_id, samples, rate in session.query(AudioInfo.file_id, AudioInfo.samples, AudioInfo.rate):
+                row = file_row.get(int(file_id))
+                if row is not None:
+                    file_samples[row] = samples
+                    file_rate[row] = rate
+
+        arrays = {
+            'file_id': numpy.array([k[0] for k in files], dtype=numpy.int64),
+            'file_group': _codes([k[2] for k in files], File.group_choices),
+            'file_purpose': _codes([k[3] for k in files], File.purpose_choices),
+            'file_attacktype': _codes([k[4] for k in files], File.attacktype_choices),
+            'file_client': numpy.array([client_index.get(k[5], -1) for k in files], dtype=numpy.int32),
+            'file_samples': file_samples,
+            'file_rate': file_rate,
+            'path_offsets': path_offsets,
+            'path_blob': path_blob,
+            'client_id': numpy.array([k[0] for k in clients], dtype=str),
+            'client_gender': _codes([k[1] for k in clients], Client.gender_choices),
+            'client_group': _codes([k[2] for k in clients], Client.group_choices),
+            'protocol_id': numpy.array([k[0] for k in protocols], dtype=numpy.int64),
+            'protocol_name': numpy.array([k[1] for k in protocols], dtype=str),
+            'protocol_offsets': protocol_offsets.astype(numpy.int64),
+            'link_file': numpy.array([k[1] for k in links], dtype=numpy.int32),
+        }
+        arrays.update(compile_bitmaps(arrays))
+        return cls(arrays)
+
+    def save(self, sqlite_file):
+        """Writes the snapshot next to the given SQLite file"""
+
+        for name, filename in zip(ARRAYS, snapshot_files(sqlite_file)):
+            numpy.save(filename, getattr(self, name), allow_pickle=False)
+
+    @classmethod
+    def exists(cls, sqlite_file):
+        """Tells if a complete snapshot exists next to the given SQLite file"""
+
+        return all(os.path.exists(k) for k in snapshot_files(sqlite_file))
+
+    @classmethod
+    def load(cls, sqlite_file, mmap_mode='r'):
+        """Loads the snapshot stored next to the given SQLite file, by default
+        with read-only memory mapping"""
+
+        return cls(dict((name, numpy.load(filename, mmap_mode=mmap_mode, allow_pickle=False))
+                        for name, filename in zip(ARRAYS, snapshot_files(sqlite_file))))
+
+    def take(self, rows):
+        """Returns a new snapshot with the files in the given rows only, together
+        with all clients and protocols
+
+        Keyword parameters:
+
+        rows
+            The rows of the files to keep, which should be unique and sorted, so
+            that the files stay sorted by path.
+        """
+
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        starts = self.path_offsets[rows]
+        lengths = self.path_offsets[rows + 1] - starts
+        path_offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=path_offsets[1:])
+        # gathers the bytes of all kept stems at once
+        index = numpy.repeat(starts - path_offsets[:-1], lengths) + numpy.arange(path_offsets[-1])
+
+        # maps the old rows to the new ones, dropping the links to other files
+        new_rows = numpy.full(len(self.file_id), -1, dtype=numpy.int64)
+        new_rows[rows] = numpy.arange(len(rows))
+        link_file = new_rows[self.link_file]
+        link_protocol = numpy.repeat(numpy.arange(len(self.protocol_id)), numpy.diff(self.protocol_offsets))
+        kept = link_file >= 0
+        protocol_offsets = numpy.zeros(len(self.protocol_id) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(link_protocol[kept], minlength=len(self.protocol_id)), out=protocol_offsets[1:])
+
+        arrays = self.arrays()
+        arrays.update({
+            'file_id': self.file_id[rows],
+            'file_group': self.file_group[rows],
+            'file_purpose': self.file_purpose[rows],
+            'file_attacktype': self.file_attacktype[rows],
+            'file_client': self.file_client[rows],
+            'file_samples': self.file_samples[rows],
+            'file_rate': self.file_rate[rows],
+            'path_offsets': path_offsets,
+            'path_blob': numpy.asarray(self.path_blob)[index],
+            'protocol_offsets': protocol_offsets,
+            'link_file': link_file[kept].astype(numpy.int32),
+        })
+        arrays.update(compile_bitmaps(arrays))
+        return Snapshot(arrays)
+
+    def arrays(self):
+        """Returns a dictionary with all :py:data:`ARRAYS` of this snapshot"""
+
+        return dict((name, getattr(self, name)) for name in ARRAYS)
+
+    def path(self, row):
+        """Returns the stem of the file in the given row"""
+
+        return str(self._blob[self.path_offsets[row]:self.path_offsets[row + 1]], 'utf-8')
+
+    def paths(self, rows):
+        """Returns the stems of the files in the given rows"""
+
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        if self._text is None:
+            text = bytes(self._blob).decode('utf-8')
+            # slicing the decoded text is only possible if characters are bytes
+            self._text = text if len(text) == len(self._blob) else False
+        blob = self._text or self._blob
+        starts = self.path_offsets[rows].tolist()
+        ends = self.path_offsets[rows + 1].tolist()
+        if self._text:
+            return [blob[s:e] for s, e in zip(starts, ends)]
+        return [str(blob[s:e], 'utf-8') for s, e in zip(starts, ends)]
+
+    def record(self, row):
+        """Returns the :py:class:`.FileRecord` of the file in the given row"""
+
+        return self.records([row])[0]
+
+    def records(self, rows):
+        """Returns the :py:class:`.FileRecord` objects of the files in the given
+        rows"""
+
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        offsets = self.path_offsets
+        blob = self._blob
+        starts = offsets[rows].tolist()
+        ends = offsets[rows + 1].tolist()
+        clients = self.file_client[rows].tolist()
+        groups = File.group_choices
+        purposes = File.purpose_choices
+        attacks = File.attacktype_choices
+        client_records = self.client_records
+        return [FileRecord(i, str(blob[s:e], 'utf-8'), purposes[p], attacks[a], groups[g],
+                           client_records[c].id if c >= 0 else None, client_records[c] if c >= 0 else None)
+                for i, s, e, p, a, g, c in zip(self.file_id[rows].tolist(), starts, ends,
+                                               self.file_purpose[rows].tolist(),
+                                               self.file_attacktype[rows].tolist(),
+                                               self.file_group[rows].tolist(), clients)]
+
+    def protocols(self, rows):
+        """Returns the protocols of the files in the given rows, as tuples of
+        :py:class:`.ProtocolRecord` objects"""
+
+        if self._links_by_file is None:
+            link_protocol = numpy.repeat(numpy.arange(len(self.protocol_id)), numpy.diff(self.protocol_offsets))
+            order = numpy.argsort(self.link_file, kind='stable')
+            self._links_by_file = (self.link_file[order], link_protocol[order].tolist())
+        files, link_protocol = self._links_by_file
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        starts = numpy.searchsorted(files, rows, side='left').tolist()
+        ends = numpy.searchsorted(files, rows, side='right').tolist()
+        records = self.protocol_records
+        return [tuple(records[k] for k in link_protocol[s:e]) for s, e in zip(starts, ends)]
+
+    def audio(self, rows):
+        """Returns the :py:class:`.AudioRecord` objects of the files in the given
+        rows, or ``None`` for the files that are not indexed"""
+
+        return [AudioRecord(s, r) if r > 0 else None
+                for s, r in zip(self.file_samples[rows].tolist(), self.file_rate[rows].tolist())]
+
+    @property
+    def indexed(self):
+        """Whether the lengths of the audio files are stored in the snapshot"""
+
+        return bool((self.file_rate > 0).any())
+
+    def durations(self, rows):
+        """Returns the durations in seconds of the files in the given rows, or
+        NaN for the files that are not indexed"""
+
+        rate = self.file_rate[rows]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(rate > 0, self.file_samples[rows] / rate.astype(numpy.float64), numpy.nan)
+
+    def restrict(self, rows, min_duration=None, max_duration=None):
+        """Returns the given rows of the files whose duration is within the
+        given bounds; files that are not indexed are dropped"""
+
+        if min_duration is None and max_duration is None:
+            return rows
+        durations = self.durations(rows)
+        with numpy.errstate(invalid='ignore'):
+            mask = ~numpy.isnan(durations)
+            if min_duration is not None:
+                mask &= durations >= min_duration
+            if max_duration is not None:
+                mask &= durations <= max_duration
+        return rows[mask]
+
+    def sort_by_duration(self, rows):
+        """Returns the given (path-sorted) rows sorted by duration, then by path;
+        files that are not indexed come last"""
+
+        return rows[numpy.argsort(self.durations(rows), kind='stable')]
+
+    def select(self, protocols, groups=None, purposes=None, supports=None, genders=None, clients=None):
+        """Returns the rows of the files matching the given (already validated)
+        parameters, with the semantics of :py:meth:`.Database.objects`
+
+        Files linked to several of the given protocols are returned once. The
+        rows are sorted by path.
+        """
+
+        names = self.protocol_name.tolist()
+        offsets = self.protocol_offsets
+        parts = [self.link_file[offsets[k]:offsets[k + 1]] for k, name in enumerate(names) if name in protocols]
+        if not parts:
+            return numpy.zeros((0,), dtype=numpy.int64)
+        rows = numpy.concatenate(parts).astype(numpy.int64)
+
+        # files without a client (-1) are dropped, as by the join of the clients in SQL
+        file_client = self.file_client[rows]
+        mask = file_client >= 0
+        file_client = numpy.maximum(file_client, 0)
+        if groups:
+            mask &= numpy.isin(self.client_group[file_client], _codes(groups, Client.group_choices))
+        if genders:
+            mask &= numpy.isin(self.client_gender[file_client], _codes(genders, Client.gender_choices))
+        if clients:
+            clients = set(clients)
+            mask &= numpy.isin(file_client, [k for k, c in enumerate(self.client_id.tolist()) if c in clients])
+        if supports:
+            mask &= numpy.isin(self.file_attacktype[rows], _codes(supports, File.attacktype_choices))
+        if purposes:
+            mask &= numpy.isin(self.file_purpose[rows], _codes(purposes, File.purpose_choices))
+
+        return numpy.unique(rows[mask])
+
+    def shard(self, rows, shard, balance_by=None):
+        """Returns the rows of the given shard of the (path-sorted) rows of a
+        query, see :py:mod:`bob.db.asvspoof.sharding`"""
+
+        if balance_by == 'duration':
+            return rows[sharding.positions(len(rows), shard, weights=self.durations(rows))]
+        keys = None
+        if balance_by == 'client':
+            keys = self.file_client[rows]
+        elif balance_by == 'attacktype':
+            keys = self.file_attacktype[rows]
+        return rows[sharding.positions(len(rows), shard, keys)]
+
+    def rows_by_id(self, ids):
+        """Returns the rows of the given file ids, or ``-1`` for unknown ids"""
+
+        if self._rows_by_id is None:
+            order = numpy.argsort(self.file_id, kind='stable')
+            self._rows_by_id = (order, self.file_id[order])
+        order, sorted_ids = self._rows_by_id
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        positions = numpy.minimum(numpy.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+        if not len(sorted_ids):
+            return numpy.full(len(ids), -1, dtype=numpy.int64)
+        return numpy.where(sorted_ids[positions] == ids, order[positions], -1)
+
+    def bitmap_values(self, kind):
+        """Returns the values of the given kind (see
+        :py:data:`bob.db.asvspoof.bitmap.KINDS`) with a bitmap"""
+
+        prefix = kind + ':'
+        return [k[len(prefix):] for k in self._bitmaps if k.startswith(prefix)]
+
+    def bitmap(self, kind, values):
+        """Returns the :py:class:`.Bitmap` of the files with any of the given
+        values of the given kind, e.g., ``bitmap('attacktype', ('S1', 'S2'))``"""
+
+        if kind not in KINDS:
+            raise ValueError("Invalid bitmap kind '%s'. Valid values are %s" % (kind, KINDS))
+        bits = numpy.zeros(self.bitmap_bits.shape[1], dtype=numpy.uint8)
+        for value in values:
+            bits |= self.bitmap_bits[self._bitmaps['%s:%s' % (kind, value)]]
+        return Bitmap(bits, self)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Generates synthetic protocol files in the format of the ASVspoof 2015 lists.
+
+The generated files can be fed to ``bob_dbmanage.py asvspoof create`` (or to
+:py:func:`bob.db.asvspoof.create.init_database`) to build a database that does
+not require the real corpus, e.g., for benchmarks, tests and load tests of
+protocols much larger than the original ones.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+
+
+TRAIN_ATTACKS = ('S1', 'S2', 'S3', 'S4', 'S5')
+"""The attacks available in the training and development sets"""
+
+EVAL_ATTACKS = TRAIN_ATTACKS + ('S6', 'S7', 'S8', 'S9', 'S10')
+"""The attacks available in the evaluation set"""
+
+AS_DEVELOPMENT_DIR = os.path.join('ASVspoof2015_development', 'wav')
+"""The directory of the AS training and development samples, as used by
+:py:mod:`bob.db.asvspoof.create`"""
+
+AS_EVALUATION_DIR = os.path.join('eva_release', 'wav')
+"""The directory of the anonymised AS evaluation samples, as used by
+:py:mod:`bob.db.asvspoof.create`"""
+
+
+def _clients(prefix, number):
+    """Returns the client identifiers and genders of a group"""
+
+    genders = ('male', 'female')
+    return [('%s%d' % (prefix, k + 1), genders[k % 2]) for k in range(number)]
+
+
+def _samples(clients, files_per_client, attacks, impostors_per_client=0):
+    """Yields the tuple ``(client, gender, sample name, purpose, attack)`` for
+    all samples of a group of clients"""
+
+    counter = 1000000
+    for client, gender in clients:
+        for k in range(files_per_client):
+            counter += 1
+            yield client, gender, '%s_%d' % (client, counter), 'real', 'human'
+        for attack in attacks:
+            for k in range(files_per_client):
+                counter += 1
+                yield client, gender, '%s_%d' % (client, counter), 'attack', attack
+        for k in range(impostors_per_client):
+            yield client, gender, '%s_A%d' % (client, 100001 + k), 'impostor', 'human'
+
+
+def _cm_lines(samples, samplesdir):
+    """Formats samples in the four column format of the CM and AS protocols"""
+
+    for client, gender, name, purpose, attack in samples:
+        if purpose == 'real':
+            line = '%s %s human human' % (client, name)
+        elif purpose == 'attack':
+            line = '%s %s %s spoof' % (client, name, attack)
+        else:
+            continue
+        yield line, (os.path.join(samplesdir, client, name),)
+
+
+def _asv_lines(samples, gender, samplesdir):
+    """Formats samples of a given gender in the four column format of the ASV
+    protocols"""
+
+    words = {'real': 'genuine', 'attack': 'spoof', 'impostor': 'impostor'}
+    for client, g, name, purpose, attack in samples:
+        if g == gender:
+            line = '%s %s %s %s' % (client, name, words[purpose], attack)
+            yield line, (os.path.join(samplesdir, client, name),)
+
+
+def _enrollment_lines(clients, gender, enrollments, samplesdir):
+    """Formats the enrollment lines of the ASV protocols"""
+
+    for client, g in clients:
+        if g == gender:
+            names = ['%s_EN%d' % (client, 10001 + k) for k in range(enrollments)]
+            yield ','.join([client] + names), tuple(os.path.join(samplesdir, client, k) for k in names)
+
+
+def _as_eval_lines(clients, files_per_client, attacks):
+    """Formats the anonymised one column lines of the AS evaluation list"""
+
+    for k in range(len(clients) * files_per_client * (1 + len(attacks))):
+        name = 'E1%07d' % (k + 1)
+        yield name, (os.path.join(AS_EVALUATION_DIR, name[0:6], name),)
+
+
+class _WavWriter(object):
+    """Creates dummy audio files for the stems of the written protocols by
+    linking (or copying) a few template files of different durations"""
+
+    VARIANTS = 8
+    """The number of different durations if a range of durations is given"""
+
+    def __init__(self, wavdir, duration, rate, link):
+        import wave
+        import struct
+
+        self.wavdir = wavdir
+        self.link = link
+        if not os.path.exists(wavdir):
+            os.makedirs(wavdir)
+
+        durations = [duration]
+        if isinstance(duration, (tuple, list)):
+            shortest, longest = duration
+            durations = [shortest + (longest - shortest) * k / (self.VARIANTS - 1.) for k in range(self.VARIANTS)]
+
+        self.templates = []
+        for index, duration in enumerate(durations):
+            # a quiet sawtooth, so that the files are not all zeros
+            template = os.path.join(wavdir, '.template%d.wav' % index)
+            frames = int(duration * rate)
+            data = struct.pack('<%dh' % frames, *[(k % 200) - 100 for k in range(frames)])
+            f = wave.open(template, 'wb')
+            try:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(rate)
+                f.writeframes(data)
+            finally:
+                f.close()
+            self.templates.append(template)
+
+    def __call__(self, stem):
+        import zlib
+
+        # the duration of a file only depends on its stem
+        template = self.templates[zlib.crc32(stem.encode('utf-8')) % len(self.templates)]
+        path = os.path.join(self.wavdir, stem + '.wav')
+        if os.path.exists(path):
+            return
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if self.link:
+            try:
+                os.link(template, path)
+                return
+            except OSError:
+                # e.g., the file system does not support hard links
+                self.link = False
+        shutil.copyfile(template, path)
+
+    def close(self):
+        for template in self.templates:
+            os.unlink(template)
+
+
+def _write(protodir, filename, entries, wavs=None):
+    """Writes the lines of the given entries into a protocol file, creates the
+    audio files of their stems if requested and returns the number of lines"""
+
+    count = 0
+    with open(os.path.join(protodir, filename), 'wt') as f:
+        for line, stems in entries:
+            f.write(line + '\n')
+            count += 1
+            if wavs is not None:
+                for stem in stems:
+                    wavs(stem)
+    return count
+
+
+def lines_per_client(files_per_client, impostors_per_client=5, train_attacks=TRAIN_ATTACKS,
+                     eval_attacks=EVAL_ATTACKS):
+    """Returns the number of protocol lines generated for each client of
+    :py:func:`write_protocols`, summing over all protocol files and groups"""
+
+    train = files_per_client * (1 + len(train_attacks))
+    evaluation = files_per_client * (1 + len(eval_attacks))
+    # cm_train, as_train, cm_develop, as_develop and as_evaluation
+    retval = 4 * train + evaluation
+    # ASV development and evaluation, and one enrollment line for the clients
+    # of the development and evaluation groups
+    retval += train + evaluation + 2 * impostors_per_client + 2
+    return retval
+
+
+def files_per_client_for(rows, clients, impostors_per_client=5, train_attacks=TRAIN_ATTACKS,
+                         eval_attacks=EVAL_ATTACKS):
+    """Returns the number of files per client for which
+    :py:func:`write_protocols` generates approximately ``rows`` protocol lines
+    in total"""
+
+    fixed = lines_per_client(0, impostors_per_client, train_attacks, eval_attacks)
+    variable = lines_per_client(1, impostors_per_client, train_attacks, eval_attacks) - fixed
+    return max(1, int(round((float(rows) / clients - fixed) / variable)))
+
+
+def write_protocols(protodir, clients=10, files_per_client=10, impostors_per_client=5,
+                    enrollments=5, train_attacks=TRAIN_ATTACKS, eval_attacks=EVAL_ATTACKS,
+                    samplesdir='wav', wavdir=None, duration=0.1, rate=16000, link=True):
+    """Writes a complete set of synthetic protocol files
+
+    The files follow the naming and the line formats of the ASVspoof 2015 lists
+    (``cm_*``, ``ASV_*_enrolment|development|evaluation`` and ``as_*``), so they
+    can be parsed by :py:mod:`bob.db.asvspoof.create`. The lines are streamed to
+    disk, so the size of the protocols is only limited by the disk space. Use
+    :py:func:`files_per_client_for` to scale the protocols to a given number of
+    lines.
+
+    Keyword parameters:
+
+    protodir
+        The directory where to write the protocol files. It is created if it does
+        not exist.
+
+    clients
+        The number of clients in each of the groups ``train``, ``dev`` and
+        ``eval``. Clients alternate between male and female.
+
+    files_per_client
+        The number of genuine samples per client, which is also the number of
+        spoofed samples per client and attack.
+
+    impostors_per_client
+        The number of impostor samples per client in the ASV protocols.
+
+    enrollments
+        The number of enrollment samples per client in the ASV protocols.
+
+    train_attacks
+        The attacks used in the ``train`` and ``dev`` groups.
+
+    eval_attacks
+        The attacks used in the ``eval`` group.
+
+    samplesdir
+        The directory of the CM and ASV samples, which has to match the one given
+        to ``bob_dbmanage.py asvspoof create``.
+
+    wavdir
+        [optional] If set, a dummy audio file is written in this directory for
+        every sample of the protocols, following the paths of
+        :py:meth:`.File.audiofile`.
+
+    duration, rate
+        The duration in seconds and the sampling rate of the dummy audio files.
+        If ``duration`` is a tuple ``(shortest, longest)``, the files last one of
+        a few durations in that range, depending on their stem.
+
+    link
+        If set, the dummy audio files are hard links to a single file, which saves
+        disk space and time for large protocols.
+
+    Returns a dictionary with the number of lines written per protocol file.
+    """
+
+    if not os.path.exists(protodir):
+        os.makedirs(protodir)
+
+    train = _clients('T', clients)
+    dev = _clients('D', clients)
+    evaluation = _clients('E', clients)
+
+    wavs = None if wavdir is None else _WavWriter(wavdir, duration, rate, link)
+
+    def samples(group, attacks, impostors=0):
+        return _samples(group, files_per_client, attacks, impostors)
+
+    counts = {}
+    try:
+        counts['cm_train.trn'] = _write(protodir, 'cm_train.trn',
+                                        _cm_lines(samples(train, train_attacks), samplesdir), wavs)
+        counts['as_train.trn'] = _write(protodir, 'as_train.trn',
+                                        _cm_lines(samples(train, train_attacks), AS_DEVELOPMENT_DIR), wavs)
+        counts['cm_develop.ndx'] = _write(protodir, 'cm_develop.ndx',
+                                          _cm_lines(samples(dev, train_attacks), samplesdir), wavs)
+        counts['as_develop.ndx'] = _write(protodir, 'as_develop.ndx',
+                                          _cm_lines(samples(dev, train_attacks), AS_DEVELOPMENT_DIR), wavs)
+        counts['as_evaluation.ndx'] = _write(protodir, 'as_evaluation.ndx',
+                                             _as_eval_lines(evaluation, files_per_client, eval_attacks), wavs)
+
+        for gender in ('male', 'female'):
+            filename = 'ASV_%s_enrolment.ndx' % gender
+            counts[filename] = _write(protodir, filename, _enrollment_lines(
+                dev + evaluation, gender, enrollments, samplesdir), wavs)
+            filename = 'ASV_%s_development.ndx' % gender
+            counts[filename] = _write(protodir, filename, _asv_lines(
+                samples(dev, train_attacks, impostors_per_client), gender, samplesdir), wavs)
+            filename = 'ASV_%s_evaluation.ndx' % gender
+            counts[filename] = _write(protodir, filename, _asv_lines(
+                samples(evaluation, eval_attacks, impostors_per_client), gender, samplesdir), wavs)
+    finally:
+        if wavs is not None:
+            wavs.close()
+
+    return counts
+
+
+# Driver API
+# ==========
+
+def synthesize(args):
+    """Writes synthetic protocol files for load tests"""
+
+    attacks = tuple(args.attacks)
+    train_attacks = tuple(k for k in attacks if k in TRAIN_ATTACKS)
+    files_per_client = args.files_per_client
+    if args.rows:
+        files_per_client = files_per_client_for(args.rows, args.clients, args.impostors,
+                                                train_attacks, attacks)
+
+    counts = write_protocols(args.protodir, clients=args.clients, files_per_client=files_per_client,
+                             impostors_per_client=args.impostors, train_attacks=train_attacks,
+                             eval_attacks=attacks, samplesdir=args.samplesdir, wavdir=args.wavdir,
+                             duration=args.duration[0] if len(args.duration) == 1 else tuple(args.duration[:2]),
+                             link=not args.copy)
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    for filename in sorted(counts):
+        output.write('%-28s %d\n' % (filename, counts[filename]))
+    output.write('%d lines in total\n' % sum(counts.values()))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "synthesize" can use"""
+
+    from argparse import SUPPRESS
+
+    parser = subparsers.add_parser('synthesize', help=synthesize.__doc__)
+
+    parser.add_argument('-P', '--protodir', required=True, metavar='DIR',
+                        help="the directory where the protocol files are written")
+    parser.add_argument('-c', '--clients', type=int, default=10,
+                        help="the number of clients per group (defaults to %(default)s)")
+    parser.add_argument('-f', '--files-per-client', type=int, default=10,
+                        help="the number of samples per client and attack (defaults to %(default)s)")
+    parser.add_argument('-n', '--rows', type=int, default=None,
+                        help="if given, the number of samples per client is chosen so that approximately "
+                             "this number of protocol lines is written in total")
+    parser.add_argument('-i', '--impostors', type=int, default=5,
+                        help="the number of impostor samples per client (defaults to %(default)s)")
+    parser.add_argument('-a', '--attacks', nargs='+', default=list(EVAL_ATTACKS),
+                        help="the attacks of the evaluation set, the ones among %s are also used for "
+                             "training and development (defaults to %%(default)s)" % (TRAIN_ATTACKS,))
+    parser.add_argument('-D', '--samplesdir', default='wav', metavar='DIR',
+                        help="the relative path of the samples, as given to the 'create' command (defaults to %(default)s)")
+    parser.add_argument('-w', '--wavdir', default=None, metavar='DIR',
+                        help="if given, dummy audio files matching the protocols are written into this directory")
+    parser.add_argument('-t', '--duration', type=float, nargs='+', default=[0.1], metavar='SECONDS',
+                        help="the duration in seconds of the dummy audio files, or the shortest and the longest "
+                             "durations of the files (defaults to %(default)s)")
+    parser.add_argument('--copy', action='store_true', default=False,
+                        help="if set, dummy audio files are copies instead of hard links of a single file")
+    parser.add_argument('--self-test', dest="selftest", default=False,
+                        action='store_true', help=SUPPRESS)
+
+    parser.set_defaults(func=synthesize)  # action
@@ -8,6 +8,9 @@
 """A few checks at the asvspoof attack database.
 """
 
+import io
+import shutil
+import tempfile
 import unittest
 from .query import Database
 from .models import *
@@ -31,9 +34,47 @@ def db_available(test):
     return wrapper
 
 
+def synthetic_database(tmpdir, **kwargs):
+    """Creates a database from synthetic protocols in the given directory and
+    returns the path of its SQLite file"""
+
+    import argparse
+    from .create import create
+    from .synthetic import write_protocols
+
+    protodir = os.path.join(tmpdir, 'protocols')
+    write_protocols(protodir, **kwargs)
+    dbfile = os.path.join(tmpdir, 'db.sql3')
+    create(argparse.Namespace(type='sqlite', files=[dbfile], recreate=True, verbose=0, protodir=protodir,
+                              samplesdir='wav', progress=False, report=None, no_snapshot=False))
+    return dbfile
+
+
+def _write_stem(f, output):
+    """Writes the stem of a file to its output, for the tests of ``map``"""
+
+    with open(output, 'wt') as o:
+        o.write(f.path)
+
+
+def _fail_odd(f, output):
+    """Writes the stem of the files with an even id only"""
+
+    if f.id % 2:
+        raise RuntimeError("odd file")
+    _write_stem(f, output)
+
+
 class ASVspoofDatabaseTest(unittest.TestCase):
     """Performs various tests on the AVspoof attack database."""
 
+    def setUp(self):
+        # a directory for the synthetic databases and the outputs of a test
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
     @db_available
     def queryGroupsProtocolsTypes(self, protocol, purpose, Ntrain, Ndev, Neval):
 
@@ -227,3 +268,895 @@ class ASVspoofDatabaseTest(unittest.TestCase):
     @db_available
     def test23_queryS4AttacksASVFemale(self):
         self.queryAttackType('ASV-female', 'S4', 16100)
+
+    @db_available
+    def test24_attachScores(self):
+
+        db = Database()
+        stems = ['wav/D18/D18_1000001', 'wav/T2/T2_1000001', 'wav/X/unknown']
+        with tempfile.NamedTemporaryFile(mode='wt', suffix='.txt') as f:
+            for i, stem in enumerate(stems):
+                f.write('%s %s %s %f\n' % (stem.split('/')[1], stem.split('/')[1], stem, i))
+            f.flush()
+            scores, unmatched = db.attach_scores(f.name)
+
+        self.assertEqual(unmatched, ['wav/X/unknown'])
+        self.assertEqual(list(scores['id']), db.reverse(stems[:2]))
+        self.assertEqual(list(scores['score']), [0., 1.])
+        self.assertEqual(list(scores['purpose']), ['real', 'real'])
+        self.assertEqual(list(scores['group']), ['dev', 'train'])
+
+    def test25_benchmark(self):
+
+        from .benchmark import run, OBJECT_QUERIES
+        results = run(clients=2, files_per_client=2, repeat=1, sizes=(10,))
+        self.assertEqual(results['parameters']['clients'], 2)
+        for name in ['create', 'reverse.10', 'paths.10', 'dumplist', 'checkfiles', 'import']:
+            self.assertIn(name, results['results'])
+        for protocol, purpose in OBJECT_QUERIES:
+            self.assertIn('objects.%s.%s' % (protocol, purpose), results['results'])
+
+    def test26_synthetic(self):
+
+        import argparse
+        from .create import create
+        from .synthetic import write_protocols, lines_per_client
+
+        counts = write_protocols(os.path.join(self.tmpdir, 'protocols'), clients=2, files_per_client=3,
+                                 wavdir=os.path.join(self.tmpdir, 'wav'))
+        self.assertEqual(sum(counts.values()), 2 * lines_per_client(3))
+
+        dbfile = os.path.join(self.tmpdir, 'db.sql3')
+        report = os.path.join(self.tmpdir, 'report.json')
+        import contextlib
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            create(argparse.Namespace(type='sqlite', files=[dbfile], recreate=True, verbose=0,
+                                      protodir=os.path.join(self.tmpdir, 'protocols'), samplesdir='wav',
+                                      progress=False, report=report, no_snapshot=False))
+        # quiet by default
+        self.assertEqual(output.getvalue(), '')
+        import json
+        with open(report) as f:
+            report = json.load(f)
+        self.assertEqual(report['count'], sum(len(k.protocolfiles) for k in Database(dbfile).session.query(File)))
+        self.assertEqual(len(report['tasks']), len(counts))
+        for phase in ('read', 'parse', 'insert', 'flush', 'commit'):
+            self.assertIn(phase, report['phases'])
+        db = Database(dbfile)
+        self.assertEqual(len(db.objects(protocol='CM', purposes='real', groups='train')), 6)
+        self.assertEqual(len(db.objects(protocol='CM', purposes='attack', groups='dev')), 30)
+        self.assertEqual(len(db.objects(protocol='ASV-male', purposes='attack', groups='eval')), 30)
+        self.assertEqual(len(db.objects(protocol='ASV-female', purposes='enroll')), 10)
+        self.assertEqual(len(db.objects(protocol='AS', purposes='attack', groups='eval')), 66)
+        for f in db.session.query(File):
+            self.assertTrue(os.path.exists(f.audiofile(os.path.join(self.tmpdir, 'wav'))))
+        del db
+
+    @db_available
+    def test27_profiling(self):
+
+        db = Database()
+        self.assertEqual(db.stats(), None)
+        db.profile()
+        f = db.objects(protocol='CM', purposes='attack', groups='train')
+        stats = db.stats()
+        self.assertEqual(stats['calls']['objects']['calls'], 1)
+        self.assertEqual(stats['calls']['objects']['rows'], len(f))
+        self.assertTrue(stats['sql']['count'] > 0)
+        self.assertTrue(stats['statements'])
+        with db.slow_queries(1e6):
+            db.reverse([f[0].path])
+        self.assertEqual(db.stats()['calls']['reverse']['rows'], 1)
+        db.profile(False)
+        self.assertEqual(db.stats(), None)
+
+    def test28_snapshot(self):
+
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2)
+        sql = Database(dbfile)
+        snapshot = Database(dbfile, backend='snapshot')
+        self.assertTrue(snapshot.is_valid())
+        self.assertEqual(sql.protocol_names(), snapshot.protocol_names())
+        self.assertEqual([k.id for k in sql.clients()], [k.id for k in snapshot.clients()])
+
+        def describe(files):
+            return [(k.id, k.path, k.purpose, k.attacktype, k.group, k.client_id) for k in files]
+
+        for protocol in sql.protocol_names():
+            for purpose in sql.purposes():
+                for group in sql.groups():
+                    self.assertEqual(describe(sql.objects(protocol=protocol, purposes=purpose, groups=group)),
+                                     describe(snapshot.objects(protocol=protocol, purposes=purpose, groups=group)))
+
+        files = sql.objects(protocol=sql.protocol_names(), purposes=None)
+        self.assertEqual(sql.paths([k.id for k in files], 'x', '.y'),
+                         snapshot.paths([k.id for k in files], 'x', '.y'))
+        self.assertEqual(sql.reverse([k.path for k in files]), snapshot.reverse([k.path for k in files]))
+        self.assertTrue(all(isinstance(k, FileRecord) for k in snapshot.objects()))
+
+        # files without a client are not returned, as in SQL
+        from bob.db.base.utils import session_try_nolock
+        from .snapshot import Snapshot
+        session = session_try_nolock('sqlite', dbfile)
+        session.query(File).filter(File.id == files[-1].id).update({File.client_id: None})
+        session.commit()
+        orphan = Database(dbfile, backend='snapshot', snapshot=Snapshot.from_session(session))
+        session.close()
+        for groups in (None, 'dev', 'eval'):
+            expected = describe(sql.objects(protocol=sql.protocol_names(), purposes=None, groups=groups))
+            self.assertEqual(describe(orphan.objects(protocol=sql.protocol_names(), purposes=None, groups=groups)),
+                             expected)
+            self.assertFalse(files[-1].id in [k[0] for k in expected])
+
+        # without a stored snapshot, the snapshot backend falls back to SQL
+        from .snapshot import snapshot_files
+        os.unlink(snapshot_files(dbfile)[0])
+        import warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            fallback = Database(dbfile, backend='snapshot')
+        self.assertEqual([k.category for k in caught], [RuntimeWarning])
+        self.assertTrue(fallback.is_valid())
+        self.assertEqual(describe(fallback.objects()), describe(sql.objects()))
+        del sql, snapshot, fallback
+
+    def test29_shared(self):
+
+        from . import shared
+
+        db = Database(synthetic_database(self.tmpdir, clients=2, files_per_client=2))
+        files = db.objects(protocol=('CM', 'AS'), purposes=('real', 'attack'))
+        with db.publish(protocol=('CM', 'AS'), purposes=('real', 'attack')) as table:
+            attached = shared.attach(table.name)
+            self.assertEqual(len(attached), len(files))
+            self.assertEqual([(k.id, k.path, k.purpose) for k in attached.files],
+                             [(k.id, k.path, k.purpose) for k in files])
+            self.assertEqual(attached.files[3].path, files[3].path)
+            attached.close()
+
+        with db.publish() as table:
+            view = table.database()
+            self.assertEqual([k.id for k in view.objects(protocol='ASV-female', purposes='enroll')],
+                             [k.id for k in db.objects(protocol='ASV-female', purposes='enroll')])
+            # the segment is detached once the views into it are deleted
+            import warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', ResourceWarning)
+                self.assertFalse(table.close())
+            del view
+            self.assertTrue(table.close())
+        del db
+
+    def test30_lightweight(self):
+
+
+        db = Database(synthetic_database(self.tmpdir, clients=2, files_per_client=2))
+
+        def describe(files):
+            return [(k.id, k.path, k.purpose, k.attacktype, k.group, k.client_id) for k in files]
+
+        for protocol in db.protocol_names():
+            for purpose in db.purposes():
+                files = db.objects(protocol=protocol, purposes=purpose, lightweight=True)
+                self.assertEqual(describe(db.objects(protocol=protocol, purposes=purpose)), describe(files))
+                self.assertTrue(all(isinstance(k, FileRecord) for k in files))
+
+        record = db.objects(purposes='attack', lightweight=True)[0]
+        self.assertTrue(record.is_attack())
+        self.assertEqual(record.make_path('x', '.y'), os.path.join('x', record.path + '.y'))
+        del db
+
+    def test31_loadRelated(self):
+
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2)
+        sql = Database(dbfile)
+        snapshot = Database(dbfile, backend='snapshot')
+
+        def describe(files):
+            return [(k.id, k.client.id, k.client.gender, k.client.group, tuple(p.name for p in k.protocols))
+                    for k in files]
+
+        query = dict(protocol=sql.protocol_names(), purposes=None)
+        expected = describe(sql.objects(**query))
+        self.assertEqual(expected, describe(sql.objects(load_related=('client', 'protocols'), **query)))
+        self.assertEqual(expected, describe(sql.objects(lightweight=True, load_related=('client', 'protocols'),
+                                                        **query)))
+        self.assertEqual(expected, describe(snapshot.objects(load_related='protocols', **query)))
+        self.assertEqual(sql.objects(lightweight=True, **query)[0].protocols, None)
+        self.assertRaises(ValueError, sql.objects, load_related='scores')
+        del sql, snapshot
+
+    def test32_async(self):
+
+        import asyncio
+        from .aio import AsyncDatabase
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2)
+        db = Database(dbfile)
+        query = dict(protocol=db.protocol_names(), purposes=None)
+        expected = [k.id for k in db.objects(**query)]
+
+        async def run(backend):
+            # more workers than the connections a pool of bob.db.base keeps
+            async with AsyncDatabase(dbfile, backend=backend, workers=8, concurrency=12) as adb:
+                results = await asyncio.gather(*[adb.objects(**query) for k in range(16)])
+                for files in results:
+                    self.assertEqual(expected, [k.id for k in files])
+                self.assertEqual(len(expected), await adb.count(**query))
+                self.assertEqual(db.paths(expected, 'x', '.y'), await adb.paths(expected, 'x', '.y'))
+                self.assertEqual(expected, await adb.reverse([k.path for k in results[0]]))
+                self.assertEqual(expected, [k.id async for k in adb.iterate(batch=7, **query)])
+
+        for backend in ('sql', 'snapshot'):
+            asyncio.run(run(backend))
+
+        async def close():
+            # the event loop keeps running while the pending queries finish
+            import time
+            adb = AsyncDatabase(dbfile, workers=1)
+            slow = asyncio.ensure_future(adb.run(lambda db: time.sleep(0.3)))
+            await asyncio.sleep(0.05)
+            closing = asyncio.ensure_future(adb.aclose())
+            ticks = 0
+            while not closing.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            await slow
+            return ticks
+
+        self.assertTrue(asyncio.run(close()) > 5)
+        del db
+
+    def test33_service(self):
+
+        import threading
+        from .snapshot import Snapshot
+        from .service import Service, make_server
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2)
+        sql = Database(dbfile)
+        service = Service(Snapshot.load(dbfile))
+
+        def describe(files):
+            return [(k.id, k.path, k.purpose, k.attacktype, k.group, k.client.id, k.client.gender)
+                    for k in files]
+
+        for address in (('127.0.0.1', 0), os.path.join(self.tmpdir, 'socket')):
+            server = make_server(service, address)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                if isinstance(address, tuple):
+                    url = 'http://%s:%d' % server.server_address[:2]
+                else:
+                    url = 'unix:' + address
+                remote = Database(backend='remote', address=url)
+                self.assertEqual(sql.protocol_names(), remote.protocol_names())
+                self.assertEqual([k.id for k in sql.clients()], [k.id for k in remote.clients()])
+                for protocol in sql.protocol_names():
+                    for purpose in sql.purposes():
+                        query = dict(protocol=protocol, purposes=purpose)
+                        self.assertEqual(describe(sql.objects(**query)), describe(remote.objects(**query)))
+                        self.assertEqual(sql.count(**query), remote.count(**query))
+
+                files = sql.objects(protocol=sql.protocol_names(), purposes=None)
+                ids = [k.id for k in files]
+                self.assertEqual(sql.paths(ids, 'x', '.y'), remote.paths(ids, 'x', '.y'))
+                self.assertEqual(ids, remote.reverse([k.path for k in files]))
+                # labels repeat once per claimed identity
+                lines = ['c c %s %d\n' % (k.path, i) for i, k in enumerate(files[:3] * 2)]
+                lines.append('c c wav/X/unknown 0\n')
+                expected = sql.attach_scores(io.StringIO(''.join(lines)))
+                self.assertEqual(expected[1], ['wav/X/unknown'])
+                self.assertEqual(list(expected[0]['id']), ids[:3] * 2)
+                self.assertEqual(list(expected[0]['gender']), [k.client.gender for k in files[:3] * 2])
+                for db in (remote, Database(dbfile, backend='snapshot')):
+                    scores, unmatched = db.attach_scores(io.StringIO(''.join(lines)))
+                    self.assertEqual(unmatched, expected[1])
+                    for key in ('id', 'score', 'purpose', 'attacktype', 'group', 'gender'):
+                        self.assertEqual(list(scores[key]), list(expected[0][key]))
+                self.assertEqual([k.name for k in sql.objects()[0].protocols],
+                                 [k.name for k in remote.objects(load_related='protocols')[0].protocols])
+                self.assertRaises(ValueError, remote._remote.count, [{'protocol': 'unknown'}])
+                # a request missing a key is invalid, only unknown endpoints are not found
+                self.assertRaises(ValueError, remote._remote.request, 'count', {})
+                self.assertRaises(IOError, remote._remote.request, 'unknown', {})
+                del remote
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+        del sql
+
+    def test34_shard(self):
+
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=2)
+        sql = Database(dbfile)
+        snapshot = Database(dbfile, backend='snapshot')
+        query = dict(protocol=sql.protocol_names(), purposes=None)
+        files = sql.objects(**query)
+        order = dict((k.id, i) for i, k in enumerate(files))
+
+        for balance_by in (None, 'client', 'attacktype'):
+            shards = []
+            for i in range(4):
+                ids = [k.id for k in sql.objects(shard=(i, 4), balance_by=balance_by, **query)]
+                self.assertEqual(ids, [k.id for k in sql.objects(shard=(i, 4), balance_by=balance_by,
+                                                                 lightweight=True, **query)])
+                self.assertEqual(ids, [k.id for k in snapshot.objects(shard=(i, 4), balance_by=balance_by,
+                                                                      **query)])
+                self.assertEqual(ids, sorted(ids, key=order.get))
+                shards.append(ids)
+            self.assertEqual(sorted(order), sorted(sum(shards, [])))
+            self.assertTrue(max(len(k) for k in shards) - min(len(k) for k in shards) <= 1)
+
+            if balance_by is not None:
+                key = 'client_id' if balance_by == 'client' else balance_by
+                by_id = dict((k.id, getattr(k, key)) for k in files)
+                for value in set(by_id.values()):
+                    counts = [sum(1 for k in ids if by_id[k] == value) for ids in shards]
+                    self.assertTrue(max(counts) - min(counts) <= 1)
+
+        self.assertRaises(ValueError, sql.objects, shard=(4, 4))
+        self.assertRaises(ValueError, sql.objects, balance_by='client')
+        del sql, snapshot
+
+    def test35_audioIndex(self):
+
+        from bob.db.base.utils import session_try_nolock
+        from .snapshot import Snapshot
+        from .audioindex import index_audio
+        from .batching import bucketed_batches
+
+        wavdir = os.path.join(self.tmpdir, 'wav')
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=2, wavdir=wavdir,
+                                    duration=(0.05, 0.4))
+        sql = Database(dbfile)
+        query = dict(protocol=sql.protocol_names(), purposes=None)
+        self.assertRaises(RuntimeError, sql.objects, order_by='duration', **query)
+
+        missing = sql.objects(**query)[0]
+        os.unlink(missing.make_path(wavdir, '.wav'))
+        # the session of Database is read-only, the index command opens a writable one
+        session = session_try_nolock('sqlite', dbfile)
+        failed = index_audio(session, wavdir, workers=2)
+        session.close()
+        self.assertEqual([k[0] for k in failed], [missing.path])
+        # the command fails as long as a file cannot be indexed
+        import argparse
+        from .audioindex import index
+        self.assertEqual(index(argparse.Namespace(type='sqlite', files=[dbfile], directory=wavdir, extension='.wav',
+                                                  jobs=2, reindex=False, progress=False, selftest=True)), 1)
+        self.assertEqual(sql.session.query(AudioInfo).count(), len(sql.objects(**query)) - 1)
+        snapshot = Database(dbfile, backend='snapshot', snapshot=Snapshot.from_session(sql.session))
+
+        def durations(files):
+            return [(k.id, k.audio.duration if k.audio else None) for k in files]
+
+        for arguments in (dict(order_by='duration'), dict(min_duration=0.1, max_duration=0.3),
+                          dict(shard=(1, 3), balance_by='duration', order_by='duration')):
+            arguments.update(query, load_related='audio')
+            files = durations(sql.objects(**arguments))
+            self.assertEqual(files, durations(sql.objects(lightweight=True, **arguments)))
+            self.assertEqual(files, durations(snapshot.objects(**arguments)))
+
+        files = durations(sql.objects(order_by='duration', load_related='audio', **query))
+        self.assertEqual(files[-1], (missing.id, None))
+        self.assertEqual([k[1] for k in files[:-1]], sorted(k[1] for k in files[:-1]))
+        for k in durations(sql.objects(min_duration=0.1, max_duration=0.3, load_related='audio', **query)):
+            self.assertTrue(0.1 <= k[1] <= 0.3)
+
+        totals = [sum(k.audio.duration for k in snapshot.objects(shard=(i, 3), balance_by='duration',
+                                                                 load_related='audio', **query) if k.audio)
+                  for i in range(3)]
+        self.assertTrue(max(totals) - min(totals) <= 0.4)
+
+        files = sql.objects(min_duration=0, load_related='audio', **query)
+        batches = bucketed_batches(files, 8000)
+        self.assertEqual(sorted(k.id for k in files), sorted(k.id for b in batches for k in b))
+        for batch in batches:
+            self.assertTrue(len(batch) == 1 or len(batch) * max(k.audio.samples for k in batch) <= 8000)
+        del sql, snapshot
+
+    def test36_segments(self):
+
+        import wave
+        import numpy
+        from .batching import random_segments
+
+        wavdir = os.path.join(self.tmpdir, 'wav')
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=1, wavdir=wavdir, duration=(0.05, 0.2))
+        db = Database(dbfile, backend='snapshot')
+        files = db.objects(protocol='CM', purposes=None)
+
+        f = wave.open(files[0].make_path(wavdir, '.wav'), 'rb')
+        try:
+            expected = numpy.frombuffer(f.readframes(f.getnframes()), dtype='<i2').astype(numpy.float64)
+        finally:
+            f.close()
+        segment = files[0].load_segment(100, 300, wavdir)
+        self.assertEqual(segment.shape, (1, 300))
+        self.assertTrue((segment[0] == expected[100:400]).all())
+        self.assertEqual(files[0].load_segment(len(expected) - 10, 300, wavdir).shape, (1, 10))
+
+        # the samples of WAVE_FORMAT_EXTENSIBLE files are described by their subformat
+        import struct
+        from .wav import read_segment
+
+        def extensible(filename, tag, samples):
+            guid = struct.pack('<H', tag) + b'\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+            fmt = struct.pack('<HHIIHHHHI', 0xFFFE, 1, 16000, 16000 * samples.itemsize, samples.itemsize,
+                              8 * samples.itemsize, 22, 8 * samples.itemsize, 4) + guid
+            data = samples.tobytes()
+            with open(filename, 'wb') as f:
+                f.write(b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt) + 8 + len(data)) + b'WAVE')
+                f.write(b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data)
+
+        samples = numpy.linspace(-1, 1, 500).astype('<f4')
+        filename = os.path.join(self.tmpdir, 'float.wav')
+        extensible(filename, 3, samples)
+        self.assertTrue((read_segment(filename, 10, 100)[0] == samples[10:110]).all())
+        extensible(filename, 1, (samples * 1000).astype('<i2'))
+        self.assertTrue((read_segment(filename, 0, 500)[0] == (samples * 1000).astype('<i2')).all())
+        extensible(filename, 2, samples)
+        self.assertRaises(ValueError, read_segment, filename, 0, 10)
+
+        length = 1200
+        batch = random_segments(files, length, wavdir, seed=5, workers=3)
+        self.assertEqual(batch.shape, (len(files), 1, length))
+        self.assertTrue((batch == random_segments(files, length, wavdir, seed=5, workers=1)).all())
+        segments = random_segments(files, length, wavdir, seed=5, pad=False)
+        for segment, padded in zip(segments, batch):
+            self.assertTrue(segment.shape[1] <= length)
+            self.assertTrue((padded[:, :segment.shape[1]] == segment).all())
+        del db
+
+    def test37_sampler(self):
+
+        import numpy
+
+        dbfile = synthetic_database(self.tmpdir, clients=4, files_per_client=3)
+        query = dict(protocol='CM', groups='train', purposes=('real', 'attack'))
+        sql = Database(dbfile)
+        sampler = sql.sampler(**query)
+        self.assertTrue(sql.sampler(**query) is sampler)
+        snapshot = Database(dbfile, backend='snapshot').sampler(**query)
+        self.assertEqual(sampler.strata, snapshot.strata)
+        self.assertEqual(sampler.ids.tolist(), snapshot.ids.tolist())
+        self.assertEqual(sampler.stratified(3).tolist(), snapshot.stratified(3).tolist())
+
+        files = sql.objects(**query)
+        self.assertEqual(sampler.ids.tolist(), [k.id for k in files])
+        for stratum, index in zip(sampler.strata, sampler.indexes):
+            self.assertEqual(index.tolist(), [i for i, k in enumerate(files)
+                                              if (k.purpose, k.attacktype) == stratum])
+
+        size = len(files)
+        for strategy in ('shuffle', 'stratified'):
+            epoch = sampler.epoch(7, strategy)
+            self.assertEqual(sorted(epoch.tolist()), list(range(size)))
+            self.assertEqual(epoch.tolist(), sampler.epoch(7, strategy).tolist())
+        # every part of a stratified epoch holds files of all strata
+        epoch = sampler.stratified(1)
+        part = size // min(sampler.counts)
+        for start in range(0, size - part + 1, part):
+            self.assertEqual(len(set(sampler.codes[epoch[start:start + part]].tolist())), len(sampler.strata))
+
+        weights = {('real', 'undefined'): 1., ('attack', 'S1'): 1.}
+        drawn = sampler.weighted(2, weights, size=1000)
+        counts = numpy.bincount(sampler.codes[drawn], minlength=len(sampler.strata))
+        self.assertEqual(counts.sum(), counts[sampler.strata.index(('real', 'undefined'))] +
+                         counts[sampler.strata.index(('attack', 'S1'))])
+        self.assertTrue(400 < counts[sampler.strata.index(('real', 'undefined'))] < 600)
+        drawn = sampler.weighted(2, replace=False)
+        self.assertEqual(sorted(drawn.tolist()), list(range(size)))
+        self.assertRaises(ValueError, sampler.weighted, 2, weights, size=size, replace=False)
+        self.assertRaises(ValueError, sql.sampler, by='path')
+        self.assertEqual([k[0] for k in sql.sampler(by='gender', **query).strata], ['undefined'])
+        del sql
+
+    def test38_query(self):
+
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        for db in (Database(dbfile), Database(dbfile, backend='snapshot')):
+            attacks = db.query().protocol('CM').group('dev', 'eval').purpose('attack')
+            selection = attacks.support(['S1', 'S10'])
+            files = db.objects(protocol='CM', groups=('dev', 'eval'), purposes='attack', support=('S1', 'S10'))
+            self.assertEqual(selection.count(), len(files))
+            self.assertEqual(selection.ids(), [k.id for k in files])
+            self.assertEqual(selection.paths('/data', '.wav'), [k.make_path('/data', '.wav') for k in files])
+            self.assertEqual([k.id for k in selection.page(2, 5)], [k.id for k in files[2:7]])
+            self.assertEqual(selection.page(len(files), 5), [])
+            self.assertEqual([(k.id, k.path, k.client_id) for k in selection.iter(4)],
+                             [(k.id, k.path, k.client_id) for k in files])
+            # refining a selection does not change it
+            self.assertEqual(attacks.count(), db.count(protocol='CM', groups=('dev', 'eval'), purposes='attack'))
+            self.assertEqual(db.query().count(), db.count())
+            self.assertRaises(ValueError, db.query().group, 'test')
+            self.assertRaises(ValueError, db.query().support)
+            self.assertRaises(ValueError, selection.page, -1, 5)
+            del db
+
+    def test39_bulkPaths(self):
+
+        import warnings
+        from .models import make_paths
+
+        self.assertEqual(make_paths(['a/b', 'c'], 'dir', '.wav'), ['dir/a/b.wav', 'dir/c.wav'])
+        self.assertEqual(make_paths(['a/b'], 'dir/'), ['dir/a/b'])
+        self.assertEqual(make_paths([], 'dir', '.wav'), [])
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        for db in (Database(dbfile), Database(dbfile, backend='snapshot')):
+            query = dict(protocol=db.protocol_names(), purposes=('real', 'attack'), groups='dev')
+            files = db.objects(**query)
+            expected = [k.make_path('/data', '.wav') for k in files]
+            self.assertEqual(db.bulk_paths(directory='/data', extension='.wav', **query), expected)
+            self.assertEqual(db.bulk_paths(directory='/data', extension='.wav', output='array', **query).tolist(),
+                             expected)
+            self.assertEqual(db.bulk_paths(directory='/data', extension='.wav', output='buffer', **query),
+                             ''.join(k + '\n' for k in expected))
+            self.assertEqual(db.bulk_paths(output='buffer', protocol='CM', purposes='enroll'), '')
+
+            ids = [files[3].id, files[0].id, -1, files[3].id]
+            expected = [files[3].make_path(), files[0].make_path(), files[3].make_path()]
+            self.assertEqual(db.bulk_paths(ids), expected)
+            self.assertEqual(db.paths(ids, 'd', '.x'), [os.path.join('d', k + '.x') for k in expected])
+            self.assertRaises(TypeError, db.bulk_paths, ids, protocol='CM')
+            self.assertRaises(ValueError, db.bulk_paths, output='set')
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', DeprecationWarning)
+                self.assertEqual(db.files('d', '.wav', **query), dict((k.id, k.make_path('d', '.wav'))
+                                                                       for k in files))
+            del db
+
+    def test40_reverseMatch(self):
+
+        import fnmatch
+        from .pathindex import PathIndex
+
+        index = PathIndex(['b/x1', 'a/y', 'b/x10', 'c', 'b/z/x2'], [1, 2, 3, 4, 5])
+        self.assertEqual(index.directories, ['', 'a/', 'b/', 'b/z/'])
+        self.assertEqual(index.stems(), ['a/y', 'b/x1', 'b/x10', 'b/z/x2', 'c'])
+        self.assertEqual(index.lookup(['c', 'b/x1', 'b/x']), [4, 1])
+        self.assertEqual(index.lookup(['b/x', 'a/'], 'prefix'), [1, 3, 2])
+        self.assertEqual(index.lookup(['b/x?', '*x*'], 'glob'), [1, 1, 3, 5])
+        self.assertRaises(ValueError, index.lookup, ['c'], 'regex')
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        for db in (Database(dbfile), Database(dbfile, backend='snapshot')):
+            files = db.objects(protocol=db.protocol_names(), purposes=None)
+            stems = dict((k.path, k.id) for k in files)
+            directory = files[len(files) // 2].path.rsplit('/', 1)[0] + '/'
+            self.assertEqual(db.reverse([directory], 'prefix'),
+                             [stems[k] for k in sorted(stems) if k.startswith(directory)])
+            pattern = directory + '*1'
+            self.assertEqual(db.reverse([pattern], match='glob'),
+                             [stems[k] for k in sorted(stems) if fnmatch.fnmatchcase(k, pattern)])
+            self.assertEqual(db.reverse([files[3].path, 'missing']), [files[3].id])
+            self.assertRaises(ValueError, db.reverse, [directory], 'like')
+            del db
+
+    def test41_bitmaps(self):
+
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        for db in (Database(dbfile), Database(dbfile, backend='snapshot')):
+            protocols = db.protocol_names()
+            self.assertEqual(db.bitmap_values('protocol'), protocols)
+            for protocol in protocols:
+                for group in db.groups():
+                    expected = set(k.id for k in db.objects(protocol=protocol, groups=group, purposes='attack',
+                                                            support=('S1', 'S2')))
+                    bitmap = (db.bitmap('protocol', protocol) & db.bitmap('group', group) &
+                              db.bitmap('attacktype', ('S1', 'S2')))
+                    self.assertEqual(len(bitmap), len(expected))
+                    self.assertEqual(set(bitmap.ids()), expected)
+                    self.assertEqual(set((bitmap - db.bitmap('attacktype', 'S2')).ids()),
+                                     set(k.id for k in db.objects(protocol=protocol, groups=group,
+                                                                  purposes='attack', support='S1')))
+            everything = db.bitmap('protocol')
+            self.assertEqual(len(everything), len(set(k.id for k in db.objects(protocol=protocols,
+                                                                                  purposes=None))))
+            self.assertEqual(len(~everything), 0)
+            real = db.bitmap('purpose', 'real')
+            self.assertEqual((real | ~real), ~(real & ~real))
+            self.assertEqual(real.paths('/a', '.wav'), sorted(f.make_path('/a', '.wav') for f in real.objects()))
+            self.assertRaises(ValueError, db.bitmap, 'client', 'x')
+            self.assertRaises(ValueError, db.bitmap, 'attacktype', 'S11')
+            del db
+
+    def test42_map(self):
+
+        import sys
+        from .mapping import Command, JOURNAL
+        from .progress import Progress
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        db = Database(dbfile)
+        query = {'protocol': db.protocol_names(), 'purposes': None}
+        files = db.objects(**query)
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        failed = db.map(_fail_odd, query, workers=2, output_dir=output_dir, extension='.txt', chunksize=2)
+        self.assertEqual(sorted(failed), sorted((f.path, 'RuntimeError: odd file') for f in files if f.id % 2))
+
+        # the next run only processes the files that failed
+        progress = Progress()
+        self.assertEqual(db.map(_write_stem, query, workers=2, output_dir=output_dir, extension='.txt',
+                                progress=progress), [])
+        self.assertEqual(progress.total, len([f for f in files if f.id % 2]))
+        for f in files:
+            with open(f.make_path(output_dir, '.txt')) as o:
+                self.assertEqual(o.read(), f.path)
+
+        # without journal, the existing outputs are skipped
+        os.remove(os.path.join(output_dir, JOURNAL))
+        progress = Progress()
+        self.assertEqual(db.map(_write_stem, query, workers=1, output_dir=output_dir, extension='.txt',
+                                progress=progress), [])
+        self.assertEqual(progress.total, 0)
+        for root, dirs, names in os.walk(output_dir):
+            self.assertFalse([k for k in names if '.part' in k])
+
+        command = Command('%s -c "import sys; open(sys.argv[2], \'w\').write(sys.argv[1])" {path} {output}' %
+                          sys.executable)
+        selection = db.query().protocol(db.protocol_names()[0]).purpose('attack')
+        self.assertEqual(db.map(command, selection, workers=2, output_dir=os.path.join(self.tmpdir, 'cmd'),
+                                extension='.txt'), [])
+        for f in selection:
+            with open(f.make_path(os.path.join(self.tmpdir, 'cmd'), '.txt')) as o:
+                self.assertEqual(o.read(), f.path)
+        self.assertRaises(ValueError, db.map, _write_stem, query)
+        del db
+
+    def test43_archive(self):
+
+        import tarfile
+        import zipfile
+        from .archive import Archive
+
+        wavdir = os.path.join(self.tmpdir, 'wav')
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=1, wavdir=wavdir, duration=(0.05, 0.2))
+        db = Database(dbfile, backend='snapshot')
+        files = db.objects(protocol='CM', purposes=None)
+
+        zipname = os.path.join(self.tmpdir, 'corpus.zip')
+        with zipfile.ZipFile(zipname, 'w') as z:
+            for k, f in enumerate(files):
+                z.write(f.make_path(wavdir, '.wav'), f.path + '.wav',
+                        zipfile.ZIP_DEFLATED if k % 2 else zipfile.ZIP_STORED)
+        # the tar archive does not hold the top directories of the stems
+        tarname = os.path.join(self.tmpdir, 'corpus.tar')
+        top = files[0].path.split('/', 1)[0] + '/'
+        with tarfile.open(tarname, 'w') as t:
+            for f in files:
+                t.add(f.make_path(wavdir, '.wav'), f.path[len(top):] + '.wav')
+
+        with Archive(zipname, prefix='other/') as archive:
+            self.assertEqual(archive.stems(), sorted('other/' + f.path for f in files))
+        for filename, prefix in ((zipname, ''), (tarname, top), (zipname, '')):
+            with Archive(filename, prefix=prefix) as archive:
+                self.assertEqual(archive.stems(), sorted(f.path for f in files))
+                for f, audio in zip(files, archive.load_many(files, workers=3)):
+                    self.assertTrue(f in archive)
+                    with open(f.make_path(wavdir, '.wav'), 'rb') as w:
+                        self.assertEqual(archive.read(f), w.read())
+                    self.assertTrue((audio == f.load_segment(0, 1 << 30, wavdir)).all())
+                    self.assertTrue((archive.load_segment(f.path, 100, 300) ==
+                                     f.load_segment(100, 300, wavdir)).all())
+                    self.assertEqual(archive.header(f).samples, audio.shape[1])
+                self.assertFalse('missing' in archive)
+                self.assertRaises(KeyError, archive.load, 'missing')
+            self.assertTrue(os.path.exists(filename + '.index.npz'))
+        del db
+
+    def test44_sharedEngines(self):
+
+        from . import engines
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=1)
+        first = Database(dbfile)
+        second = Database(dbfile)
+        self.assertTrue(first.session.bind is second.session.bind)
+        self.assertFalse(first.session is second.session)
+        protocols = first.protocol_names()
+        count = first.count(protocol=protocols, purposes=None)
+
+        # the engine outlives the objects using it
+        del first
+        self.assertEqual(second.count(protocol=protocols, purposes=None), count)
+
+        first = Database(dbfile)
+        first.profile()
+        second.profile()
+        first.count(protocol=protocols[0])
+        second.count(protocol=protocols[0])
+        self.assertTrue(first.stats()['sql']['count'] >= 1)
+        self.assertTrue(second.stats()['sql']['count'] >= 1)
+
+        # each thread has its own engine
+        import threading
+        other = []
+        thread = threading.Thread(target=lambda: other.append(engines.acquire('sqlite', dbfile).engine))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is first.session.bind)
+
+        # a recreated file gets a new engine, the previous one is left to the objects using it
+        engine = first.session.bind
+        del first
+        synthetic_database(self.tmpdir, clients=3, files_per_client=1)
+        db = Database(dbfile)
+        self.assertFalse(db.session.bind is engine)
+        self.assertTrue(db.count(protocol=protocols, purposes=None) > count)
+        self.assertTrue(second.session.bind is engine)
+        self.assertEqual(len(second.objects(protocol=protocols, purposes=None)), count)
+        del db, second
+        engines.clear()
+
+    def test45_temporaryTables(self):
+
+        from . import query
+
+        chunk = query.ID_CHUNK
+        try:
+            dbfile = synthetic_database(self.tmpdir, clients=6, files_per_client=3)
+            db = Database(dbfile)
+            protocols = db.protocol_names()
+            clients = [k.id for k in db.clients()][1:]
+            parameters = dict(protocol=protocols, purposes=None, clients=clients)
+            expected = [db.objects(**parameters), db.objects(lightweight=True, **parameters),
+                        db.objects(shard=(1, 3), **parameters),
+                        db.objects(shard=(0, 2), lightweight=True, load_related='protocols', **parameters)]
+
+            # the clients and the ids of the shards are loaded into temporary tables
+            query.ID_CHUNK = 2
+            for k in range(2):
+                self.assertEqual(db.objects(**parameters), expected[0])
+                self.assertEqual(db.objects(lightweight=True, **parameters), expected[1])
+                self.assertEqual(db.objects(shard=(1, 3), **parameters), expected[2])
+                shard = db.objects(shard=(0, 2), lightweight=True, load_related='protocols', **parameters)
+                self.assertEqual(shard, expected[3])
+                self.assertEqual([[p.name for p in k.protocols] for k in shard],
+                                 [[p.name for p in k.protocols] for k in expected[3]])
+                self.assertEqual(db.count(**parameters), len(expected[0]))
+                self.assertEqual(db.query().protocol(protocols).purpose(db.purposes()).client(clients).ids(),
+                                 [k.id for k in expected[0]])
+            self.assertEqual(len(db.objects(protocol=protocols, purposes=None, clients=clients[:3])),
+                             len([k for k in expected[0] if k.client_id in clients[:3]]))
+            self.assertRaises(ValueError, db.objects, clients=clients + ['missing'])
+            # the tables are refilled for other values, instead of piling up
+            tables = db.session.connection().info[query.TEMPORARY_TABLES]
+            self.assertEqual(sorted(tables), ['clients', 'shard_ids'])
+            # the tables of a connection shared with another object are refilled too
+            self.assertEqual(db.objects(**parameters), expected[0])
+            other = Database(dbfile)
+            self.assertEqual(len(other.objects(protocol=protocols, purposes=None, clients=clients[2:])),
+                             len([k for k in expected[0] if k.client_id in clients[2:]]))
+            self.assertEqual(db.objects(**parameters), expected[0])
+            del db, other
+        finally:
+            query.ID_CHUNK = chunk
+
+    def test46_dataframe(self):
+
+        from nose.plugins.skip import SkipTest
+        from . import frames
+
+        dbfile = synthetic_database(self.tmpdir, clients=3, files_per_client=3)
+        db = Database(dbfile)
+        protocols = db.protocol_names()
+        parameters = dict(protocol=protocols[1:], purposes=None, groups='eval')
+        files = db.objects(lightweight=True, load_related=('client', 'protocols'), **parameters)
+        expected = [(f.id, f.path, p.name, f.group, f.purpose, f.attacktype, f.client_id, f.client.gender)
+                    for f in files for p in f.protocols if p.name in protocols[1:]]
+        self.assertTrue(expected)
+
+        # the columns of the snapshot are the codes of the same rows
+        snapshot = Database(dbfile, backend='snapshot')
+        columns = frames.from_snapshot(snapshot._snapshot, snapshot._snapshot.select(protocols[1:], ('eval',)),
+                                       protocols[1:])
+        categories = frames.categories(protocols, [k.id for k in db.clients()])
+        rows = list(zip(*[columns[k] if k not in frames.CATEGORICAL else
+                          [categories[k][c] for c in columns[k]] for k in frames.COLUMNS]))
+        self.assertEqual([tuple(k) for k in rows], expected)
+        records = frames.from_rows(frames.from_records(files, protocols[1:]), categories)
+        self.assertEqual(records['protocol'].tolist(), columns['protocol'].tolist())
+
+        try:
+            import pandas
+        except ImportError:
+            raise SkipTest("pandas is not installed")
+        for d in (db, snapshot):
+            frame = d.dataframe(**parameters)
+            self.assertEqual(list(frame.columns), list(frames.COLUMNS))
+            self.assertEqual([tuple(k) for k in frame.itertuples(index=False)], expected)
+            for name in frames.CATEGORICAL:
+                self.assertEqual(str(frame[name].dtype), 'category')
+            chunks = list(d.dataframe(chunksize=4, **parameters))
+            self.assertEqual([len(k) for k in chunks][:-1], [4] * (len(chunks) - 1))
+            merged = pandas.concat(chunks, ignore_index=True)
+            self.assertEqual(merged['path'].tolist(), frame['path'].tolist())
+            self.assertEqual(merged['protocol'].tolist(), frame['protocol'].tolist())
+            self.assertRaises(RuntimeError, d.dataframe, audio=True, **parameters)
+            # a single protocol gives a row per file
+            query = dict(groups='dev', protocol=protocols[0], purposes='attack', support='S1')
+            self.assertEqual(d.dataframe(**query)['id'].tolist(), [k.id for k in d.objects(**query)])
+        del db, snapshot
+
+    def test47_verify(self):
+
+        import argparse
+        from bob.db.base.utils import session_try_nolock
+        from .verify import verify, verify_files
+
+        wavdir = os.path.join(self.tmpdir, 'wav')
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2, wavdir=wavdir)
+        db = Database(dbfile)
+        files = db.objects(protocol=db.protocol_names(), purposes=None)
+        self.assertRaises(RuntimeError, verify_files, db.session, wavdir, against=True)
+
+        # the session of Database is read-only, the hashes are recorded through a writable one
+        session = session_try_nolock('sqlite', dbfile)
+        summary = verify_files(session, wavdir, workers=3, record=True)
+        self.assertEqual((summary.files, summary.failed), (len(files), []))
+        self.assertEqual(db.session.query(ContentHash).count(), len(files))
+        self.assertEqual(verify_files(session, wavdir, record=True).files, 0)
+        session.close()
+
+        # the synthetic audio files are hard links, copies are modified instead
+        changed, truncated, missing = [k.make_path(wavdir, '.wav') for k in files[:3]]
+        for filename in (changed, truncated):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            os.unlink(filename)
+            with open(filename, 'wb') as f:
+                f.write(data[:-2] + b'\x01\x02' if filename == changed else data[:-10])
+        os.unlink(missing)
+        summary = verify_files(db.session, wavdir, workers=2, against=True)
+        self.assertEqual(summary.files, len(files))
+        failed = dict(summary.failed)
+        self.assertEqual(sorted(failed), sorted(k.path for k in files[:3]))
+        self.assertTrue('contents changed' in failed[files[0].path])
+        self.assertTrue('truncated' in failed[files[1].path])
+
+        arguments = argparse.Namespace(type='sqlite', files=[dbfile], directory=wavdir, extension='.wav', jobs=2,
+                                       record=False, against=True, rehash=False, progress=False, selftest=True)
+        self.assertEqual(verify(arguments), 1)
+
+        # the hash of the changed file is recorded again
+        arguments.record = arguments.rehash = True
+        self.assertEqual(verify(arguments), 1)
+        failed = verify_files(db.session, wavdir, against=True).failed
+        self.assertEqual(sorted(k[0] for k in failed), sorted(k.path for k in files[1:3]))
+        del db
+
+    def test48_profilingSessions(self):
+
+        dbfile = synthetic_database(self.tmpdir, clients=2, files_per_client=2)
+        db = Database(dbfile)
+        other = Database(dbfile)
+        # both objects read the file through the same engine
+        self.assertTrue(db.session.bind is other.session.bind)
+        db.profile()
+        other.objects(protocol=other.protocol_names(), purposes=None)
+        self.assertEqual(db.stats()['sql']['count'], 0)
+        f = db.objects(protocol='CM', purposes='real')
+        count = db.stats()['sql']['count']
+        self.assertTrue(count > 0)
+        other.reverse([f[0].path])
+        db.session.commit()
+        other.count(protocol='CM')
+        self.assertEqual(db.stats()['sql']['count'], count)
+        # statements of the following transactions of the session are counted
+        db.count(protocol='CM')
+        self.assertTrue(db.stats()['sql']['count'] > count)
+        db.profile(False)
+        del db, other
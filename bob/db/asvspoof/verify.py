@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Verifies the contents of the audio files of the database.
+
+``checkfiles`` only tests that the audio files exist. The ``verify`` command
+reads them (with several threads, in chunks) and computes the hash of their
+contents, so that files which were truncated or corrupted, e.g., by a bad copy
+of the corpus, are found before they break an experiment:
+
+* ``--record`` stores the size and the hash of each file in the table of
+  :py:class:`.ContentHash`, next to the metadata;
+* ``--against`` compares the files with the recorded hashes and reports the
+  files whose contents changed, e.g., to validate a mirror of the corpus.
+
+WAV files are also checked for a valid header whose size matches the file,
+which finds truncated files even without recorded hashes.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import struct
+import hashlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from .models import File, ContentHash
+from .wav import parse_header
+
+
+ALGORITHM = 'sha1'
+"""The hash of the contents of the files, chosen for its speed, since the
+hashes only detect accidental changes"""
+
+CHUNK = 1 << 20
+"""The number of bytes read at once from a file"""
+
+Summary = collections.namedtuple('Summary', ('files', 'bytes', 'seconds', 'failed'))
+"""The result of :py:func:`verify_files`: the number of ``files`` and of
+``bytes`` read in ``seconds``, and the list of tuples ``(path, error)`` of the
+files that ``failed``"""
+
+
+def _check_header(f, size, name):
+    """Raises a :py:exc:`ValueError` if the WAV file ``f`` of ``size`` bytes has
+    an invalid header, or is shorter than its header announces"""
+
+    parse_header(f, size, name)
+    f.seek(4)
+    announced, = struct.unpack('<I', f.read(4))
+    # files written as streams do not announce their size
+    if announced not in (0, 0xFFFFFFFF) and announced + 8 > size:
+        raise ValueError("File `%s' is truncated, its header announces %d bytes but it has %d" %
+                         (name, announced + 8, size))
+
+
+def hash_file(filename, header=False):
+    """Returns the size and the hexadecimal digest of the contents of a file
+
+    If ``header`` is set, the file is checked to be a valid WAV file first, and
+    a :py:exc:`ValueError` is raised if it is not.
+    """
+
+    digest = hashlib.new(ALGORITHM)
+    buffer = bytearray(CHUNK)
+    view = memoryview(buffer)
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if header:
+            _check_header(f, size, filename)
+            f.seek(0)
+        read = 0
+        while True:
+            # the lock of the interpreter is released while reading and hashing
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+            read += count
+    if read != size:
+        raise IOError("File `%s' changed while it was read" % filename)
+    return size, digest.hexdigest()
+
+
+def _try_hash(task):
+    """Returns the size and the digest of a file and ``None``, or ``None`` and
+    the reason why it could not be read"""
+
+    filename, header = task
+    try:
+        return hash_file(filename, header), None
+    except (IOError, OSError, ValueError) as e:
+        return None, str(e)
+
+
+def hash_files(filenames, workers=16, header=False):
+    """Hashes the given files with a pool of threads
+
+    Yields, in the order of ``filenames``, tuples ``(result, error)`` with
+    either the size and the digest of the file, see :py:func:`hash_file`, or the
+    reason why it could not be read. Only a few files per thread are read ahead,
+    so that ``filenames`` may be a generator over any number of files.
+    """
+
+    window = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for filename in filenames:
+            pending.append(executor.submit(_try_hash, (filename, header)))
+            if len(pending) > window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def verify_files(session, directory, extension='.wav', workers=16, record=False, against=False, rehash=False,
+                 progress=None, batch=1000):
+    """Hashes the audio files of the database, and records or compares their
+    hashes, see the module documentation
+
+    Keyword parameters:
+
+    session
+        A session to the database, which should be writable if ``record`` is
+        set.
+
+    directory
+        The directory containing the audio files.
+
+    extension
+        The extension of the audio files. Files with the extension ``.wav`` are
+        also checked for a valid header.
+
+    workers
+        The number of threads reading files.
+
+    record
+        If set, the hashes of the files are stored in the table of
+        :py:class:`.ContentHash`. Only the files whose hash is not recorded yet
+        are read, unless ``against`` or ``rehash`` is set.
+
+    against
+        If set, all files are read and compared with their recorded hashes.
+        Raises a :py:exc:`RuntimeError` if no hashes were recorded.
+
+    rehash
+        If set with ``record``, the recorded hashes are dropped and all files
+        are hashed again.
+
+    progress
+        [optional] A :py:class:`bob.db.asvspoof.progress.Progress` accounting
+        for the verified files.
+
+    batch
+        The number of rows inserted at once.
+
+    Returns a :py:data:`Summary`. The files that could not be read or are not
+    valid WAV files fail, as well as, with ``against``, the files that differ
+    from their recorded hashes or have none.
+    """
+
+    from sqlalchemy import inspect
+
+    bind = session.get_bind()
+    if against and not (ContentHash.__tablename__ in inspect(bind).get_table_names() and
+                        session.query(ContentHash.file_id).first() is not None):
+        raise RuntimeError("No hashes of the audio files are recorded, run 'bob_dbmanage.py asvspoof verify --record' "
+                           "first")
+    if record:
+        ContentHash.__table__.create(bind, checkfirst=True)
+        if rehash:
+            session.query(ContentHash).delete()
+            session.commit()
+
+    recorded = {}
+    if record or against:
+        recorded = dict((k[0], (k[1], k[2])) for k in session.query(ContentHash.file_id, ContentHash.size,
+                                                                      ContentHash.digest))
+    files = session.query(File.id, File.path).order_by(File.path).all()
+    if record and not against:
+        files = [k for k in files if k[0] not in recorded]
+
+    if progress is not None:
+        progress.total = len(files)
+        progress.begin('verify', directory=directory, record=record, against=against)
+
+    start = time.perf_counter()
+    failed = []
+    rows = []
+    size = 0
+    filenames = (os.path.join(directory, k[1] + extension) for k in files)
+    for (id, path), (result, error) in zip(files, hash_files(filenames, workers, extension == '.wav')):
+        if result is None:
+            failed.append((path, error))
+        else:
+            size += result[0]
+            expected = recorded.get(id)
+            if expected is not None:
+                if against and expected[0] != result[0]:
+                    failed.append((path, 'its size is %d bytes instead of %d' % (result[0], expected[0])))
+                elif against and expected[1] != result[1]:
+                    failed.append((path, 'its contents changed, its %s hash is %s instead of %s' %
+                                   (ALGORITHM, result[1], expected[1])))
+            elif record:
+                rows.append({'file_id': id, 'size': result[0], 'digest': result[1]})
+            elif against:
+                failed.append((path, 'its hash is not recorded'))
+        if len(rows) >= batch:
+            # committed as they come, so that an interrupted run keeps the recorded hashes
+            session.bulk_insert_mappings(ContentHash, rows)
+            session.commit()
+            rows = []
+        if progress is not None:
+            progress.advance()
+    if rows:
+        session.bulk_insert_mappings(ContentHash, rows)
+        session.commit()
+
+    if progress is not None:
+        progress.end()
+    return Summary(len(files), size, time.perf_counter() - start, failed)
+
+
+# Driver API
+# ==========
+
+def verify(args):
+    """Hashes the audio files, to record their hashes or compare them with the recorded ones"""
+
+    from bob.db.base.utils import session_try_nolock
+
+    if args.rehash and not args.record:
+        raise ValueError("Hashes can only be computed again (--rehash) when they are recorded (--record)")
+
+    s = session_try_nolock(args.type, args.files[0])
+
+    progress = None
+    if args.progress:
+        from .progress import Progress
+        progress = Progress(output=sys.stdout, unit='files')
+
+    summary = verify_files(s, args.directory, args.extension, workers=args.jobs, record=args.record,
+                           against=args.against, rehash=args.rehash, progress=progress)
+    s.close()
+
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+        output = null()
+
+    if progress is not None:
+        progress.write()
+    for path, error in summary.failed:
+        output.write('File "%s" is invalid: %s\n' % (os.path.join(args.directory, path + args.extension), error))
+    megabytes = summary.bytes / 1e6
+    output.write('%d files (%.1f MB) verified in %.1f s, %.1f MB/s\n' %
+                 (summary.files, megabytes, summary.seconds, megabytes / summary.seconds if summary.seconds else 0.))
+    if summary.failed:
+        output.write('%d files are invalid\n' % len(summary.failed))
+
+    return 1 if summary.failed else 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "verify" can use"""
+
+    from argparse import SUPPRESS
+
+    parser = subparsers.add_parser('verify', help=verify.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="the directory containing the audio files")
+    parser.add_argument('-e', '--extension', default='.wav',
+                        help="the extension of the audio files (defaults to '%(default)s')")
+    parser.add_argument('-j', '--jobs', type=int, default=16,
+                        help="the number of threads reading the audio files (defaults to %(default)s)")
+    parser.add_argument('-r', '--record', action='store_true', default=False,
+                        help="if set, the hashes of the files which are not recorded yet are stored in the database")
+    parser.add_argument('-a', '--against', action='store_true', default=False,
+                        help="if set, all files are compared with their recorded hashes")
+    parser.add_argument('-R', '--rehash', action='store_true', default=False,
+                        help="if set with --record, the hashes of all files are computed and recorded again")
+    parser.add_argument('-p', '--progress', action='store_true', default=False,
+                        help="if set, the progress and the throughput of the verification are reported")
+    parser.add_argument('--self-test', dest="selftest", default=False,
+                        action='store_true', help=SUPPRESS)
+
+    parser.set_defaults(func=verify)  # action
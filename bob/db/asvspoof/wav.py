@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Reading of the headers of WAV files, without reading their samples, and of
+segments of their samples, without reading the whole files.
+
+Segments are read from a memory map of the samples of the file, so that only
+the pages holding the requested frames are read from disk.
+"""
+
+import os
+import struct
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+
+WavInfo = collections.namedtuple('WavInfo', ('samples', 'rate', 'channels', 'sampwidth', 'offset', 'format'))
+"""The description of the audio of a WAV file: the number of ``samples`` per
+channel, the sampling ``rate`` in Hz, the number of ``channels``, the number
+of bytes per sample (``sampwidth``), the ``offset`` in bytes of the first
+sample in the file and the ``format`` tag of the samples (1 for PCM, 3 for
+floating point), which is the one of the subformat for
+``WAVE_FORMAT_EXTENSIBLE`` files"""
+
+PCM, FLOAT, EXTENSIBLE = 1, 3, 0xFFFE
+"""The format tags of the samples supported by :py:func:`read_segment`, the
+samples of ``EXTENSIBLE`` files are described by their subformat"""
+
+_SUBFORMAT_SUFFIX = b'\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+"""The end of the GUIDs of the subformats of ``WAVE_FORMAT_EXTENSIBLE``, which
+start with the format tag of the samples"""
+
+
+def read_header(filename):
+    """Reads the header of a RIFF/WAVE file
+
+    Only the chunk headers are read, the samples are skipped. If the size of
+    the ``data`` chunk is not set (e.g., for files written as streams) or
+    larger than the file, the samples up to the end of the file are counted.
+
+    Returns a :py:data:`WavInfo`. Raises a :py:exc:`ValueError` if the file is
+    not a valid WAV file.
+    """
+
+    with open(filename, 'rb') as f:
+        return parse_header(f, os.fstat(f.fileno()).st_size, filename)
+
+
+def parse_header(f, size, name):
+    """Reads the header of a RIFF/WAVE file from the file object ``f``, which
+    holds ``size`` bytes, as :py:func:`read_header` does; ``name`` is used in
+    the error messages"""
+
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+        raise ValueError("File `%s' is not a RIFF/WAVE file" % name)
+
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("File `%s' has no data chunk" % name)
+        chunk, length = struct.unpack('<4sI', header)
+
+        if chunk == b'fmt ':
+            data = f.read(length + length % 2)
+            if len(data) < 16:
+                raise ValueError("File `%s' has an invalid format chunk" % name)
+            fmt = struct.unpack('<HHIIHH', data[:16])
+            if fmt[0] == EXTENSIBLE:
+                # the samples are described by the subformat GUID at the end of the extension
+                if len(data) < 40:
+                    raise ValueError("File `%s' has an invalid format chunk" % name)
+                subformat = data[24:40]
+                tag, = struct.unpack('<H', subformat[:2])
+                if subformat[2:] != _SUBFORMAT_SUFFIX or tag not in (PCM, FLOAT):
+                    raise ValueError("File `%s' has an unsupported subformat %s" %
+                                     (name, ''.join('%02x' % k for k in bytearray(subformat))))
+                fmt = (tag,) + fmt[1:]
+
+        elif chunk == b'data':
+            if fmt is None:
+                raise ValueError("File `%s' has no format chunk before its data" % name)
+            format, channels, rate, block_align = fmt[0], fmt[1], fmt[2], fmt[4]
+            if not channels or not block_align:
+                raise ValueError("File `%s' has an invalid format chunk" % name)
+            offset = f.tell()
+            available = size - offset
+            if length in (0, 0xFFFFFFFF) or length > available:
+                length = available
+            return WavInfo(length // block_align, rate, channels, block_align // channels, offset, format)
+
+        else:
+            # chunks are padded to an even size
+            f.seek(length + length % 2, os.SEEK_CUR)
+
+
+def _dtype(info, filename):
+    """Returns the NumPy type of the samples described by ``info``"""
+
+    if info.format == FLOAT and info.sampwidth in (4, 8):
+        return numpy.dtype('<f%d' % info.sampwidth)
+    if info.format == PCM and info.sampwidth in (1, 2, 3, 4):
+        # 8-bit samples are unsigned, 24-bit samples are read as bytes
+        return numpy.dtype({1: 'u1', 2: '<i2', 3: 'u1', 4: '<i4'}[info.sampwidth])
+    raise ValueError("File `%s' has unsupported samples (format %d, %d bytes)" %
+                     (filename, info.format, info.sampwidth))
+
+
+def read_segment(filename, start, length, info=None):
+    """Reads a segment of the samples of a WAV file
+
+    Keyword parameters:
+
+    filename
+        The WAV file to read.
+
+    start
+        The first frame of the segment.
+
+    length
+        The number of frames of the segment. The segment is shorter if the file
+        ends before.
+
+    info
+        [optional] The :py:data:`WavInfo` of the file, if its header was read
+        already.
+
+    Returns a :py:class:`numpy.ndarray` of type ``float64`` with one row per
+    channel, holding the values of the samples as stored (e.g., between -32768
+    and 32767 for 16-bit files) as ``bob.io.audio`` does. 8-bit samples are
+    centered on 0.
+    """
+
+    if info is None:
+        info = read_header(filename)
+    if start < 0 or length < 0:
+        raise ValueError("Invalid segment (%d, %d) of file `%s'" % (start, length, filename))
+    dtype = _dtype(info, filename)
+    start, end, first, last = segment_range(info, start, length)
+    if end == start:
+        return numpy.zeros((info.channels, 0))
+
+    # memory maps start on page boundaries, which numpy handles for us
+    data = numpy.memmap(filename, dtype=dtype, mode='r', offset=first, shape=((last - first) // dtype.itemsize,))
+    try:
+        return decode_samples(data, info, filename)
+    finally:
+        del data
+
+
+def segment_range(info, start, length):
+    """Returns the frames ``(start, end)`` of a segment clipped to the audio
+    described by ``info``, and the positions of its bytes from the start of
+    the file"""
+
+    end = max(min(start + length, info.samples), start)
+    frame = info.channels * info.sampwidth
+    return start, end, info.offset + start * frame, info.offset + end * frame
+
+
+def decode_samples(data, info, name):
+    """Converts the raw samples ``data`` of whole frames, as bytes or as an
+    array of the type of the samples, into an array of type ``float64`` with
+    one row per channel, see :py:func:`read_segment`"""
+
+    dtype = _dtype(info, name)
+    if not isinstance(data, numpy.ndarray):
+        data = numpy.frombuffer(data, dtype=dtype)
+    if info.sampwidth == 3:
+        b = data.reshape(-1, 3).astype(numpy.int32)
+        samples = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)).astype(numpy.float64)
+        samples[samples >= 1 << 23] -= 1 << 24
+    else:
+        samples = data.astype(numpy.float64)
+        if info.sampwidth == 1 and info.format != FLOAT:
+            samples -= 128
+    return samples.reshape(-1, info.channels).T
+
+
+def _random_segment(filename, length, draw, pad):
+    """Reads a segment of ``length`` frames of a WAV file, starting at the
+    fraction ``draw`` of the possible starts"""
+
+    info = read_header(filename)
+    start = int(draw * (max(info.samples - length, 0) + 1))
+    segment = read_segment(filename, start, length, info)
+    if pad and segment.shape[1] < length:
+        segment = numpy.pad(segment, ((0, 0), (0, length - segment.shape[1])), 'constant')
+    return segment
+
+
+def read_random_segments(filenames, length, seed=None, workers=8, pad=False):
+    """Reads a random segment of each of the given WAV files with a pool of
+    threads
+
+    The starts of the segments are drawn uniformly among the possible ones,
+    from a generator seeded with ``seed``, so that the same seed gives the same
+    segments whatever the number of threads.
+
+    Keyword parameters:
+
+    filenames
+        The WAV files to read.
+
+    length
+        The number of frames of the segments. Files shorter than that are read
+        whole.
+
+    seed
+        [optional] The seed of the random generator.
+
+    workers
+        The number of threads reading the files.
+
+    pad
+        If set, segments shorter than ``length`` are padded with zeros, so that
+        all segments have the same shape.
+
+    Returns the list of segments, as returned by :py:func:`read_segment`, in
+    the order of ``filenames``.
+    """
+
+    filenames = list(filenames)
+    draws = numpy.random.RandomState(seed).random_sample(len(filenames)).tolist()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_random_segment, filenames, [length] * len(filenames), draws,
+                                 [pad] * len(filenames)))